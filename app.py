@@ -1,24 +1,43 @@
 import os
+import io
+import csv
 import json
+import atexit
+import fcntl
+import signal
 import hmac
 import hashlib
 import time
+import uuid
 import threading
 from datetime import datetime
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g, stream_with_context
 from flask_cors import CORS
 
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 
-import nexmo
 from dotenv import load_dotenv
 
 import psycopg2
-from psycopg2.pool import SimpleConnectionPool
-import re
-import unicodedata
+
+from breaker import CircuitBreaker
+from journal import import_legacy_json
+from pg_pool import ConnectionPool
+from queue_backend import QueueBackend, open_queue
+from redshift_ingest import RedshiftIngestor
+from sheets import PhoneIndex, SheetShards, SheetsWriter, WorksheetCache, UNSUBSCRIBED
+from workers import KeyedWorkerPool, OutcomeRegistry
+from retry import RetryManager, RetryPolicy
+from sms import SmsDispatcher, SmsStatusStore, verify_vonage_signature
+from sms_events import FORWARD_KEY, SmsEventSink, SmsEventStore, event_record
+from suppression import SuppressionList, SuppressionSync
+from metrics import REGISTRY, MultiProcessCollector, track
+from idempotency import IdempotencyStore, idempotency_key
+from routing import LeadRouter, department_code, file_rules, sheet_rules
+from phones import normalize_phone, sms_capable
+from leads import LeadRecord, normalize_lead, normalize_redshift_row, parse_iso, display_date, norm_txt, utc_iso
 
 
 
@@ -30,6 +49,9 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# Fichiers partagés par les process : files durables, disjoncteurs, métriques
+QUEUE_DIR = os.environ.get("QUEUE_DIR", "queues")
+
 # ============================================================
 # Google Sheets creds env
 # ============================================================
@@ -75,8 +97,17 @@ creds = ServiceAccountCredentials.from_json_keyfile_dict(
 
 client = gspread.authorize(creds)
 
-# Vonage client
-client_vonage = nexmo.Client(key=KEY_VONAGE, secret=KEY_VONAGE_SECRET)
+# Vonage (SMS API REST, via sms.SmsDispatcher)
+VONAGE_BASE_URL = os.environ.get("VONAGE_BASE_URL", "https://rest.nexmo.com")
+VONAGE_RATE = float(os.environ.get("VONAGE_RATE", "30"))  # SMS/s
+VONAGE_SENDERS = int(os.environ.get("VONAGE_SENDERS", "4"))
+# DLR /vonage/dlr : webhooks signés (secret de signature du compte Vonage)
+# ou, à défaut, jeton partagé dans l'URL de callback (?token=...)
+VONAGE_SIGNATURE_SECRET = os.environ.get("VONAGE_SIGNATURE_SECRET", "")
+VONAGE_SIGNATURE_METHOD = os.environ.get("VONAGE_SIGNATURE_METHOD", "md5hash")
+VONAGE_DLR_TOKEN = os.environ.get("VONAGE_DLR_TOKEN", "")
+if not (VONAGE_SIGNATURE_SECRET or VONAGE_DLR_TOKEN):
+    print("⚠️ VONAGE_SIGNATURE_SECRET / VONAGE_DLR_TOKEN absents : /vonage/dlr refuse tout (401)")
 
 
 API_KEY = os.getenv("SENDDO_API_KEY")
@@ -84,6 +115,8 @@ WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
 
 
 def verify_signature(signature, timestamp):
+    if not WEBHOOK_SECRET:
+        return False
     message = f"{API_KEY}{timestamp}{WEBHOOK_SECRET}".encode()
 
     expected = hmac.new(
@@ -92,7 +125,40 @@ def verify_signature(signature, timestamp):
         hashlib.sha256
     ).hexdigest()
 
-    return hmac.compare_digest(expected, signature)
+    return hmac.compare_digest(expected, str(signature))
+
+
+# ============================================================
+# Disjoncteurs par dépendance (Sheets, Vonage, Redshift)
+# ============================================================
+# Circuit ouvert : échec immédiat, l'élément reste dans sa file durable et
+# repasse après la réouverture (RetryManager, sans consommer de tentative).
+# État partagé entre les process via BREAKER_STATE_DIR/<dépendance>.json.
+BREAKER_FAILURE_RATE = float(os.environ.get("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", "5"))
+BREAKER_WINDOW_SECONDS = float(os.environ.get("BREAKER_WINDOW_SECONDS", "30"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "15"))
+BREAKER_STATE_DIR = os.environ.get("BREAKER_STATE_DIR", os.path.join(QUEUE_DIR, "breakers"))
+
+
+def _breaker(name: str, **options) -> CircuitBreaker:
+    return CircuitBreaker(
+        name,
+        failure_rate=BREAKER_FAILURE_RATE,
+        min_calls=BREAKER_MIN_CALLS,
+        window_seconds=BREAKER_WINDOW_SECONDS,
+        open_seconds=BREAKER_OPEN_SECONDS,
+        state_path=os.path.join(BREAKER_STATE_DIR, f"{name}.json"),
+        **options,
+    )
+
+
+breakers = {
+    "sheets": _breaker("sheets"),
+    # numéro refusé par Vonage (erreur définitive) : pas une panne du service
+    "vonage": _breaker("vonage", is_failure=lambda e: getattr(e, "transient", True)),
+    "redshift": _breaker("redshift"),
+}
 
 
 # ============================================================
@@ -107,88 +173,38 @@ REDSHIFT_SCHEMA = os.environ.get("REDSHIFT_SCHEMA", "public")
 REDSHIFT_TABLE = os.environ.get("REDSHIFT_TABLE", "")
 REDSHIFT_SSLMODE = os.environ.get("REDSHIFT_SSLMODE", "require")
 
-redshift_pool = None
-
-
-def _utc_iso() -> str:
-    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-
-
-def _trunc(v, max_len=1000) -> str:
-    if v is None:
-        return ""
-    s = str(v)
-    return s[:max_len]
-
-
-def _first_ip(xff: str) -> str:
-    if not xff:
-        return ""
-    return xff.split(",")[0].strip()
-
-
-def _norm_txt(s: str) -> str:
-    if not s:
-        return ""
-    # enlève les étoiles typeform "*...*"
-    s = s.replace("*", " ")
-    # minuscules + suppression accents
-    s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii")
-    s = s.lower()
-    # espaces clean
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-def parse_iso(dt_str: str) -> str:
-    """
-    Normalise une date ISO reçue (avec ou sans ms), sinon now UTC.
-    Output: YYYY-MM-DDTHH:MM:SSZ
-    """
-    if not dt_str:
-        return _utc_iso()
-    s = str(dt_str)
-    for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"):
-        try:
-            dt = datetime.strptime(s, fmt)
-            return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-        except ValueError:
-            pass
-    return _utc_iso()
-
-
-def _merge_analytics(analytics_str: str, extra: dict) -> str:
-    """
-    analytics est stocké dans Redshift en VARCHAR(1000).
-    On essaie de conserver du JSON et d'ajouter ip/headers côté serveur.
-    """
-    base = {}
-    try:
-        if analytics_str:
-            base = json.loads(analytics_str)
-            if not isinstance(base, dict):
-                base = {"raw": analytics_str}
-    except Exception:
-        base = {"raw": analytics_str}
+# Ingestion par micro-batchs (INSERT multi-lignes, ou S3 + COPY si configuré)
+REDSHIFT_FLUSH_ROWS = int(os.environ.get("REDSHIFT_FLUSH_ROWS", "500"))
+REDSHIFT_FLUSH_SECONDS = float(os.environ.get("REDSHIFT_FLUSH_SECONDS", "2"))
+REDSHIFT_COPY_MIN_ROWS = int(os.environ.get("REDSHIFT_COPY_MIN_ROWS", "200"))
+REDSHIFT_S3_BUCKET = os.environ.get("REDSHIFT_S3_BUCKET", "")
+REDSHIFT_S3_PREFIX = os.environ.get("REDSHIFT_S3_PREFIX", "redshift-staging")
+REDSHIFT_IAM_ROLE = os.environ.get("REDSHIFT_IAM_ROLE", "")
+REDSHIFT_S3_ENDPOINT_URL = os.environ.get("REDSHIFT_S3_ENDPOINT_URL") or None  # MinIO / moto en local
+
+# 1 = insert Redshift dans la requête /leads_pv (comportement historique)
+REDSHIFT_SYNC_INSERT = os.environ.get("REDSHIFT_SYNC_INSERT", "0") == "1"
+
+# Pool thread-safe : attente bornée quand il est plein, validation au checkout,
+# recyclage des vieilles connexions, keepalives TCP (NAT / LB qui coupent en silence)
+REDSHIFT_POOL_MAX = int(os.environ.get("REDSHIFT_POOL_MAX", "5"))
+REDSHIFT_POOL_WAIT_SECONDS = float(os.environ.get("REDSHIFT_POOL_WAIT_SECONDS", "10"))
+REDSHIFT_POOL_MAX_LIFETIME = float(os.environ.get("REDSHIFT_POOL_MAX_LIFETIME", "3600"))
+REDSHIFT_POOL_VALIDATE_AFTER = float(os.environ.get("REDSHIFT_POOL_VALIDATE_AFTER", "30"))
+REDSHIFT_KEEPALIVES_IDLE = int(os.environ.get("REDSHIFT_KEEPALIVES_IDLE", "60"))
+REDSHIFT_KEEPALIVES_INTERVAL = int(os.environ.get("REDSHIFT_KEEPALIVES_INTERVAL", "10"))
+REDSHIFT_KEEPALIVES_COUNT = int(os.environ.get("REDSHIFT_KEEPALIVES_COUNT", "5"))
 
-    base.update(extra)
-    out = json.dumps(base, separators=(",", ":"), ensure_ascii=False)
-    return _trunc(out, 1000)
+redshift_pool = None
+_redshift_pool_lock = threading.Lock()
 
 
 def _redshift_ready() -> bool:
     return bool(REDSHIFT_HOST and REDSHIFT_DB and REDSHIFT_USER and REDSHIFT_PASSWORD and REDSHIFT_TABLE)
 
 
-def _get_redshift_pool():
-    global redshift_pool
-    if redshift_pool is not None:
-        return redshift_pool
-    if not _redshift_ready():
-        return None
-
-    redshift_pool = SimpleConnectionPool(
-        1,
-        5,
+def _redshift_connect():
+    return psycopg2.connect(
         host=REDSHIFT_HOST,
         port=REDSHIFT_PORT,
         dbname=REDSHIFT_DB,
@@ -196,210 +212,421 @@ def _get_redshift_pool():
         password=REDSHIFT_PASSWORD,
         sslmode=REDSHIFT_SSLMODE,
         connect_timeout=5,
+        keepalives=1,
+        keepalives_idle=REDSHIFT_KEEPALIVES_IDLE,
+        keepalives_interval=REDSHIFT_KEEPALIVES_INTERVAL,
+        keepalives_count=REDSHIFT_KEEPALIVES_COUNT,
     )
-    return redshift_pool
 
 
-def normalize_redshift_row(payload: dict, req) -> dict:
-    """
-    Attend le payload React "plat" et retourne une row conforme à la table Redshift.
-    Champs attendus:
-      analytics, civilite, code, code_postal, cohort, email, nom, prenom, telephone, utm_source,
-      user_agent, platform, referer, network_id, browser, date_import, submitted_at,
-      reponse_1, reponse_2, reponse_3
-    """
-    xff = req.headers.get("X-Forwarded-For", "")
-    ip = _first_ip(xff) or (req.remote_addr or "")
-    accept_lang = req.headers.get("Accept-Language", "")
-
-    submitted_at = parse_iso(payload.get("submitted_at") or payload.get("timestamp"))
-    date_import = parse_iso(payload.get("date_import") or submitted_at)
-
-    analytics_in = _trunc(payload.get("analytics", ""), 1000)
-    analytics = _merge_analytics(
-        analytics_in,
-        {
-            "ip": ip,
-            "xff": xff,
-            "accept_language": accept_lang,
-            "server_received_at": _utc_iso(),
-        },
-    )
+def _get_redshift_pool():
+    global redshift_pool
+    if redshift_pool is not None:
+        return redshift_pool
+    if not _redshift_ready():
+        return None
 
-    return {
-        "analytics": analytics,
-        "civilite": _trunc(payload.get("civilite", ""), 1000),
-        "code": _trunc(payload.get("code", ""), 1000),
-        "code_postal": _trunc(payload.get("code_postal", ""), 1000),
-        "cohort": _trunc(payload.get("cohort", ""), 1000),
-        "email": _trunc(payload.get("email", ""), 1000),
-        "nom": _trunc(payload.get("nom", ""), 1000),
-        "prenom": _trunc(payload.get("prenom", ""), 1000),
-        "telephone": _trunc(payload.get("telephone", ""), 1000),
-        "utm_source": _trunc(payload.get("utm_source", ""), 1000),
-        "user_agent": _trunc(payload.get("user_agent") or req.headers.get("User-Agent", ""), 1000),
-        "platform": _trunc(payload.get("platform", ""), 1000),
-        "referer": _trunc(payload.get("referer") or req.headers.get("Referer", ""), 1000),
-        "network_id": _trunc(payload.get("network_id", ""), 1000),
-        "browser": _trunc(payload.get("browser", ""), 1000),
-        "date_import": _trunc(date_import, 1000),
-        "submitted_at": _trunc(submitted_at, 1000),
-        "reponse_1": _trunc(payload.get("reponse_1", ""), 50),
-        "reponse_2": _trunc(payload.get("reponse_2", ""), 50),
-        "reponse_3": _trunc(payload.get("reponse_3", ""), 50),
-    }
+    with _redshift_pool_lock:
+        if redshift_pool is None:
+            redshift_pool = ConnectionPool(
+                _redshift_connect,
+                maxconn=REDSHIFT_POOL_MAX,
+                checkout_timeout=REDSHIFT_POOL_WAIT_SECONDS,
+                max_lifetime=REDSHIFT_POOL_MAX_LIFETIME,
+                validate_after=REDSHIFT_POOL_VALIDATE_AFTER,
+                name="redshift",
+            )
+    return redshift_pool
+
+
+def _redshift_pool_stats() -> dict:
+    pool = redshift_pool
+    return pool.stats() if hasattr(pool, "stats") else {}
+
+
+REDSHIFT_COLUMNS = (
+    "analytics",
+    "civilite",
+    "code",
+    "code_postal",
+    "cohort",
+    "email",
+    "nom",
+    "prenom",
+    "telephone",
+    "utm_source",
+    "user_agent",
+    "platform",
+    "referer",
+    "network_id",
+    "browser",
+    "date_import",
+    "submitted_at",
+    "reponse_1",
+    "reponse_2",
+    "reponse_3",
+)
 
 
 def insert_redshift_row(row: dict):
     """
     Insert dans la table Redshift (elle doit déjà exister).
     """
-    pool = _get_redshift_pool()
-    if pool is None:
-        raise RuntimeError("Redshift not configured (missing REDSHIFT_* env vars)")
-
-    sql = f"""
-        INSERT INTO {REDSHIFT_SCHEMA}.{REDSHIFT_TABLE} (
-            analytics,
-            civilite,
-            code,
-            code_postal,
-            cohort,
-            email,
-            nom,
-            prenom,
-            telephone,
-            utm_source,
-            user_agent,
-            platform,
-            referer,
-            network_id,
-            browser,
-            date_import,
-            submitted_at,
-            reponse_1,
-            reponse_2,
-            reponse_3
-        )
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-    """
-
-    params = (
-        row["analytics"],
-        row["civilite"],
-        row["code"],
-        row["code_postal"],
-        row["cohort"],
-        row["email"],
-        row["nom"],
-        row["prenom"],
-        row["telephone"],
-        row["utm_source"],
-        row["user_agent"],
-        row["platform"],
-        row["referer"],
-        row["network_id"],
-        row["browser"],
-        row["date_import"],
-        row["submitted_at"],
-        row["reponse_1"],
-        row["reponse_2"],
-        row["reponse_3"],
-    )
-
-    conn = pool.getconn()
-    try:
-        conn.autocommit = True
-        with conn.cursor() as cur:
-            cur.execute(sql, params)
-    finally:
-        pool.putconn(conn)
+    redshift_ingestor.insert_rows([row])
 
 
 # ============================================================
 # Redshift persistent queue (retry) (NEW)
 # ============================================================
-REDSHIFT_QUEUE_FILE = "redshift_queue.json"
-_redshift_lock = threading.Lock()
+REDSHIFT_QUEUE_FILE = "redshift_queue.json"  # ancien format (migré au démarrage)
+# journal (fichiers segmentés, défaut) ou sqlite (QUEUE_DIR/queues.db, WAL)
+QUEUE_BACKEND = os.environ.get("QUEUE_BACKEND", "journal")
+# journal : durabilité always (fsync groupé à chaque put), interval, os
+QUEUE_FSYNC = os.environ.get("QUEUE_FSYNC", "always")
+QUEUE_FSYNC_INTERVAL_MS = float(os.environ.get("QUEUE_FSYNC_INTERVAL_MS", "50"))
+# sqlite : bail d'un élément réservé, lignes réservées par transaction, rétention des livrés
+QUEUE_LEASE_SECONDS = float(os.environ.get("QUEUE_LEASE_SECONDS", "300"))
+QUEUE_CLAIM_BATCH = int(os.environ.get("QUEUE_CLAIM_BATCH", "32"))
+QUEUE_RETENTION_SECONDS = float(os.environ.get("QUEUE_RETENTION_SECONDS", "86400"))
+
+
+def _open_queue(name: str) -> QueueBackend:
+    if QUEUE_BACKEND == "sqlite":
+        options = {
+            "lease_seconds": QUEUE_LEASE_SECONDS,
+            "batch_size": QUEUE_CLAIM_BATCH,
+            "retention_seconds": QUEUE_RETENTION_SECONDS,
+        }
+    else:
+        options = {"fsync": QUEUE_FSYNC, "fsync_interval_ms": QUEUE_FSYNC_INTERVAL_MS}
+    return open_queue(QUEUE_BACKEND, QUEUE_DIR, name, **options)
 
-if not os.path.exists(REDSHIFT_QUEUE_FILE):
-    with open(REDSHIFT_QUEUE_FILE, "w") as f:
-        json.dump([], f)
+
+# Workers de traitement des leads + limite globale d'appels Sheets/Vonage simultanés
+LEAD_WORKERS = int(os.environ.get("LEAD_WORKERS", "4"))
+API_CONCURRENCY = int(os.environ.get("API_CONCURRENCY", "4"))
+api_slots = threading.BoundedSemaphore(API_CONCURRENCY)
+_shutting_down = threading.Event()
+
+redshift_queue = _open_queue("redshift")
+import_legacy_json(redshift_queue, REDSHIFT_QUEUE_FILE)
 
 
 def add_to_redshift_queue(row: dict):
-    with _redshift_lock:
-        with open(REDSHIFT_QUEUE_FILE, "r+") as f:
-            rows = json.load(f)
-            rows.append(row)
-            f.seek(0)
-            json.dump(rows, f)
-            f.truncate()
+    redshift_queue.put(row)
 
 
 def pop_from_redshift_queue():
-    with _redshift_lock:
-        with open(REDSHIFT_QUEUE_FILE, "r+") as f:
-            rows = json.load(f)
-            if not rows:
-                return None
-            row = rows.pop(0)
-            f.seek(0)
-            json.dump(rows, f)
-            f.truncate()
-            return row
+    return redshift_queue.get()
+
+
+def _requeue_redshift_rows(rows: list, error):
+    for row in rows:
+        retry_failed("redshift", row, error)
+        redshift_queue.ack(row)   # reprogrammée : plus due par la file
+
+
+def _nack_redshift_rows(rows: list):
+    # reprogrammation impossible : la file représente les rows pas encore ack
+    for row in rows:
+        redshift_queue.nack(row)
+
+
+def _ack_redshift_rows(rows: list):
+    # insérées ou reprogrammées (retry) : retirées de la file durable seulement maintenant
+    for row in rows:
+        redshift_queue.ack(row)
+
+
+redshift_ingestor = RedshiftIngestor(
+    _get_redshift_pool,
+    f"{REDSHIFT_SCHEMA}.{REDSHIFT_TABLE}",
+    REDSHIFT_COLUMNS,
+    flush_rows=REDSHIFT_FLUSH_ROWS,
+    flush_seconds=REDSHIFT_FLUSH_SECONDS,
+    copy_min_rows=REDSHIFT_COPY_MIN_ROWS,
+    s3_bucket=REDSHIFT_S3_BUCKET,
+    s3_prefix=REDSHIFT_S3_PREFIX,
+    iam_role=REDSHIFT_IAM_ROLE,
+    s3_endpoint_url=REDSHIFT_S3_ENDPOINT_URL,
+    on_failure=_requeue_redshift_rows,
+    breaker=breakers["redshift"],
+    on_flushed=_ack_redshift_rows,
+    on_dropped=_nack_redshift_rows,
+)
 
 
 def redshift_worker():
-    while True:
-        row = pop_from_redshift_queue()
-        if not row:
-            time.sleep(5)
+    while not _shutting_down.is_set():
+        # pas de lecture tant que le batch précédent n'est pas parti
+        if redshift_ingestor.pending() >= REDSHIFT_FLUSH_ROWS:
+            time.sleep(0.1)
             continue
-        try:
-            insert_redshift_row(row)
-            print("✅ Redshift insert OK (from queue)")
-        except Exception as e:
-            print("❌ Redshift insert failed (requeue):", str(e))
-            add_to_redshift_queue(row)
-            time.sleep(5)
+        # réveillé dès qu'une row est ajoutée (plus de sleep 5s)
+        row = redshift_queue.get(timeout=1.0)
+        if row:
+            # ack après le flush du batch (_ack_redshift_rows) : un crash ne perd pas le buffer
+            redshift_ingestor.add(row)
 
 
-threading.Thread(target=redshift_worker, daemon=True).start()
 
 
 # ============================================================
 # Old pipeline: persistent queue -> worker -> process_lead
 # ============================================================
-QUEUE_FILE = "leads_queue.json"
-_queue_lock = threading.Lock()
+QUEUE_FILE = "leads_queue.json"  # ancien format (migré au démarrage)
 
-if not os.path.exists(QUEUE_FILE):
-    with open(QUEUE_FILE, "w") as f:
-        json.dump([], f)
+lead_queue = _open_queue("leads")
+import_legacy_json(lead_queue, QUEUE_FILE)
 
 
 def add_to_queue(lead):
-    with _queue_lock:
-        with open(QUEUE_FILE, "r+") as f:
-            leads = json.load(f)
-            leads.append(lead)
-            f.seek(0)
-            json.dump(leads, f)
-            f.truncate()
+    lead_queue.put(lead)
 
 
 def pop_from_queue():
-    with _queue_lock:
-        with open(QUEUE_FILE, "r+") as f:
-            leads = json.load(f)
-            if not leads:
-                return None
-            lead = leads.pop(0)
-            f.seek(0)
-            json.dump(leads, f)
-            f.truncate()
-            return lead
+    return lead_queue.get()
+
+
+# ============================================================
+# SMS : outbox durable -> SmsDispatcher (keep-alive, token bucket)
+# ============================================================
+# Désinscriptions : liste locale persistante, vérifiée avant chaque envoi
+SUPPRESSION_CAPACITY = int(os.environ.get("SUPPRESSION_CAPACITY", "1000000"))
+SUPPRESSION_SYNC_SECONDS = float(os.environ.get("SUPPRESSION_SYNC_SECONDS", "5"))
+
+suppression = SuppressionList(os.path.join(QUEUE_DIR, "suppression.db"), capacity=SUPPRESSION_CAPACITY)
+
+sms_dispatcher = SmsDispatcher(
+    _open_queue("sms"),
+    SmsStatusStore(os.path.join(QUEUE_DIR, "sms_status.db")),
+    KEY_VONAGE,
+    KEY_VONAGE_SECRET,
+    base_url=VONAGE_BASE_URL,
+    rate=VONAGE_RATE,
+    senders=VONAGE_SENDERS,
+    on_failure=lambda message, error: retry_failed("sms", message, error),
+    limiter=api_slots,
+    suppressed=suppression.contains,
+    breaker=breakers["vonage"],
+)
+
+
+def sms_text(prenom: str, nom: str, code: str) -> str:
+    return (
+        f"Bonjour {prenom} {nom}\n"
+        f"Merci pour votre demande\n"
+        f"Un conseiller vous recontactera sous 24h à 48h\n\n"
+        f"Pour sécuriser votre parcours, veuillez noter votre code dossier {code}. "
+        f"Pour annuler votre RDV, cliquez ici: https://cliquez-ici.info/annulationPVML"
+    )
+
+
+def send_sms(phone: str, text: str) -> str:
+    """Enqueue seulement : l'envoi réel est fait par les threads du dispatcher."""
+    return sms_dispatcher.enqueue(phone, text)
+
+
+# ============================================================
+# Événements SMS Senddo : webhook -> file durable -> store local + Redshift
+# ============================================================
+SENDDO_REPLAY_WINDOW_SECONDS = float(os.environ.get("SENDDO_REPLAY_WINDOW_SECONDS", "300"))
+SENDDO_EVENTS_BATCH = int(os.environ.get("SENDDO_EVENTS_BATCH", "500"))
+SENDDO_EVENTS_FLUSH_SECONDS = float(os.environ.get("SENDDO_EVENTS_FLUSH_SECONDS", "0.5"))
+# table Redshift des événements (même schéma) ; vide = store local uniquement
+SENDDO_EVENTS_TABLE = os.environ.get("SENDDO_EVENTS_TABLE", "")
+
+SMS_EVENT_COLUMNS = ("message_id", "event_type", "status", "event_at", "received_at", "payload")
+SMS_WEBHOOK_REQUESTS = REGISTRY.counter("sms_webhook_requests_total", "Appels /sms-webhook par résultat", ("result",))
+
+sms_event_queue = _open_queue("sms_events")
+sms_event_store = SmsEventStore(os.path.join(QUEUE_DIR, "sms_events.db"))
+
+
+def _requeue_sms_event(row: dict):
+    # toujours la file durable : l'ingestor (buffer mémoire) n'existe que
+    # chez le leader, un replay servi par un worker web serait perdu
+    sms_event_queue.put(dict(row, **{FORWARD_KEY: True}))
+
+
+def _requeue_sms_event_rows(rows: list, error):
+    for row in rows:
+        retry_failed("sms_events", row, error)
+
+
+sms_events_ingestor = None
+if SENDDO_EVENTS_TABLE:
+    sms_events_ingestor = RedshiftIngestor(
+        _get_redshift_pool,
+        f"{REDSHIFT_SCHEMA}.{SENDDO_EVENTS_TABLE}",
+        SMS_EVENT_COLUMNS,
+        flush_rows=REDSHIFT_FLUSH_ROWS,
+        flush_seconds=REDSHIFT_FLUSH_SECONDS,
+        on_failure=_requeue_sms_event_rows,
+        breaker=breakers["redshift"],
+    )
+
+sms_event_sink = SmsEventSink(
+    sms_event_queue,
+    sms_event_store,
+    forward=sms_events_ingestor.add if sms_events_ingestor else None,
+    batch_size=SENDDO_EVENTS_BATCH,
+    flush_seconds=SENDDO_EVENTS_FLUSH_SECONDS,
+)
+
+
+def delivery_status(message_id: str):
+    """Dernier événement de livraison connu pour ce message-id (lecture par clé)."""
+    return sms_event_store.status(message_id) if message_id else None
+
+
+def _webhook_timestamp(timestamp):
+    """Timestamp Senddo (secondes ou millisecondes) -> secondes epoch, None si invalide."""
+    try:
+        ts = float(timestamp)
+    except (TypeError, ValueError):
+        return None
+    return ts / 1000 if ts > 1e11 else ts
+
+
+# ============================================================
+# Retries (backoff exponentiel + jitter) et dead-letter
+# ============================================================
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "8"))
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", "5"))
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "3600"))
+# routes d'admin (dead letters, replay, routage, bulk, statut SMS) : fermées sans token
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+if not ADMIN_TOKEN:
+    print("⚠️ ADMIN_TOKEN absent : routes d'admin désactivées (401)")
+
+retry_manager = RetryManager(
+    os.path.join(QUEUE_DIR, "retry"),
+    {
+        "leads": add_to_queue,
+        "redshift": add_to_redshift_queue,
+        "sms": sms_dispatcher.requeue,
+        "sms_events": _requeue_sms_event,
+    },
+    RetryPolicy(RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY),
+)
+
+
+def retry_failed(queue_name: str, item: dict, error):
+    retry_manager.fail(queue_name, item, error)
+
+
+# ============================================================
+# Idempotence : retries des webhooks rejetés avant tout traitement
+# ============================================================
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "100000"))
+# store disque partagé entre workers ; IDEMPOTENCY_DB= (vide) -> mémoire seule
+IDEMPOTENCY_DB = os.environ.get("IDEMPOTENCY_DB", os.path.join(QUEUE_DIR, "idempotency.db"))
+
+idempotency = IdempotencyStore(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_DB or None)
+DUPLICATE_REQUESTS = REGISTRY.counter(
+    "duplicate_requests_total", "Livraisons répétées rejetées (idempotence)", ("route",)
+)
+
+
+def _claim_request(scope: str, data: dict):
+    """Retourne la clé si la requête est nouvelle, None si c'est un doublon."""
+    key = idempotency_key(scope, request.headers.get("Idempotency-Key", ""), data)
+    if idempotency.claim(key):
+        return key
+    DUPLICATE_REQUESTS.inc(route=scope)
+    print(f"↩️ {scope}: livraison répétée ignorée ({key[:60]})")
+    return None
+
+
+# ============================================================
+# Google Sheet + index des téléphones (dédup sans get_all_values par lead)
+# ============================================================
+SHEET_NAME = "Panneaux Solaires - Publiweb"
+SHEET_KEY = os.environ.get("SHEET_KEY", "")  # évite la recherche Drive par titre
+SHEET_METADATA_TTL = float(os.environ.get("SHEET_METADATA_TTL", "600"))
+PHONE_INDEX_RESYNC_SECONDS = float(os.environ.get("PHONE_INDEX_RESYNC_SECONDS", "300"))
+PHONE_INDEX_ARCHIVE_RESYNC_SECONDS = float(os.environ.get("PHONE_INDEX_ARCHIVE_RESYNC_SECONDS", "3600"))
+
+# Shards : "" (tout dans sheet1), month (un onglet par mois) ou rows (un onglet par SHEET_SHARD_MAX_ROWS)
+SHEET_SHARD_BY = os.environ.get("SHEET_SHARD_BY", "")
+SHEET_SHARD_PREFIX = os.environ.get("SHEET_SHARD_PREFIX", "Leads")
+SHEET_SHARD_MAX_ROWS = int(os.environ.get("SHEET_SHARD_MAX_ROWS", "50000"))
+# lignes ajoutées d'un coup quand l'onglet est plein
+SHEET_ROW_CHUNK = int(os.environ.get("SHEET_ROW_CHUNK", "500"))
+
+worksheet_cache = WorksheetCache(client, metadata_ttl=SHEET_METADATA_TTL, breaker=breakers["sheets"])
+
+
+def _get_sheet(tab: str = ""):
+    # handle en cache : aucun appel de découverte sur le chemin chaud
+    return worksheet_cache.get(SHEET_KEY or SHEET_NAME, tab or None)
+
+
+def _load_sheet_values(tab: str = ""):
+    with breakers["sheets"], api_slots, track("sheets", "get_all_values"):
+        return _get_sheet(tab).get_all_values()
+
+
+sheet_shards = SheetShards(
+    _get_sheet,
+    os.path.join(QUEUE_DIR, "sheet_shards.json"),
+    SHEET_SHARD_BY,
+    prefix=SHEET_SHARD_PREFIX,
+    max_rows=SHEET_SHARD_MAX_ROWS,
+    initial_rows=SHEET_ROW_CHUNK,
+    limiter=api_slots,
+    breaker=breakers["sheets"],
+)
+phone_index = PhoneIndex(
+    _load_sheet_values,
+    PHONE_INDEX_RESYNC_SECONDS,
+    shards=sheet_shards,
+    archive_resync_seconds=PHONE_INDEX_ARCHIVE_RESYNC_SECONDS,
+    key=normalize_phone,
+)
+
+# Écritures regroupées : 1 batch_update (valeurs + couleurs) par fenêtre
+SHEETS_BATCH_WINDOW = float(os.environ.get("SHEETS_BATCH_WINDOW", "0.5"))
+SHEETS_WRITE_TIMEOUT = float(os.environ.get("SHEETS_WRITE_TIMEOUT", "60"))
+
+sheets_writer = SheetsWriter(
+    _get_sheet, SHEETS_BATCH_WINDOW, limiter=api_slots, row_chunk=SHEET_ROW_CHUNK, breaker=breakers["sheets"]
+)
+
+
+def write_error(write) -> Exception:
+    """Erreur d'une écriture Sheets échouée (cause chaînée : disjoncteur, API...)."""
+    error = RuntimeError(write.error or "Sheets write failed")
+    error.__cause__ = write.exception
+    return error
+
+
+def _sync_unsubscribes(rows: list) -> list:
+    """K = DÉSINSCRIT + ligne rouge pour un paquet de désinscriptions (une écriture batchée)."""
+    done, pending = [], []
+    for phone, _raw in rows:
+        ref = phone_index.lookup(phone)
+        if ref is None:
+            done.append(phone)   # pas (encore) dans le sheet : process_lead ne lui enverra rien
+            continue
+        pending.append((phone, sheets_writer.submit_status(ref, UNSUBSCRIBED, red=True)))
+    for phone, write in pending:
+        if write.wait(SHEETS_WRITE_TIMEOUT):
+            phone_index.mark_unsubscribed(phone)
+            done.append(phone)
+        else:
+            print("❌ Désinscription non reportée dans le sheet:", phone, write.error or "timeout")
+    return done
+
+
+suppression_sync = SuppressionSync(
+    suppression,
+    _sync_unsubscribes,
+    interval=SUPPRESSION_SYNC_SECONDS,
+    seed=lambda: suppression.add_many(phone_index.unsubscribed(), source="sheet", synced=True),
+)
 
 
 # ============================================================
@@ -417,206 +644,410 @@ clientInterests = {
 
 }
 
+# Règles de routage : ROUTING_FILE (JSON) ou onglet ROUTING_SHEET_TAB,
+# rechargées à chaud ; sinon clientInterests ci-dessus.
+# Cap journalier : {"Client": {"departments": [...], "daily_cap": 20}}
+ROUTING_FILE = os.environ.get("ROUTING_FILE", "")
+ROUTING_SHEET_TAB = os.environ.get("ROUTING_SHEET_TAB", "")
+ROUTING_RELOAD_SECONDS = float(os.environ.get("ROUTING_RELOAD_SECONDS", "60"))
+
+
+def _load_routing_values():
+    with breakers["sheets"], api_slots, track("sheets", "get_all_values"):
+        return worksheet_cache.get(SHEET_KEY or SHEET_NAME, ROUTING_SHEET_TAB).get_all_values()
+
+
+if ROUTING_FILE:
+    _routing_rules = file_rules(ROUTING_FILE)
+elif ROUTING_SHEET_TAB:
+    _routing_rules = sheet_rules(_load_routing_values)
+else:
+    _routing_rules = lambda: clientInterests
+
+lead_router = LeadRouter(
+    _routing_rules,
+    ROUTING_RELOAD_SECONDS,
+    counts_path=os.path.join(QUEUE_DIR, "routing_counts.json"),
+)
+
+
 # ============================================================
-# normalize_lead: accepte payload Typeform OU payload React (NEW)
+# Normalisation des payloads (normalize_lead / normalize_redshift_row : leads.py)
 # ============================================================
-def normalize_lead(data: dict) -> dict:
+def _unbounce_value(v) -> str:
+    # Unbounce envoie parfois chaque champ sous forme de liste
+    if isinstance(v, list):
+        v = v[0] if v else ""
+    return str(v or "")
+
+
+def _unbounce_datetime(date_submitted: str, time_submitted: str) -> str:
+    """date_submitted "YYYY-MM-DD" + time_submitted "HH:MM AM UTC" -> ISO UTC."""
+    raw = f"{date_submitted} {time_submitted.replace('UTC', '')}".strip()
+    for fmt in ("%Y-%m-%d %I:%M %p", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(raw, fmt).strftime("%Y-%m-%dT%H:%M:%SZ")
+        except ValueError:
+            pass
+    return utc_iso()
+
+
+def normalize_unbounce(data: dict) -> dict:
     """
-    Convertit un payload React "plat" vers le format attendu par process_lead
-    (typeform-like: form_response.hidden + form_response.answers).
-    Si déjà au format typeform, renvoie tel quel.
+    Convertit un payload Unbounce vers le même format que normalize_lead
+    (form_response.hidden + form_response.answers).
     """
+    own_raw = _unbounce_value(data.get("êtesvous_propriétaire_ou_locataire_"))
+    prop_raw = _unbounce_value(data.get("vivezvous_en_maison_ou_en_appartement_"))
 
-    # Déjà au format typeform-like
-    if isinstance(data, dict) and "form_response" in data:
-        fr = data.get("form_response", {})
-        fr["submitted_at"] = parse_iso(fr.get("submitted_at"))
-
-        # --- ✅ ADAPTATION NOUVELLE QUESTION "tout en une" ---
-        answers = fr.get("answers", []) or []
-        if len(answers) == 1:
-            raw_label = (answers[0].get("choice", {}) or {}).get("label", "") or ""
-            label = _norm_txt(raw_label)
-
-            type_label = ""
-            own_label = ""
-
-            # habitation
-            if "maison" in label:
-                type_label = "Maison ✅"
-            elif "appartement" in label:
-                type_label = "Appartement ❌"
-
-            # statut
-            # (on cherche propriétaire / locataire)
-            if "propriet" in label:      # couvre proprietaire / propriete...
-                own_label = "Propriétaire ✅"
-            elif "locat" in label:       # couvre locataire / location...
-                own_label = "Locataire ❌"
-
-            # Si on a pu déduire au moins un des 2, on réécrit le format attendu
-            if type_label or own_label:
-                fr["answers"] = [
-                    {"type": "choice", "choice": {"label": type_label}},
-                    {"type": "choice", "choice": {"label": own_label}},
-                ]
-
-        data["form_response"] = fr
-        return data
-
-    # Payload React "plat" (inchangé)
-    prop = data.get("property_type") or data.get("reponse_1") or data.get("propertyType") or ""
-    own = data.get("ownership_status") or data.get("reponse_2") or data.get("ownershipStatus") or ""
-
-    type_label = "Maison ✅" if prop == "house" else "Appartement ❌" if prop == "apartment" else ""
-    own_label = "Propriétaire ✅" if own == "owner" else "Locataire ❌" if own == "tenant" else ""
+    prop = norm_txt(prop_raw)
+    own = norm_txt(own_raw)
+    type_label = "Maison ✅" if "maison" in prop else "Appartement ❌" if "appartement" in prop else prop_raw
+    own_label = "Propriétaire ✅" if "propriet" in own else "Locataire ❌" if "locat" in own else own_raw
+    telephone = _unbounce_value(data.get("telephone"))
 
     return {
         "form_response": {
             "hidden": {
-                "telephone": data.get("telephone", ""),
-                "nom": data.get("nom", ""),
-                "prenom": data.get("prenom", ""),
-                "email": data.get("email", ""),
-                "code_postal": data.get("code_postal", ""),
-                "civilite": data.get("civilite", ""),
-                "utm_source": data.get("utm_source", ""),
-                "code": data.get("code", ""),
+                "telephone": normalize_phone(telephone) or telephone,
+                "nom": _unbounce_value(data.get("nom")),
+                "prenom": _unbounce_value(data.get("prenom")),
+                "email": _unbounce_value(data.get("email")),
+                "code_postal": _unbounce_value(data.get("code_postal")),
+                "civilite": _unbounce_value(data.get("civilite")),
+                "utm_source": _unbounce_value(data.get("utm_source")),
+                "code": _unbounce_value(data.get("code")),
             },
-            "submitted_at": parse_iso(data.get("submitted_at") or data.get("date_import") or data.get("timestamp")),
+            "submitted_at": _unbounce_datetime(
+                _unbounce_value(data.get("date_submitted")), _unbounce_value(data.get("time_submitted"))
+            ),
             "answers": [
                 {"type": "choice", "choice": {"label": type_label}},
                 {"type": "choice", "choice": {"label": own_label}},
             ],
         },
-        "page": data.get("page", ""),
+        "page": _unbounce_value(data.get("page_url")),
+        "source": "unbounce",
     }
+
+
 # ============================================================
 # process_lead (UNCHANGED, juste sécurisation parse date)
 # ============================================================
+# Le worker réserve la ligne et soumet l'écriture au writer batché sans
+# l'attendre : la suite (SMS, résultat ?wait=) tourne dans _lead_written
+# une fois le batch écrit, et le lead n'est ack qu'à ce moment-là.
 def process_lead(lead):
-    global client, client_vonage
-
+    phone = ""
+    next_row = None
+    routed_clients = []
     try:
-        phone = lead["form_response"]["hidden"].get("telephone", "")
-        nom = lead["form_response"]["hidden"].get("nom", "")
-        prenom = lead["form_response"]["hidden"].get("prenom", "")
-        email = lead["form_response"]["hidden"].get("email", "")
-        zipcode = lead["form_response"]["hidden"].get("code_postal", "")
-        civilite = lead["form_response"]["hidden"].get("civilite", "")
-        utm_source = lead["form_response"]["hidden"].get("utm_source", "")
-        code = lead["form_response"]["hidden"].get("code", "")
-        date = lead["form_response"].get("submitted_at", "")
+        # lecture du lead en un passage (format typeform-like des files)
+        rec = LeadRecord.from_queue(lead)
+        nom, prenom, email = rec.nom, rec.prenom, rec.email
+        # E.164, clé de l'index ; les éléments déjà en file peuvent être bruts
+        phone = normalize_phone(rec.telephone)
+        if not phone:
+            _reject_invalid_phone(lead, rec.telephone)
+            return None
+        zipcode, civilite, utm_source, code = rec.code_postal, rec.civilite, rec.utm_source, rec.code
+        type_habitation, statut_habitation = rec.type_label, rec.own_label
 
         # Conversion date -> affichage FR
-        date_iso = parse_iso(date)
-        date_obj = datetime.strptime(date_iso, "%Y-%m-%dT%H:%M:%SZ")
-        date_sliced = date_obj.strftime("%d-%m-%Y %H:%M")
-
-        form_list = lead["form_response"].get("answers", [])
-        type_habitation = ""
-        statut_habitation = ""
-        if len(form_list) > 0:
-            type_habitation = form_list[0].get("choice", {}).get("label", "") or ""
-        if len(form_list) > 1:
-            statut_habitation = form_list[1].get("choice", {}).get("label", "") or ""
+        date_sliced = display_date(parse_iso(rec.submitted_at))
 
         print("Téléphone:", phone, date_sliced)
 
-        # Département
-        if zipcode:
-            if len(zipcode) == 4:
-                zipcode = "0" + zipcode
-            department = zipcode[:2]
-        else:
-            department = ""
-
-        interested_clients = []
-        if department:
-            try:
-                dep_int = int(department)
-                for clients, departments in clientInterests.items():
-                    if dep_int in departments:
-                        interested_clients.append(clients)
-            except Exception:
-                pass
+        # Département ("06", "2A", "971")
+        if zipcode and len(zipcode) == 4:
+            zipcode = "0" + zipcode
+        department = department_code(zipcode)
 
         # Google Sheet
-        sheet = client.open("Panneaux Solaires - Publiweb").sheet1
-        all_values = sheet.get_all_values()
-        existing_phones = [row[5] for row in all_values]  # tel en colonne 6
-
-        if phone not in existing_phones:
-            next_row = len(all_values) + 1
-
-            if next_row > sheet.row_count:
-                sheet.add_rows(1)
-
-            # reset white
-            sheet.format(f"A{next_row}:O{next_row}", {
-                "backgroundColor": {"red": 1.0, "green": 1.0, "blue": 1.0}
-            })
-
-            sheet.update(f"A{next_row}:N{next_row}", [[
-                type_habitation,
-                statut_habitation,
-                civilite,
-                nom,
-                prenom,
-                phone,
-                email,
-                zipcode,
-                code,
-                utm_source,
-                "",
-                date_sliced,
-                department,
-                ", ".join(interested_clients),
-            ]])
-
-            print("Nouveau lead inscrit")
-
-            # Rouge si KO
-            if type_habitation == "Appartement ❌" or statut_habitation == "Locataire ❌":
-                sheet.format(f"A{next_row}:O{next_row}", {
-                    "backgroundColor": {"red": 1.0, "green": 0.0, "blue": 0.0}
-                })
-
-            # SMS si OK
-            if type_habitation != "Appartement ❌" and statut_habitation != "Locataire ❌":
-                response = client_vonage.send_message({
-                    "from": "RDV TEL",
-                    "to": phone,
-                    "text": (
-                        f"Bonjour {prenom} {nom}\n"
-                        f"Merci pour votre demande\n"
-                        f"Un conseiller vous recontactera sous 24h à 48h\n\n"
-                        f"Pour sécuriser votre parcours, veuillez noter votre code dossier {code}. "
-                        f"Pour annuler votre RDV, cliquez ici: https://cliquez-ici.info/annulationPVML"
-                    )
-                })
-                print("Réponse Vonage:", response)
-                if response.get("messages", [{}])[0].get("status") != "0":
-                    print("Erreur SMS:", response.get("messages", [{}])[0].get("error-text", "unknown"))
-        else:
+        next_row = phone_index.reserve(phone)
+
+        if next_row is None:
             print("Lead déjà existant avec ce numéro")
+            lead_outcomes.resolve(lead.get("lead_id"), {"status": "duplicate"})
+            return None
+
+        # une recherche dans l'index de routage (caps journaliers inclus) ;
+        # un lead KO (rouge) n'est routé à personne : il ne consomme pas de cap
+        eligible = type_habitation != "Appartement ❌" and statut_habitation != "Locataire ❌"
+        interested_clients = lead_router.assign(department, count=eligible)
+        routed_clients = interested_clients if eligible else []
+
+        # Ligne A:N + fond A:O (rouge si KO) en une seule écriture batchée
+        write = sheets_writer.submit(next_row, [
+            type_habitation,
+            statut_habitation,
+            civilite,
+            nom,
+            prenom,
+            phone,
+            email,
+            zipcode,
+            code,
+            utm_source,
+            "",
+            date_sliced,
+            department,
+            ", ".join(interested_clients),
+        ], red=not eligible)
+        sms = sms_text(prenom, nom, code) if eligible else None
+        write.add_done_callback(lambda w: _lead_written(lead, phone, routed_clients, sms, w))
+        return write
 
     except Exception as e:
-        print("Erreur process_lead:", str(e))
-        # Réajouter le lead en cas d'échec
-        add_to_queue(lead)
+        _lead_failed(lead, phone, next_row is not None, routed_clients, e)
+        return None
 
 
-def worker():
-    while True:
-        lead = pop_from_queue()
-        if lead:
-            process_lead(lead)
-        else:
-            time.sleep(5)
+def _lead_written(lead, phone: str, routed_clients: list, sms, write):
+    """Suite de process_lead après le batch Sheets : SMS si OK, sinon retry."""
+    if not write.ok:
+        # handle peut-être périmé (onglet supprimé, droits...) : réouverture au prochain appel
+        worksheet_cache.invalidate()
+        _lead_failed(lead, phone, True, routed_clients, write_error(write))
+        return
+    try:
+        phone_index.confirm(phone)
+        print("Nouveau lead inscrit")
+
+        # SMS si OK
+        sms_id = None
+        if sms is not None:
+            if suppression.contains(phone):
+                print("🚫 Numéro désinscrit, pas de SMS:", phone)
+            elif not sms_capable(phone):
+                print("📵 Numéro non mobile, pas de SMS:", phone)
+            else:
+                sms_id = send_sms(phone, sms)
+                print("SMS en file:", sms_id)
+        lead_outcomes.resolve(lead.get("lead_id"), {"status": "registered", "sms_id": sms_id})
+    except Exception as e:
+        _lead_failed(lead, phone, True, routed_clients, e)
+
+
+def _lead_failed(lead, phone: str, reserved: bool, routed_clients: list, error):
+    print("Erreur process_lead:", str(error))
+    if reserved:
+        phone_index.release(phone)
+        lead_router.release(routed_clients)
+    # Retry avec backoff (dead-letter après RETRY_MAX_ATTEMPTS)
+    retry_failed("leads", lead, error)
+    lead_outcomes.resolve(lead.get("lead_id"), {"status": "retrying", "error": str(error)})
+
+
+INVALID_PHONES = REGISTRY.counter("leads_invalid_phone_total", "Leads écartés : téléphone invalide")
+
+
+def _reject_invalid_phone(lead, raw_phone):
+    """Ni Sheets ni SMS ni retry : le lead va directement en dead-letter (corrigeable puis rejouable)."""
+    INVALID_PHONES.inc()
+    print("📵 Téléphone invalide, lead écarté:", repr(raw_phone))
+    retry_manager.dead_letters.add("leads", lead, f"invalid phone: {raw_phone!r}"[:500])
+    lead_outcomes.resolve(lead.get("lead_id"), {"status": "invalid"})
+
+
+# ?wait= sur /webhook_unbounce_pv
+UNBOUNCE_MAX_WAIT = float(os.environ.get("UNBOUNCE_MAX_WAIT", "25"))
+lead_outcomes = OutcomeRegistry(os.path.join(QUEUE_DIR, "outcomes"))
+
+
+def _lead_phone(lead):
+    phone = lead.get("form_response", {}).get("hidden", {}).get("telephone", "")
+    return normalize_phone(phone) or phone
+
+
+# Leads lus et pas encore écrits (en attente d'un batch Sheets) : au plus LEAD_MAX_IN_FLIGHT
+LEAD_MAX_IN_FLIGHT = int(os.environ.get("LEAD_MAX_IN_FLIGHT", "200"))
+
+# LEAD_WORKERS workers, réveillés à l'enqueue ; même téléphone => même worker (ordre conservé)
+lead_pool = KeyedWorkerPool(
+    lead_queue.get, process_lead, _lead_phone, workers=LEAD_WORKERS, name="leads", ack=lead_queue.ack,
+    max_in_flight=LEAD_MAX_IN_FLIGHT,
+)
+
+
+# ============================================================
+# Cycle de vie du process (gunicorn multi-workers ou app.run)
+# ============================================================
+# Chaque process web accepte les requêtes et écrit dans les files ; un seul
+# process (le leader, qui détient un flock) consomme les files. Si le
+# leader meurt, le verrou est libéré et un autre process prend le relais.
+RUN_CONSUMERS = os.environ.get("RUN_CONSUMERS", "1") == "1"
+LEADER_LOCK_FILE = os.path.join(QUEUE_DIR, "consumers.lock")
+LEADER_RETRY_SECONDS = float(os.environ.get("LEADER_RETRY_SECONDS", "5"))
+
+_leader_fd = None
+_consumer_threads = []
+_process_started = False
+
+
+def _try_become_leader() -> bool:
+    global _leader_fd
+    fd = os.open(LEADER_LOCK_FILE, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    _leader_fd = fd
+    return True
+
+
+def is_leader() -> bool:
+    return _leader_fd is not None
+
+
+def start_consumers():
+    """Workers de fond : leads, SMS, Redshift, retries (leader uniquement)."""
+    # offsets relus : l'ancien leader a pu ack (et supprimer des segments) depuis l'ouverture
+    for q in (lead_queue, redshift_queue, sms_dispatcher.outbox, sms_event_queue):
+        q.take_over()
+    retry_manager.delayed.start()
+    redshift_ingestor.start()
+    sms_dispatcher.start()
+    if sms_events_ingestor is not None:
+        sms_events_ingestor.start()
+    sms_event_sink.start()
+    suppression_sync.start()
+    lead_pool.start()
+    t = threading.Thread(target=redshift_worker, name="redshift", daemon=True)
+    t.start()
+    _consumer_threads.append(t)
+    print(f"👑 Consumers démarrés (pid {os.getpid()})")
+
+
+def _leader_election():
+    while not _shutting_down.is_set():
+        if _try_become_leader():
+            start_consumers()
+            return
+        _shutting_down.wait(LEADER_RETRY_SECONDS)
+
+
+def init_process():
+    """
+    À appeler une fois par process : par gunicorn (post_worker_init), ou
+    automatiquement à l'import hors gunicorn (python3 app.py).
+    """
+    global _process_started
+    if _process_started:
+        return
+    _process_started = True
+    sheets_writer.start()
+    metrics_collector.start()
+    if RUN_CONSUMERS:
+        threading.Thread(target=_leader_election, name="leader-election", daemon=True).start()
+
+
+def shutdown_workers(timeout: float = 25):
+    """
+    Arrêt propre : drain des leads en cours, flush Sheets / SMS / Redshift, fsync des files.
+    `timeout` borne l'arrêt complet (une seule échéance partagée par les étapes) :
+    le process doit avoir fermé ses files avant le SIGKILL de gunicorn.
+    """
+    global _leader_fd
+    if _shutting_down.is_set():
+        return
+    _shutting_down.set()
+    deadline = time.monotonic() + timeout
+
+    def remaining() -> float:
+        return max(0.0, deadline - time.monotonic())
+
+    lead_pool.stop(remaining())
+    sheets_writer.stop(remaining())
+    sms_dispatcher.stop(remaining())
+    sms_event_sink.stop(remaining())
+    suppression_sync.stop(remaining())
+    for t in _consumer_threads:
+        t.join(remaining())
+    redshift_ingestor.stop(remaining())
+    if sms_events_ingestor is not None:
+        sms_events_ingestor.stop(remaining())
+    retry_manager.delayed.stop(min(5, remaining()))
+    if redshift_pool is not None:
+        redshift_pool.closeall()
+    metrics_collector.close()
+    for q in (lead_queue, redshift_queue, sms_dispatcher.outbox, sms_event_queue):
+        try:
+            q.close()
+        except Exception as e:
+            print("❌ Fermeture de file:", str(e))
+    if _leader_fd is not None:
+        os.close(_leader_fd)
+        _leader_fd = None
+    print(f"👋 Process {os.getpid()} arrêté proprement")
+
+
+atexit.register(shutdown_workers)
+
+
+# ============================================================
+# Métriques (/metrics, format Prometheus, agrégées sur tous les process)
+# ============================================================
+# Chaque process publie un snapshot dans METRICS_DIR ; celui qui sert
+# /metrics additionne les counters (process arrêtés compris) et prend les
+# gauges au leader, les somme, ou les évalue lui-même si l'état est partagé.
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(QUEUE_DIR, "metrics"))
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_seconds", "Latence des requêtes HTTP", ("route", "method", "status")
+)
+
+REGISTRY.gauge("app_process_info", "Process actifs (1 par process)",
+               lambda: {(os.getpid(), "leader" if is_leader() else "web"): 1}, ("pid", "role"), multiprocess="sum")
+# profondeur lue sur disque (journal : compteurs partagés, sqlite : COUNT)
+REGISTRY.gauge("queue_depth", "Éléments en attente dans les files durables", lambda: {
+    "leads": len(lead_queue),
+    "redshift": len(redshift_queue),
+    "sms": len(sms_dispatcher.outbox),
+    "sms_events": len(sms_event_queue),
+}, ("queue",), multiprocess="local")
+REGISTRY.gauge("retry_delayed", "Éléments en attente de retry (leader)", lambda: len(retry_manager.delayed))
+REGISTRY.gauge("lead_workers_in_flight", "Leads dispatchés non terminés", lead_pool.in_flight)
+REGISTRY.gauge("redshift_buffer_rows", "Rows en buffer avant flush Redshift", redshift_ingestor.pending)
+REGISTRY.gauge("sheets_pending_writes", "Écritures Sheets en attente de batch", sheets_writer.pending,
+               multiprocess="sum")
+REGISTRY.gauge("phone_index_size", "Téléphones dans l'index", lambda: len(phone_index))
+REGISTRY.gauge("suppression_list", "Liste de désinscription (taille, filtre de Bloom)",
+               lambda: dict(suppression.stats(), size=len(suppression)), ("stat",))
+REGISTRY.gauge("circuit_breaker_open", "Disjoncteur ouvert ou en essai (1) / fermé (0)",
+               lambda: {name: int(b.stats()["state"] != "closed") for name, b in breakers.items()}, ("target",),
+               multiprocess="local")
+REGISTRY.gauge("sheet_shard_rows", "Lignes utilisées par onglet de leads", phone_index.shard_rows, ("tab",))
+REGISTRY.gauge("sheets_cache", "Cache des worksheets (hits, misses, refresh, handles)",
+               worksheet_cache.stats, ("stat",), multiprocess="sum")
+REGISTRY.gauge("redshift_pool", "Pool Redshift (max, idle, in_use, waits, timeouts)",
+               _redshift_pool_stats, ("stat",))
+
+metrics_collector = MultiProcessCollector(
+    REGISTRY, METRICS_DIR, interval=METRICS_FLUSH_SECONDS,
+    role=lambda: "leader" if is_leader() else "web",
+)
+
 
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
 
-threading.Thread(target=worker, daemon=True).start()
+
+@app.after_request
+def _observe_request(response):
+    start = getattr(g, "request_start", None)
+    if start is not None:
+        # règle Flask (ex: /sms/<sms_id>) et pas l'URL : cardinalité bornée
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start, route=route, method=request.method, status=response.status_code
+        )
+    return response
 
 
 # ============================================================
@@ -625,7 +1056,77 @@ threading.Thread(target=worker, daemon=True).start()
 
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"ok": True, "time": _utc_iso()}), 200
+    """Liveness + état des disjoncteurs, partagé par tous les process (degraded si une dépendance est coupée)."""
+    states = {name: b.stats() for name, b in breakers.items()}
+    return jsonify({
+        "ok": True,
+        "time": utc_iso(),
+        "degraded": any(st["state"] != "closed" for st in states.values()),
+        "breakers": states,
+    }), 200
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness : 503 pendant l'arrêt pour que le routeur retire le process."""
+    body = {
+        "ready": not _shutting_down.is_set(),
+        "pid": os.getpid(),
+        "role": "leader" if is_leader() else "web",
+        "queues": {
+            "leads": len(lead_queue),
+            "redshift": len(redshift_queue),
+            "sms": len(sms_dispatcher.outbox),
+            "sms_events": len(sms_event_queue),
+        },
+        "sheets_cache": worksheet_cache.stats(),
+        "sheet_shards": phone_index.shard_rows(),
+        "redshift_pool": _redshift_pool_stats(),
+    }
+    return jsonify(body), 200 if body["ready"] else 503
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(metrics_collector.render(), mimetype="text/plain; version=0.0.4")
+
+
+def _admin_authorized() -> bool:
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
+
+
+@app.route("/dead_letters", methods=["GET"])
+def dead_letters():
+    if not _admin_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    queue_name = request.args.get("queue") or None
+    limit = request.args.get("limit", default=100, type=int)
+    entries = retry_manager.dead_letters.list(queue_name, limit)
+    return jsonify({"count": len(entries), "items": entries, "scheduled_retries": len(retry_manager.delayed)}), 200
+
+
+@app.route("/dead_letters/replay", methods=["POST"])
+def dead_letters_replay():
+    """Body: {"ids": [...]} ou {"queue": "leads"|"redshift"} (toutes si vide)."""
+    if not _admin_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    data = request.get_json(silent=True) or {}
+    queue_name = data.get("queue") or None
+    if queue_name and queue_name not in retry_manager.queues:
+        return jsonify({"error": "unknown queue"}), 400
+    replayed = retry_manager.replay(data.get("ids"), queue_name)
+    print(f"🔁 {replayed} dead-letter(s) rejouée(s)")
+    return jsonify({"status": "ok", "replayed": replayed}), 200
+
+
+@app.route("/routing", methods=["GET", "POST"])
+def routing_state():
+    """Règles / caps du routage ; POST force le rechargement des règles."""
+    if not _admin_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    if request.method == "POST":
+        lead_router.reload()
+    return jsonify(lead_router.stats()), 200
 
 
 @app.route("/leads_pv", methods=["POST", "OPTIONS"])
@@ -640,25 +1141,47 @@ def webhook_leads_pv():
             print("❌ /leads_pv: JSON invalide")
             return jsonify({"status": "error", "message": "Invalid JSON"}), 400
 
-        # ---- 1) Redshift (NEW) ----
-        # On essaye d'insérer; si ça échoue, on requeue pour retry.
+        # ---- 0) Idempotence : retry du client -> rien n'est refait ----
+        idem_key = _claim_request("leads_pv", data)
+        if idem_key is None:
+            return jsonify({"status": "success", "message": "Lead déjà reçu.", "duplicate": True}), 200
+
+        # ---- 1) Google Sheets pipeline (OLD) ----
+        # Lead en file d'abord : tant qu'il n'y est pas, rien n'est écrit et
+        # la clé est libérée (le retry du client refait tout).
+        try:
+            lead = normalize_lead(data)
+            print("✅ /leads_pv reçu (hidden):", lead.get("form_response", {}).get("hidden", {}))
+            add_to_queue(lead)
+        except Exception:
+            idempotency.release(idem_key)  # le retry du client sera traité
+            raise
+
+        # ---- 2) Redshift (NEW) ----
+        # Row normalisée une seule fois puis mise en file durable ; la
+        # livraison se fait en tâche de fond (redshift_worker).
+        # REDSHIFT_SYNC_INSERT=1 : insert inline (read-after-write), file si échec.
+        # Le lead est en file : la clé reste prise, un échec part en
+        # dead-letter (rejouable) plutôt que de dupliquer la row au retry.
+        row = None
         try:
             row = normalize_redshift_row(data, request)
-            insert_redshift_row(row)
-            print("✅ Redshift insert OK")
+            if REDSHIFT_SYNC_INSERT:
+                try:
+                    insert_redshift_row(row)
+                    print("✅ Redshift insert OK")
+                except Exception as e:
+                    print("❌ Redshift insert failed (queued):", str(e))
+                    add_to_redshift_queue(row)
+            else:
+                add_to_redshift_queue(row)
         except Exception as e:
-            print("❌ Redshift insert failed (queued):", str(e))
+            print("❌ Redshift queue failed (dead-letter):", str(e))
             try:
-                row = normalize_redshift_row(data, request)
-                add_to_redshift_queue(row)
-            except Exception as e2:
-                print("❌ Redshift queue failed:", str(e2))
-            # Important: on ne bloque pas le pipeline Google Sheet
-
-        # ---- 2) Google Sheets pipeline (OLD) ----
-        lead = normalize_lead(data)
-        print("✅ /leads_pv reçu (hidden):", lead.get("form_response", {}).get("hidden", {}))
-        add_to_queue(lead)
+                if row is not None:
+                    retry_manager.dead_letters.add("redshift", row, f"enqueue failed: {e}"[:500])
+            except Exception as e:
+                print("❌ Redshift dead-letter failed:", str(e))
 
         return jsonify({"status": "success", "message": "Lead reçu."}), 200
 
@@ -667,6 +1190,179 @@ def webhook_leads_pv():
         return jsonify({"status": "error", "message": str(e)}), 500
     
     
+# ============================================================
+# Import en masse (backfill) : NDJSON ou CSV en streaming
+# ============================================================
+BULK_CHUNK = int(os.environ.get("BULK_CHUNK", "200"))
+
+
+def _bulk_records(stream, content_type: str):
+    """(n° de ligne, dict | None) sans charger le body en mémoire."""
+    text = io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="")
+    if "csv" in content_type:
+        reader = csv.DictReader(text)
+        for rec in reader:
+            yield reader.line_num, {(k or "").strip(): (v or "").strip() for k, v in rec.items()}
+        return
+    for n, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield n, json.loads(line)
+        except ValueError:
+            yield n, None
+
+
+def _bulk_prepare(n: int, rec, seen: set):
+    """
+    Résultat de la ligne + (clé, row Redshift, lead) à mettre en file, ou None.
+    Seuls les doublons du body sont écartés ici ; les téléphones déjà dans le
+    sheet sont écartés par le leader (process_lead), sans appel Sheets dans
+    la requête. Toute clé réclamée mais pas mise en file est libérée.
+    """
+    if not isinstance(rec, dict):
+        return {"line": n, "status": "invalid", "error": "JSON invalide"}, None
+    key = idempotency_key("leads_pv", "", rec)
+    if not idempotency.claim(key):
+        return {"line": n, "status": "duplicate", "reason": "already_received"}, None
+    try:
+        try:
+            row = normalize_redshift_row(rec, request)
+            lead = normalize_lead(rec)
+            phone = lead["form_response"]["hidden"].get("telephone", "")
+        except Exception as e:
+            idempotency.release(key)
+            return {"line": n, "status": "invalid", "error": str(e)}, None
+        if not phone:
+            idempotency.release(key)
+            return {"line": n, "status": "invalid", "error": "telephone manquant"}, None
+        if not normalize_phone(phone):
+            idempotency.release(key)
+            return {"line": n, "status": "invalid", "error": "telephone invalide"}, None
+        if phone in seen:
+            idempotency.release(key)
+            return {"line": n, "status": "duplicate", "phone": phone}, None
+    except Exception:
+        idempotency.release(key)
+        raise
+    seen.add(phone)
+    return {"line": n, "status": "queued", "phone": phone}, (key, row, lead)
+
+
+def _bulk_flush(results: list, pending: list, summary: dict):
+    """
+    Un put_many par file (un fsync) pour le paquet, puis les résultats.
+    Leads d'abord : tant qu'ils ne sont pas en file, rien n'est écrit et les
+    clés sont libérées (le retry du client refait tout). Une fois en file,
+    les clés restent prises : un échec Redshift part en dead-letter
+    (rejouable) plutôt que de dupliquer les rows au retry du client.
+    """
+    if pending:
+        try:
+            lead_queue.put_many([lead for _, _, lead in pending])
+        except Exception as e:
+            print("❌ /leads_pv/bulk: enqueue failed:", str(e))
+            for key, _, _ in pending:
+                idempotency.release(key)
+            for r in results:
+                if r["status"] == "queued":
+                    r["status"], r["error"] = "error", str(e)
+        else:
+            try:
+                redshift_queue.put_many([row for _, row, _ in pending])
+            except Exception as e:
+                print("❌ /leads_pv/bulk: Redshift enqueue failed (dead-letter):", str(e))
+                for _, row, _ in pending:
+                    retry_manager.dead_letters.add("redshift", row, f"bulk enqueue failed: {e}"[:500])
+    for r in results:
+        summary["received"] += 1
+        summary[r["status"]] += 1
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in results)
+
+
+@app.route("/leads_pv/bulk", methods=["POST"])
+def webhook_leads_pv_bulk():
+    """
+    Backfill : body NDJSON (1 lead par ligne) ou CSV (en-tête = champs du
+    payload React). Réponse NDJSON streamée : un résultat par ligne puis
+    {"summary": {...}}. Les leads suivent ensuite le pipeline normal.
+    """
+    if not _admin_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    content_type = (request.content_type or "").lower()
+
+    def generate():
+        summary = {"received": 0, "queued": 0, "duplicate": 0, "invalid": 0, "error": 0}
+        seen, results, pending = set(), [], []
+        try:
+            for n, rec in _bulk_records(request.stream, content_type):
+                try:
+                    result, entry = _bulk_prepare(n, rec, seen)
+                except Exception as e:
+                    print(f"❌ /leads_pv/bulk: ligne {n}:", str(e))
+                    result, entry = {"line": n, "status": "error", "error": str(e)}, None
+                results.append(result)
+                if entry is not None:
+                    pending.append(entry)
+                if len(results) >= BULK_CHUNK:
+                    out = _bulk_flush(results, pending, summary)
+                    results, pending = [], []
+                    yield out
+            out = _bulk_flush(results, pending, summary)
+            results, pending = [], []
+            yield out
+        finally:
+            if pending:
+                # flux interrompu (body illisible, client parti) : les lignes
+                # dont la clé est prise partent quand même en file (ou sont libérées)
+                _bulk_flush(results, pending, summary)
+        print("✅ /leads_pv/bulk:", summary)
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def _vonage_dlr_authorized(data) -> bool:
+    if VONAGE_SIGNATURE_SECRET:
+        return verify_vonage_signature(dict(data.items()), VONAGE_SIGNATURE_SECRET, VONAGE_SIGNATURE_METHOD)
+    return bool(VONAGE_DLR_TOKEN) and hmac.compare_digest(request.args.get("token", ""), VONAGE_DLR_TOKEN)
+
+
+@app.route("/vonage/dlr", methods=["GET", "POST"])
+def vonage_delivery_receipt():
+    """Accusés de réception Vonage (messageId, status, err-code), signés ou avec le jeton partagé."""
+    data = request.get_json(silent=True) or request.values
+    if not _vonage_dlr_authorized(data):
+        return jsonify({"error": "unauthorized"}), 401
+    message_id = data.get("messageId") or data.get("message-id") or ""
+    if not message_id:
+        return jsonify({"error": "missing messageId"}), 400
+    sms_dispatcher.delivery_receipt(message_id, data.get("status", ""), data.get("err-code", ""))
+    return ("", 204)
+
+
+@app.route("/sms/<sms_id>", methods=["GET"])
+def sms_status(sms_id):
+    if not _admin_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    entry = sms_dispatcher.status.get(sms_id)
+    if entry is None:
+        return jsonify({"error": "not found"}), 404
+    entry["delivery"] = delivery_status(entry.get("message_id"))
+    return jsonify(entry), 200
+
+
+@app.route("/sms-webhook/status/<message_id>", methods=["GET"])
+def sms_webhook_status(message_id):
+    if not _admin_authorized():
+        return jsonify({"error": "unauthorized"}), 401
+    entry = delivery_status(message_id)
+    if entry is None:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(entry), 200
+
+
 @app.route("/sms-webhook", methods=["POST"])
 def sms_webhook():
     payload = request.get_json(silent=True)
@@ -686,29 +1382,34 @@ def sms_webhook():
 
     if not signature or not timestamp:
         print("❌ Signature ou timestamp manquant")
+        SMS_WEBHOOK_REQUESTS.inc(result="invalid")
         return jsonify({"error": "missing fields"}), 400
 
-    # 🔥 DEBUG SAFE
-    expected_signature = hmac.new(
-        WEBHOOK_SECRET.encode(),
-        f"{API_KEY}{timestamp}{WEBHOOK_SECRET}".encode(),
-        hashlib.sha256
-    ).hexdigest()
-
-    print("EXPECTED:", expected_signature)
-    print("RECEIVED:", signature)
+    event_ts = _webhook_timestamp(timestamp)
+    if event_ts is None:
+        SMS_WEBHOOK_REQUESTS.inc(result="invalid")
+        return jsonify({"error": "invalid timestamp"}), 400
 
-    # 🔐 Vérification signature
+    # 🔐 Vérification signature (un seul HMAC par appel)
     if not verify_signature(signature, timestamp):
         print("❌ Signature invalide")
+        SMS_WEBHOOK_REQUESTS.inc(result="bad_signature")
         return jsonify({"error": "unauthorized"}), 401
 
-    print("\n========= SENDDO WEBHOOK =========")
-    print("TYPE EVENT :", event.get("type"))
-    print("TIMESTAMP :", timestamp)
-    print("DATA :", payload.get("data"))
-    print("=================================\n")
+    # signature valide mais trop vieille (ou dans le futur) : rejeu probable
+    if abs(time.time() - event_ts) > SENDDO_REPLAY_WINDOW_SECONDS:
+        print("❌ Webhook Senddo hors fenêtre:", timestamp)
+        SMS_WEBHOOK_REQUESTS.inc(result="stale")
+        return jsonify({"error": "stale timestamp"}), 401
+
+    try:
+        sms_event_queue.put(event_record(event, payload.get("data"), utc_iso()))
+    except Exception as e:
+        print("❌ Événement SMS non enregistré:", str(e))
+        SMS_WEBHOOK_REQUESTS.inc(result="error")
+        return jsonify({"error": "unavailable"}), 503
 
+    SMS_WEBHOOK_REQUESTS.inc(result="accepted")
     return jsonify({"status": "ok"}), 200
 
 
@@ -721,134 +1422,100 @@ def webhook_leads_desinscription_pv():
         json_tree = request.get_json(silent=True) or {}
         form_list = json_tree.get("form_response", {}).get("answers", [])
 
-        phone_without_plus = None
+        phone = None
         for answer in form_list:
             if answer.get("type") == "phone_number":
-                phone_with_plus = answer.get("phone_number", "")
-                phone_without_plus = phone_with_plus.lstrip("+")
+                phone = answer.get("phone_number", "")
                 break
 
-        if phone_without_plus is None:
+        if phone is None:
             return "Phone number not found in the form responses", 400
-
-        sheet = client.open("Panneaux Solaires - Publiweb").sheet1
-        all_values = sheet.get_all_values()
-
-        row_number = None
-        for index, row in enumerate(all_values):
-            if len(row) > 5 and row[5] == phone_without_plus:
-                row_number = index + 1
-                break
-
-        if row_number:
-            sheet.update_cell(row_number, 11, "DÉSINSCRIT")
-            sheet.format(f"A{row_number}:O{row_number}", {
-                "backgroundColor": {"red": 1.0, "green": 0.0, "blue": 0.0}
-            })
-            return "Done"
-        else:
-            print("Numéro à désinscrire non trouvé")
-            return "Numéro à désinscrire non trouvé"
+        if not normalize_phone(phone):
+            print("❌ Désinscription: numéro invalide", repr(phone))
+            return "Invalid phone number", 400
+
+        # liste locale : effet immédiat sur les envois, report dans le sheet en tâche de fond
+        if suppression.add(phone):
+            print("🚫 Désinscription enregistrée:", phone)
+            suppression_sync.notify()
+        return "Done"
     else:
         return "Not there"
 
 
 @app.route("/webhook_unbounce_pv", methods=["POST"])
 def webhook_unbounce_pv():
+    """
+    Enqueue le lead (même pipeline que /leads_pv) et répond tout de suite.
+    ?wait=<secondes> : attend le résultat (doublon / enregistrement / SMS).
+    """
     if not request.is_json:
         return jsonify({"status": "error", "message": "Erreur de format de requête"}), 400
 
     data = request.get_json(silent=True) or {}
+    idem_key = _claim_request("unbounce_pv", data)
+    if idem_key is None:
+        return jsonify({"status": "success", "message": "Lead déjà reçu.", "duplicate": True}), 200
+    lead = normalize_unbounce(data)
+    print("téléphone:", lead["form_response"]["hidden"]["telephone"], lead["form_response"]["submitted_at"])
 
-    civilite = data.get("civilite", "")
-    time_submitted = data.get("time_submitted", "")
-    prenom = data.get("prenom", "")
-    code = data.get("code", "")
-    date_submitted = data.get("date_submitted", "")
-    phone = data.get("telephone", "")
-    utm_source = data.get("utm_source", "")
-    nom = data.get("nom", "")
-    email = data.get("email", "")
-    statut_habitation = data.get("êtesvous_propriétaire_ou_locataire_", "")
-    type_habitation = data.get("vivezvous_en_maison_ou_en_appartement_", "")
-    zipcode = data.get("code_postal", "")
-    date_time = (date_submitted + " " + time_submitted).strip()
-    cohort = ""
-
-    print("téléphone:", phone, date_time)
-
-    if zipcode:
-        if len(zipcode) == 4:
-            zipcode = "0" + zipcode
-        department = zipcode[:2]
-    else:
-        department = ""
-
-    interested_clients = []
-    if department:
-        try:
-            dep_int = int(department)
-            for clients, departments in clientInterests.items():
-                if dep_int in departments:
-                    interested_clients.append(clients)
-        except Exception:
-            pass
+    wait = min(request.args.get("wait", default=0, type=float) or 0, UNBOUNCE_MAX_WAIT)
+    if wait > 0:
+        lead["lead_id"] = uuid.uuid4().hex
+        lead_outcomes.expect(lead["lead_id"])
 
     try:
-        sheet = client.open("Panneaux Solaires - Publiweb").sheet1
-        all_values = sheet.get_all_values()
-        existing_phones = [row[5] for row in all_values]
-
-        if phone not in existing_phones:
-            next_row = len(all_values) + 1
-            if next_row > sheet.row_count:
-                sheet.add_rows(1)
-
-            sheet.format(f"A{next_row}:O{next_row}", {
-                "backgroundColor": {"red": 1.0, "green": 1.0, "blue": 1.0}
-            })
-
-            sheet.update(f"A{next_row}:N{next_row}", [[
-                type_habitation, statut_habitation, civilite, nom, prenom, phone, email,
-                zipcode, code, utm_source, " ", date_time, department, ", ".join(interested_clients)
-            ]])
-
-            if type_habitation == "Appartement ❌" or statut_habitation == "Locataire ❌":
-                sheet.format(f"A{next_row}:O{next_row}", {
-                    "backgroundColor": {"red": 1.0, "green": 0.0, "blue": 0.0}
-                })
-
-            if type_habitation != "Appartement ❌" and statut_habitation != "Locataire ❌":
-                try:
-                    response = client_vonage.send_message({
-                        "from": "RDV TEL",
-                        "to": phone,
-                        "text": (
-                            f"Bonjour {prenom} {nom}\n"
-                            f"Merci pour votre demande\n"
-                            f"Un conseiller vous recontactera sous 24h à 48h\n\n"
-                            f"Pour sécuriser votre parcours, veuillez noter votre code dossier {code}. "
-                            f"Pour annuler votre RDV, cliquez ici: https://cliquez-ici.info/annulationPVML"
-                        )
-                    })
-                    if response.get("messages", [{}])[0].get("status") != "0":
-                        return jsonify({"status": "error", "message": response.get("messages", [{}])[0].get("error-text", "SMS error")})
-                    return jsonify({"status": "success", "message": "Enregistrement réussi!"})
-                except Exception as e:
-                    return jsonify({"status": "error", "message": str(e)}), 500
-            else:
-                return jsonify({"status": "success", "message": "Enregistrement réussi sans envoi de SMS."})
-        else:
-            return jsonify({"status": "duplicate", "message": "Lead déjà existant"}), 200
-
+        add_to_queue(lead)
     except Exception as e:
-        print("Erreur Sheets:", str(e))
+        idempotency.release(idem_key)
+        print("Erreur enqueue unbounce:", str(e))
         return jsonify({"status": "error", "message": str(e)}), 500
 
+    if wait <= 0:
+        return jsonify({"status": "success", "message": "Lead reçu."}), 200
+    return _unbounce_outcome(lead["lead_id"], wait)
+
+
+def _unbounce_outcome(lead_id: str, wait: float):
+    deadline = time.monotonic() + wait
+    outcome = lead_outcomes.wait(lead_id, wait)
+    if outcome is None or outcome["status"] == "retrying":
+        return jsonify({"status": "queued", "message": "Lead reçu, traitement en cours."}), 202
+    if outcome["status"] == "duplicate":
+        return jsonify({"status": "duplicate", "message": "Lead déjà existant"}), 200
+    if outcome["status"] == "invalid":
+        return jsonify({"status": "error", "message": "Numéro de téléphone invalide"}), 200
+    if not outcome.get("sms_id"):
+        return jsonify({"status": "success", "message": "Enregistrement réussi sans envoi de SMS."}), 200
+
+    # attend l'envoi effectif du SMS dans le temps restant
+    sms = None
+    while time.monotonic() < deadline:
+        sms = sms_dispatcher.status.get(outcome["sms_id"]) or {}
+        if sms.get("status") not in ("queued", "retrying"):
+            break
+        time.sleep(0.05)
+    if sms and sms.get("status") == "failed":
+        return jsonify({"status": "error", "message": sms.get("error") or "SMS error"}), 200
+    return jsonify({"status": "success", "message": "Enregistrement réussi!"}), 200
+
 
 # ============================================================
 # Main
 # ============================================================
+# Sous gunicorn (gunicorn.conf.py), init_process() est appelé par worker
+# après le fork ; sinon on démarre ici comme avant.
+if os.environ.get("APP_MANAGED_START") != "1":
+    init_process()
+
+
+def _handle_sigterm(signum, frame):
+    shutdown_workers()
+    raise SystemExit(0)
+
+
 if __name__ == "__main__":
+    # mode dev / mono-process : app.run
+    signal.signal(signal.SIGTERM, _handle_sigterm)
     port = int(os.environ.get("PORT", "8080"))
     app.run(host="0.0.0.0", port=port, debug=False)
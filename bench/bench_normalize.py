@@ -0,0 +1,240 @@
+"""
+Micro-benchmark de la normalisation des leads : implémentation historique
+(reprise telle quelle ci-dessous) vs leads.py.
+
+    python bench/bench_normalize.py [--n 20000] [--json]
+
+Mesure le temps CPU par lead (normalize_redshift_row + normalize_lead +
+lecture dans process_lead) et la mémoire allouée / retenue par lead
+(tracemalloc).
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import unicodedata
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import leads  # noqa: E402
+
+
+# ============================================================
+# Référence : implémentation avant leads.py
+# ============================================================
+def _utc_iso() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _trunc(v, max_len=1000) -> str:
+    if v is None:
+        return ""
+    s = str(v)
+    return s[:max_len]
+
+
+def _first_ip(xff: str) -> str:
+    if not xff:
+        return ""
+    return xff.split(",")[0].strip()
+
+
+def _norm_txt(s: str) -> str:
+    if not s:
+        return ""
+    s = s.replace("*", " ")
+    s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii")
+    s = s.lower()
+    s = re.sub(r"\s+", " ", s).strip()
+    return s
+
+
+def parse_iso(dt_str: str) -> str:
+    if not dt_str:
+        return _utc_iso()
+    s = str(dt_str)
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"):
+        try:
+            dt = datetime.strptime(s, fmt)
+            return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+        except ValueError:
+            pass
+    return _utc_iso()
+
+
+def _merge_analytics(analytics_str: str, extra: dict) -> str:
+    base = {}
+    try:
+        if analytics_str:
+            base = json.loads(analytics_str)
+            if not isinstance(base, dict):
+                base = {"raw": analytics_str}
+    except Exception:
+        base = {"raw": analytics_str}
+    base.update(extra)
+    out = json.dumps(base, separators=(",", ":"), ensure_ascii=False)
+    return _trunc(out, 1000)
+
+
+def legacy_redshift_row(payload: dict, req) -> dict:
+    xff = req.headers.get("X-Forwarded-For", "")
+    ip = _first_ip(xff) or (req.remote_addr or "")
+    accept_lang = req.headers.get("Accept-Language", "")
+    submitted_at = parse_iso(payload.get("submitted_at") or payload.get("timestamp"))
+    date_import = parse_iso(payload.get("date_import") or submitted_at)
+    analytics_in = _trunc(payload.get("analytics", ""), 1000)
+    analytics = _merge_analytics(analytics_in, {
+        "ip": ip, "xff": xff, "accept_language": accept_lang, "server_received_at": _utc_iso(),
+    })
+    return {
+        "analytics": analytics,
+        "civilite": _trunc(payload.get("civilite", ""), 1000),
+        "code": _trunc(payload.get("code", ""), 1000),
+        "code_postal": _trunc(payload.get("code_postal", ""), 1000),
+        "cohort": _trunc(payload.get("cohort", ""), 1000),
+        "email": _trunc(payload.get("email", ""), 1000),
+        "nom": _trunc(payload.get("nom", ""), 1000),
+        "prenom": _trunc(payload.get("prenom", ""), 1000),
+        "telephone": _trunc(payload.get("telephone", ""), 1000),
+        "utm_source": _trunc(payload.get("utm_source", ""), 1000),
+        "user_agent": _trunc(payload.get("user_agent") or req.headers.get("User-Agent", ""), 1000),
+        "platform": _trunc(payload.get("platform", ""), 1000),
+        "referer": _trunc(payload.get("referer") or req.headers.get("Referer", ""), 1000),
+        "network_id": _trunc(payload.get("network_id", ""), 1000),
+        "browser": _trunc(payload.get("browser", ""), 1000),
+        "date_import": _trunc(date_import, 1000),
+        "submitted_at": _trunc(submitted_at, 1000),
+        "reponse_1": _trunc(payload.get("reponse_1", ""), 50),
+        "reponse_2": _trunc(payload.get("reponse_2", ""), 50),
+        "reponse_3": _trunc(payload.get("reponse_3", ""), 50),
+    }
+
+
+def legacy_normalize_lead(data: dict) -> dict:
+    if "form_response" in data:
+        fr = data.get("form_response", {})
+        fr["submitted_at"] = parse_iso(fr.get("submitted_at"))
+        answers = fr.get("answers", []) or []
+        if len(answers) == 1:
+            label = _norm_txt((answers[0].get("choice", {}) or {}).get("label", "") or "")
+            type_label = "Maison ✅" if "maison" in label else "Appartement ❌" if "appartement" in label else ""
+            own_label = "Propriétaire ✅" if "propriet" in label else "Locataire ❌" if "locat" in label else ""
+            if type_label or own_label:
+                fr["answers"] = [
+                    {"type": "choice", "choice": {"label": type_label}},
+                    {"type": "choice", "choice": {"label": own_label}},
+                ]
+        data["form_response"] = fr
+        return data
+    prop = data.get("property_type") or data.get("reponse_1") or data.get("propertyType") or ""
+    own = data.get("ownership_status") or data.get("reponse_2") or data.get("ownershipStatus") or ""
+    type_label = "Maison ✅" if prop == "house" else "Appartement ❌" if prop == "apartment" else ""
+    own_label = "Propriétaire ✅" if own == "owner" else "Locataire ❌" if own == "tenant" else ""
+    return {
+        "form_response": {
+            "hidden": {k: data.get(k, "") for k in leads.LeadRecord.HIDDEN},
+            "submitted_at": parse_iso(data.get("submitted_at") or data.get("date_import") or data.get("timestamp")),
+            "answers": [
+                {"type": "choice", "choice": {"label": type_label}},
+                {"type": "choice", "choice": {"label": own_label}},
+            ],
+        },
+        "page": data.get("page", ""),
+    }
+
+
+def legacy_read(lead: dict):
+    hidden = lead["form_response"]["hidden"]
+    values = [lead["form_response"]["hidden"].get(k, "") for k in hidden]
+    date_iso = parse_iso(lead["form_response"].get("submitted_at", ""))
+    date_sliced = datetime.strptime(date_iso, "%Y-%m-%dT%H:%M:%SZ").strftime("%d-%m-%Y %H:%M")
+    return values, date_sliced
+
+
+# ============================================================
+# Bench
+# ============================================================
+class FakeRequest:
+    remote_addr = "10.0.0.1"
+    headers = {
+        "X-Forwarded-For": "203.0.113.7, 10.0.0.1",
+        "Accept-Language": "fr-FR,fr;q=0.9",
+        "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X)",
+        "Referer": "https://example.com/landing",
+    }
+
+
+def payloads(n: int):
+    labels = ["*Maison* - je suis propriétaire", "Appartement, locataire", "Maison / Locataire"]
+    out = []
+    for i in range(n):
+        if i % 3 == 0:
+            out.append({"event_id": f"ev{i}", "form_response": {
+                "submitted_at": "2024-05-01T10:00:%02d.123Z" % (i % 60),
+                "hidden": {"telephone": f"336{i:08d}", "nom": "Dupont", "prenom": "Jean",
+                           "code_postal": "54000", "utm_source": "fb"},
+                "answers": [{"type": "choice", "choice": {"label": labels[i % len(labels)]}}],
+            }})
+        else:
+            out.append({
+                "telephone": f"336{i:08d}", "nom": "Dupont", "prenom": "Jean", "email": "j@d.fr",
+                "code_postal": "54000", "civilite": "M", "utm_source": "google", "code": "1234",
+                "submitted_at": "2024-05-01T10:00:%02dZ" % (i % 60),
+                "analytics": '{"gclid":"abc","campaign":"pv"}',
+                "property_type": "house", "ownership_status": "owner",
+            })
+    return out
+
+
+def run(normalize_row, normalize, read, data, req):
+    """Retourne (µs CPU / lead, octets alloués au pic / lead, octets retenus / lead)."""
+    batch = [json.loads(json.dumps(p)) for p in data]
+    start = time.process_time()
+    for p in batch:
+        normalize_row(p, req)
+        read(normalize(p))
+    cpu = (time.process_time() - start) / len(batch) * 1e6
+
+    batch = [json.loads(json.dumps(p)) for p in data]
+    tracemalloc.start()
+    kept = []
+    for p in batch:
+        kept.append((normalize_row(p, req), read(normalize(p))))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak / len(batch), current / len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    data = payloads(args.n)
+    req = FakeRequest()
+    results = {}
+    for name, fns in (
+        ("legacy", (legacy_redshift_row, legacy_normalize_lead, legacy_read)),
+        ("fast", (leads.normalize_redshift_row, leads.normalize_lead, leads.LeadRecord.from_queue)),
+    ):
+        cpu, peak, kept = run(*fns, data, req)
+        results[name] = {"cpu_us_per_lead": round(cpu, 2), "peak_bytes_per_lead": int(peak), "kept_bytes_per_lead": int(kept)}
+
+    results["speedup"] = round(results["legacy"]["cpu_us_per_lead"] / results["fast"]["cpu_us_per_lead"], 2)
+    if args.json:
+        print(json.dumps(results))
+        return
+    for name in ("legacy", "fast"):
+        r = results[name]
+        print(f"{name:7s} {r['cpu_us_per_lead']:8.2f} µs/lead  "
+              f"pic {r['peak_bytes_per_lead']:6d} o/lead  retenu {r['kept_bytes_per_lead']:6d} o/lead")
+    print(f"speedup x{results['speedup']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,573 @@
+"""
+Fakes en mémoire pour les benchmarks : Google Sheets (gspread), Vonage
+(serveur HTTP local, même API REST que sms.py), S3 (serveur HTTP local,
+adressage par chemin) et Redshift (serveur TCP parlant le protocole
+Postgres v3 : psycopg2 et pg_pool.ConnectionPool s'y connectent pour de
+vrai). Chacun a une latence et un taux d'échec configurables et compte
+ses appels.
+"""
+import re
+import gzip
+import json
+import time
+import random
+import struct
+import threading
+import socketserver
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote
+
+
+class Faults:
+    """Latence (ms, +/- jitter) et probabilité d'échec d'un service simulé."""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, fail_rate: float = 0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fail_rate = fail_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self, what: str):
+        with self._lock:
+            delay = self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+            fail = self._rng.random() < self.fail_rate
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if fail:
+            raise FakeServiceError(f"{what}: panne simulée")
+
+
+class FakeServiceError(Exception):
+    pass
+
+
+# ============================================================
+# Google Sheets
+# ============================================================
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title: str = "Sheet1", rows: int = 1000, cols: int = 26, sheet_id: int = 0):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.row_count = rows
+        self.col_count = cols
+        self.rows = [["header"] * 15] if sheet_id == 0 else []
+
+    @property
+    def written_at(self):
+        return self.spreadsheet.written_at
+
+    def _ensure(self, n: int):
+        while len(self.rows) < n:
+            self.rows.append([""] * 15)
+
+    def get_all_values(self):
+        self.spreadsheet.calls["get_all_values"] += 1
+        self.spreadsheet.faults.apply("sheets.get_all_values")
+        return [list(r) for r in self.rows]
+
+    def row_values(self, n: int):
+        self.spreadsheet.calls["row_values"] += 1
+        return list(self.rows[n - 1]) if n <= len(self.rows) else []
+
+    def update(self, rng, values, **kwargs):
+        self.spreadsheet.calls["update"] += 1
+        self.spreadsheet.faults.apply("sheets.update")
+
+    def format(self, *args, **kwargs):
+        self.spreadsheet.calls["format"] += 1
+
+    def add_rows(self, n: int):
+        self.spreadsheet.calls["add_rows"] += 1
+        self.row_count += n
+
+
+class FakeSpreadsheet:
+    def __init__(self, faults: Faults):
+        self.id = "fake-spreadsheet"
+        self.faults = faults
+        self.calls = Counter()
+        self.sheet1 = FakeWorksheet(self)
+        self.tabs = {self.sheet1.title: self.sheet1}
+        self.written_at = {}   # téléphone -> time.monotonic() de l'écriture (tous onglets)
+        self._lock = threading.Lock()
+
+    def worksheet(self, title: str):
+        self.calls["worksheet"] += 1
+        if title not in self.tabs:
+            raise FakeServiceError(f"worksheet {title!r} not found")
+        return self.tabs[title]
+
+    def add_worksheet(self, title: str, rows: int, cols: int):
+        self.calls["add_worksheet"] += 1
+        with self._lock:
+            if title in self.tabs:
+                raise FakeServiceError(f"worksheet {title!r} already exists")
+            ws = FakeWorksheet(self, title, rows, cols, sheet_id=len(self.tabs))
+            self.tabs[title] = ws
+        return ws
+
+    def batch_update(self, body: dict):
+        self.calls["batch_update"] += 1
+        self.faults.apply("sheets.batch_update")
+        by_id = {ws.id: ws for ws in self.tabs.values()}
+        now = time.monotonic()
+        with self._lock:
+            for req in body.get("requests", []):
+                if "appendDimension" in req:
+                    by_id[req["appendDimension"]["sheetId"]].row_count += req["appendDimension"]["length"]
+                elif "updateCells" in req:
+                    u = req["updateCells"]
+                    sheet = by_id[u["start"]["sheetId"]]
+                    row = u["start"]["rowIndex"] + 1
+                    col = u["start"]["columnIndex"]
+                    sheet._ensure(row)
+                    for i, cell in enumerate(u["rows"][0]["values"]):
+                        value = cell.get("userEnteredValue")
+                        if value is not None and col + i < 15:
+                            sheet.rows[row - 1][col + i] = value.get("stringValue", "")
+                    phone = sheet.rows[row - 1][5]
+                    if phone and row > 1:   # ligne 1 = en-tête
+                        self.written_at.setdefault(phone, now)
+        return {}
+
+
+class FakeGspreadClient:
+    auth = None
+
+    def __init__(self, faults: Faults = None):
+        self.spreadsheet = FakeSpreadsheet(faults or Faults())
+
+    @property
+    def calls(self):
+        return self.spreadsheet.calls
+
+    def open_by_key(self, key: str):
+        self.calls["open_by_key"] += 1
+        self.spreadsheet.faults.apply("sheets.open_by_key")
+        return self.spreadsheet
+
+    def open(self, title: str):
+        self.calls["open"] += 1
+        self.spreadsheet.faults.apply("sheets.open")
+        return self.spreadsheet
+
+
+# ============================================================
+# Vonage (serveur HTTP local)
+# ============================================================
+class FakeVonage:
+    """POST /sms/json comme rest.nexmo.com ; un échec répond status 1 (Throttled)."""
+
+    def __init__(self, faults: Faults = None):
+        self.faults = faults or Faults()
+        self.calls = Counter()
+        self.sent = {}   # téléphone -> time.monotonic()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+                fake.calls["send_message"] += 1
+                try:
+                    fake.faults.apply("vonage")
+                    to = body.get("to", [""])[0]
+                    fake.sent.setdefault(to, time.monotonic())
+                    out = {"messages": [{"status": "0", "message-id": "fake-%d" % fake.calls["send_message"]}]}
+                except FakeServiceError:
+                    out = {"messages": [{"status": "1", "error-text": "Throttled"}]}
+                data = json.dumps(out).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return "http://127.0.0.1:%d" % self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# ============================================================
+# S3 (serveur HTTP local, PUT / GET / DELETE d'objets)
+# ============================================================
+class FakeS3:
+    """
+    Sous-ensemble de l'API S3 utilisé par redshift_ingest (boto3 avec
+    endpoint_url, adressage par chemin /bucket/key). Signatures non vérifiées.
+    """
+
+    def __init__(self, faults: Faults = None):
+        self.faults = faults or Faults()
+        self.calls = Counter()
+        self.objects = {}   # (bucket, key) -> bytes
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _target(self):
+                bucket, _, key = unquote(self.path.split("?", 1)[0]).lstrip("/").partition("/")
+                return bucket, key
+
+            def _reply(self, status: int, body: bytes = b"", content_type: str = "application/xml"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _error(self, status: int, code: str):
+                self._reply(status, f"<Error><Code>{code}</Code><Message>{code}</Message></Error>".encode())
+
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                fake.calls["put_object"] += 1
+                try:
+                    fake.faults.apply("s3.put_object")
+                except FakeServiceError:
+                    return self._error(503, "SlowDown")
+                with fake._lock:
+                    fake.objects[self._target()] = body
+                self.send_response(200)
+                self.send_header("ETag", '"fake"')
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                fake.calls["get_object"] += 1
+                body = fake.get(*self._target())
+                if body is None:
+                    return self._error(404, "NoSuchKey")
+                self._reply(200, body, "application/octet-stream")
+
+            def do_DELETE(self):
+                fake.calls["delete_object"] += 1
+                with fake._lock:
+                    fake.objects.pop(self._target(), None)
+                self._reply(204)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def endpoint_url(self) -> str:
+        return "http://127.0.0.1:%d" % self.server.server_address[1]
+
+    def get(self, bucket: str, key: str):
+        with self._lock:
+            return self.objects.get((bucket, key))
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ============================================================
+# Redshift (serveur protocole Postgres v3, requêtes simples)
+# ============================================================
+# Juste ce qu'envoient psycopg2 / redshift_ingest / pg_pool :
+# BEGIN / COMMIT / ROLLBACK, SELECT 1, INSERT ... VALUES (littéraux
+# générés par execute_values) et COPY ... FROM 's3://...' (NDJSON gzip lu
+# dans FakeS3). Les rows insérées ne sont visibles qu'au COMMIT ; une
+# erreur dans une transaction l'interrompt jusqu'au ROLLBACK, comme Postgres.
+
+_SSL_REQUEST = 80877103
+_GSSENC_REQUEST = 80877104
+_CANCEL_REQUEST = 80877102
+_PROTOCOL_V3 = 196608
+
+_INSERT_RE = re.compile(r"^\s*INSERT\s+INTO\s+([\w.]+)\s*\(([^)]*)\)\s*VALUES\s*(.*?)\s*;?\s*$", re.I | re.S)
+_COPY_RE = re.compile(r"^\s*COPY\s+([\w.]+)\s*\(([^)]*)\)\s*FROM\s+'s3://([^/']+)/([^']+)'", re.I | re.S)
+_NUMBER_RE = re.compile(r"[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?")
+_CAST_RE = re.compile(r"::[\w\[\] ]+?(?=\s*[,)])")
+
+
+class FakeSQLError(Exception):
+    def __init__(self, message: str, code: str = "XX000"):
+        super().__init__(message)
+        self.code = code
+
+
+def _parse_literal(text: str, i: int):
+    """Un littéral SQL à partir de text[i] -> (valeur, index suivant)."""
+    if text.startswith(("'", "E'", "e'"), i):
+        escapes = text[i] != "'"
+        i += 2 if escapes else 1
+        out = []
+        while True:
+            if i >= len(text):
+                raise FakeSQLError("unterminated quoted string", "42601")
+            c = text[i]
+            if c == "'" and text.startswith("''", i):
+                out.append("'")
+                i += 2
+            elif c == "'":
+                i += 1
+                break
+            elif c == "\\" and escapes:
+                out.append(text[i + 1])
+                i += 2
+            else:
+                out.append(c)
+                i += 1
+        value = "".join(out)
+    else:
+        word = re.match(r"[A-Za-z]+", text[i:])
+        number = _NUMBER_RE.match(text, i)
+        if word and word.group().upper() in ("NULL", "TRUE", "FALSE"):
+            value = {"NULL": None, "TRUE": True, "FALSE": False}[word.group().upper()]
+            i += len(word.group())
+        elif number:
+            value = float(number.group()) if any(c in number.group() for c in ".eE") else int(number.group())
+            i = number.end()
+        else:
+            raise FakeSQLError(f"syntax error at or near {text[i:i + 20]!r}", "42601")
+    cast = _CAST_RE.match(text, i)
+    return value, cast.end() if cast else i
+
+
+def parse_values(text: str) -> list:
+    """ "(1,'a'),(2,NULL)" -> [[1, 'a'], [2, None]] """
+    rows, i = [], 0
+
+    def skip(i):
+        while i < len(text) and text[i].isspace():
+            i += 1
+        return i
+
+    while True:
+        i = skip(i)
+        if i >= len(text) or text[i] != "(":
+            raise FakeSQLError("syntax error in VALUES", "42601")
+        row = []
+        while True:
+            value, i = _parse_literal(text, skip(i + 1))
+            row.append(value)
+            i = skip(i)
+            if i < len(text) and text[i] == ",":
+                continue
+            if i < len(text) and text[i] == ")":
+                break
+            raise FakeSQLError("syntax error in VALUES", "42601")
+        rows.append(row)
+        i = skip(i + 1)
+        if i >= len(text):
+            return rows
+        if text[i] != ",":
+            raise FakeSQLError("syntax error after VALUES", "42601")
+        i += 1
+
+
+def _message(kind: bytes, body: bytes = b"") -> bytes:
+    return kind + struct.pack("!I", len(body) + 4) + body
+
+
+def _cstr(value: str) -> bytes:
+    return value.encode("utf-8") + b"\0"
+
+
+class FakeRedshift:
+    """
+    Serveur local : host/port à donner à psycopg2 (sslmode=disable).
+    `tables` : nom -> rows commitées (dicts) ; `rows` : total commité.
+    """
+
+    def __init__(self, s3: FakeS3 = None, faults: Faults = None):
+        self.s3 = s3
+        self.faults = faults or Faults()
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.rows = 0
+        self.last_sql = ""
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fake.calls["connect"] += 1
+                if not self._startup():
+                    return
+                session = _Session(fake)
+                while True:
+                    head = self.rfile.read(5)
+                    if len(head) < 5:
+                        return
+                    kind, size = head[:1], struct.unpack("!I", head[1:])[0]
+                    body = self.rfile.read(size - 4)
+                    if kind == b"X":
+                        return
+                    if kind == b"Q":
+                        self.wfile.write(session.query(body.rstrip(b"\0").decode("utf-8")))
+                    else:
+                        self.wfile.write(session.error(FakeSQLError(f"unsupported message {kind!r}", "0A000")))
+                        self.wfile.write(session.ready())
+
+            def _startup(self) -> bool:
+                while True:
+                    head = self.rfile.read(8)
+                    if len(head) < 8:
+                        return False
+                    size, code = struct.unpack("!II", head)
+                    self.rfile.read(size - 8)
+                    if code in (_SSL_REQUEST, _GSSENC_REQUEST):
+                        self.wfile.write(b"N")   # ni TLS ni GSSAPI : le client continue en clair
+                        continue
+                    if code != _PROTOCOL_V3:
+                        return False
+                    break
+                out = [_message(b"R", struct.pack("!I", 0))]   # AuthenticationOk
+                for name, value in (
+                    ("server_version", "8.0.2"),
+                    ("server_encoding", "UTF8"),
+                    ("client_encoding", "UTF8"),
+                    ("DateStyle", "ISO, MDY"),
+                    ("integer_datetimes", "on"),
+                    ("standard_conforming_strings", "on"),
+                ):
+                    out.append(_message(b"S", _cstr(name) + _cstr(value)))
+                out.append(_message(b"K", struct.pack("!II", 1, 1)))
+                out.append(_message(b"Z", b"I"))
+                self.wfile.write(b"".join(out))
+                return True
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return self.server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _commit(self, pending: list):
+        with self.lock:
+            for table, rows in pending:
+                self.tables.setdefault(table, []).extend(rows)
+                self.rows += len(rows)
+
+
+class _Session:
+    """État d'une connexion : transaction en cours, rows pas encore commitées."""
+
+    def __init__(self, db: FakeRedshift):
+        self.db = db
+        self.status = b"I"   # I : hors transaction, T : en transaction, E : transaction en échec
+        self.pending = []    # [(table, rows)]
+
+    def ready(self) -> bytes:
+        return _message(b"Z", self.status)
+
+    def error(self, e: FakeSQLError) -> bytes:
+        if self.status == b"T":
+            self.status = b"E"
+        fields = b"SERROR\0VERROR\0C" + _cstr(e.code) + b"M" + _cstr(str(e)) + b"\0"
+        return _message(b"E", fields)
+
+    def query(self, sql: str) -> bytes:
+        self.db.last_sql = sql[:200]
+        try:
+            out = self._execute(sql)
+        except FakeServiceError as e:
+            out = self.error(FakeSQLError(str(e)))
+        except FakeSQLError as e:
+            out = self.error(e)
+        return out + self.ready()
+
+    def _execute(self, sql: str) -> bytes:
+        verb = sql.strip().split(None, 1)[0].upper().rstrip(";") if sql.strip() else ""
+        self.db.calls[verb.lower() or "empty"] += 1
+        if verb in ("COMMIT", "END", "ROLLBACK", "ABORT"):
+            if verb in ("COMMIT", "END") and self.status == b"T":
+                self.db._commit(self.pending)
+                tag = "COMMIT"
+            else:
+                tag = "ROLLBACK"
+            self.pending, self.status = [], b"I"
+            return _message(b"C", _cstr(tag))
+        if self.status == b"E":
+            raise FakeSQLError("current transaction is aborted, commands ignored until end of transaction block",
+                               "25P02")
+        if verb in ("BEGIN", "START"):
+            self.status = b"T"
+            return _message(b"C", _cstr("BEGIN"))
+        if verb == "SELECT":
+            self.db.faults.apply("redshift.select")
+            field = _cstr("?column?") + struct.pack("!IhIhih", 0, 0, 23, 4, -1, 0)
+            return (_message(b"T", struct.pack("!h", 1) + field)
+                    + _message(b"D", struct.pack("!hI", 1, 1) + b"1")
+                    + _message(b"C", _cstr("SELECT 1")))
+        if verb == "INSERT":
+            self.db.faults.apply("redshift.insert")
+            m = _INSERT_RE.match(sql)
+            if not m:
+                raise FakeSQLError("syntax error in INSERT", "42601")
+            columns = [c.strip() for c in m.group(2).split(",")]
+            rows = [self._row(columns, values) for values in parse_values(m.group(3))]
+            self._apply(m.group(1), rows)
+            return _message(b"C", _cstr("INSERT 0 %d" % len(rows)))
+        if verb == "COPY":
+            self.db.faults.apply("redshift.copy")
+            m = _COPY_RE.match(sql)
+            if not m:
+                raise FakeSQLError("syntax error in COPY", "42601")
+            columns = [c.strip() for c in m.group(2).split(",")]
+            body = self.db.s3.get(m.group(3), m.group(4)) if self.db.s3 is not None else None
+            if body is None:
+                raise FakeSQLError(f"S3ServiceException: The specified key does not exist: {m.group(4)}")
+            lines = gzip.decompress(body).decode("utf-8").splitlines()
+            rows = [self._row(columns, [record.get(c) for c in columns])
+                    for record in map(json.loads, filter(None, lines))]
+            self._apply(m.group(1), rows)
+            return _message(b"C", _cstr("COPY %d" % len(rows)))
+        raise FakeSQLError(f"unsupported statement: {sql[:40]!r}", "0A000")
+
+    @staticmethod
+    def _row(columns: list, values: list) -> dict:
+        if len(values) != len(columns):
+            raise FakeSQLError("INSERT has more expressions than target columns", "42601")
+        return dict(zip(columns, values))
+
+    def _apply(self, table: str, rows: list):
+        if self.status == b"T":
+            self.pending.append((table, rows))
+        else:
+            self.db._commit([(table, rows)])
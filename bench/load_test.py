@@ -0,0 +1,348 @@
+"""
+Banc de charge reproductible : l'app Flask tourne dans ce process avec des
+fakes pour Google Sheets, Vonage, S3 et Redshift (bench/fakes.py ; Redshift
+et S3 sont des serveurs locaux joints par psycopg2 / boto3), pilotée à
+débit constant (boucle ouverte : la latence est mesurée depuis l'instant
+prévu de la requête, donc un serveur lent ne ralentit pas le générateur).
+
+    python bench/load_test.py --rate 50 --duration 10
+    python bench/load_test.py --endpoint mixed --sheets-latency 200 --vonage-fail 0.05
+    python bench/load_test.py --baseline bench/results/avant.json --out bench/results/apres.json
+
+Rapporte req/s, latences p50/p95/p99, délai file -> sheet / SMS (queue
+lag) et appels d'API par lead ; le résultat est écrit en JSON pour
+comparaison entre deux versions (--baseline).
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import Faults, FakeGspreadClient, FakeVonage, FakeS3, FakeRedshift  # noqa: E402
+from phones import normalize_phone  # noqa: E402
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--endpoint", choices=("leads_pv", "unbounce", "mixed"), default="leads_pv")
+    p.add_argument("--rate", type=float, default=50, help="requêtes/s")
+    p.add_argument("--duration", type=float, default=10, help="secondes de charge")
+    p.add_argument("--concurrency", type=int, default=32, help="clients HTTP simultanés max")
+    p.add_argument("--dup-rate", type=float, default=0.0, help="part de téléphones déjà envoyés")
+    p.add_argument("--seed", type=int, default=1)
+    for name in ("sheets", "vonage", "redshift", "s3"):
+        p.add_argument(f"--{name}-latency", type=float, default=0, help="ms")
+        p.add_argument(f"--{name}-jitter", type=float, default=0, help="ms")
+        p.add_argument(f"--{name}-fail", type=float, default=0, help="probabilité d'échec par appel")
+    p.add_argument("--shard-by", choices=("", "month", "rows"), default="", help="SHEET_SHARD_BY pendant le bench")
+    p.add_argument("--shard-rows", type=int, default=50000, help="SHEET_SHARD_MAX_ROWS (avec --shard-by rows)")
+    p.add_argument("--copy-min-rows", type=int, default=200,
+                   help="REDSHIFT_COPY_MIN_ROWS : batchs à partir desquels S3 + COPY remplace l'INSERT")
+    p.add_argument("--retry-base-delay", type=float, default=0.2, help="RETRY_BASE_DELAY pendant le bench")
+    p.add_argument("--drain-timeout", type=float, default=60, help="attente max du pipeline après la charge")
+    p.add_argument("--out", default="", help="fichier JSON de résultats (défaut : bench/results/<date>.json)")
+    p.add_argument("--baseline", default="", help="résultats JSON à comparer")
+    p.add_argument("--verbose", action="store_true", help="garder les logs de l'app")
+    return p.parse_args()
+
+
+# ============================================================
+# App sous test
+# ============================================================
+def _service_account_env():
+    import rsa
+    _, key = rsa.newkeys(1024)
+    return {
+        "TYPE": "service_account",
+        "PROJECT_ID": "bench",
+        "PRIVATE_KEY_ID": "bench",
+        "PRIVATE_KEY": key.save_pkcs1().decode("ascii"),
+        "CLIENT_EMAIL": "bench@bench.iam.gserviceaccount.com",
+        "CLIENT_ID": "1",
+        "TOKEN_URI": "https://oauth2.googleapis.com/token",
+    }
+
+
+def load_app(args, workdir: str, fakes: dict):
+    env = _service_account_env()
+    env.update({
+        "APP_MANAGED_START": "1",          # on démarre après avoir branché les fakes
+        "QUEUE_DIR": os.path.join(workdir, "queues"),
+        "SHEET_KEY": "fake-spreadsheet",
+        "VONAGE_BASE_URL": fakes["vonage"].base_url,
+        "KEY_VONAGE": "bench",
+        "KEY_VONAGE_SECRET": "bench",
+        "VONAGE_RATE": "1000",
+        "RETRY_BASE_DELAY": str(args.retry_base_delay),
+        "RETRY_MAX_DELAY": "5",
+        "ROUTING_FILE": "",
+        "ROUTING_SHEET_TAB": "",
+        "SHEET_SHARD_BY": args.shard_by,
+        "SHEET_SHARD_MAX_ROWS": str(args.shard_rows),
+        # vraies connexions psycopg2 (pg_pool) vers le serveur local, COPY via le S3 local
+        "REDSHIFT_HOST": fakes["redshift"].host,
+        "REDSHIFT_PORT": str(fakes["redshift"].port),
+        "REDSHIFT_DB": "bench",
+        "REDSHIFT_USER": "bench",
+        "REDSHIFT_PASSWORD": "bench",
+        "REDSHIFT_TABLE": "leads",
+        "REDSHIFT_SSLMODE": "disable",
+        "REDSHIFT_COPY_MIN_ROWS": str(args.copy_min_rows),
+        "REDSHIFT_S3_BUCKET": "bench-staging",
+        "REDSHIFT_IAM_ROLE": "arn:aws:iam::000000000000:role/bench-copy",
+        "REDSHIFT_S3_ENDPOINT_URL": fakes["s3"].endpoint_url,
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_DEFAULT_REGION": "eu-west-3",
+    })
+    os.environ.update(env)
+    os.chdir(workdir)   # load_dotenv / fichiers relatifs dans le répertoire de travail
+
+    import app
+    app.worksheet_cache.client = fakes["sheets"]
+    app.init_process()
+    deadline = time.monotonic() + 10
+    while not app.is_leader() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return app
+
+
+# ============================================================
+# Charge
+# ============================================================
+def _payload(endpoint: str, phone: str) -> tuple:
+    if endpoint == "unbounce":
+        return "/webhook_unbounce_pv", {
+            "telephone": [phone], "nom": ["Bench"], "prenom": ["Lead"], "email": ["b@bench.fr"],
+            "code_postal": ["54000"], "civilite": ["M"], "utm_source": ["bench"], "code": ["1234"],
+            "date_submitted": ["2024-05-01"], "time_submitted": ["10:00 AM UTC"],
+            "vivezvous_en_maison_ou_en_appartement_": ["Maison"],
+            "êtesvous_propriétaire_ou_locataire_": ["Propriétaire"],
+        }
+    return "/leads_pv", {
+        "telephone": phone, "nom": "Bench", "prenom": "Lead", "email": "b@bench.fr",
+        "code_postal": "54000", "civilite": "M", "utm_source": "bench", "code": "1234",
+        "submitted_at": "2024-05-01T10:00:00Z", "analytics": '{"campaign":"bench"}',
+        "property_type": "house", "ownership_status": "owner", "nonce": uuid.uuid4().hex,
+    }
+
+
+def drive(app, args):
+    """Envoie rate*duration requêtes à intervalle fixe ; retourne les mesures par requête."""
+    rng = random.Random(args.seed)
+    total = int(args.rate * args.duration)
+    interval = 1.0 / args.rate
+    local = threading.local()
+    records = []
+    lock = threading.Lock()
+    phones = []
+
+    def one(i, endpoint, phone, scheduled):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.app.test_client()
+        path, body = _payload(endpoint, phone)
+        start = time.monotonic()
+        try:
+            status = client.post(path, json=body).status_code
+        except Exception:
+            status = 599
+        end = time.monotonic()
+        with lock:
+            records.append({"endpoint": endpoint, "phone": phone, "status": status,
+                            "latency": end - scheduled, "service": end - start, "accepted_at": end})
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        t0 = time.monotonic()
+        for i in range(total):
+            if phones and rng.random() < args.dup_rate:
+                phone = rng.choice(phones)
+            else:
+                phone = "336%08d" % i
+                phones.append(phone)
+            endpoint = args.endpoint if args.endpoint != "mixed" else rng.choice(("leads_pv", "unbounce"))
+            scheduled = t0 + i * interval
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(one, i, endpoint, phone, scheduled)
+    elapsed = time.monotonic() - t0
+    return records, elapsed, len(set(phones))
+
+
+def wait_drain(app, fakes, unique_phones: int, redshift_rows: int, timeout: float) -> float:
+    """Attend que tous les leads soient dans le sheet, SMS envoyés et rows Redshift insérées."""
+    sheet = fakes["sheets"].spreadsheet.sheet1
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if (
+            len(sheet.written_at) >= unique_phones
+            and len(fakes["vonage"].sent) >= unique_phones
+            and fakes["redshift"].rows >= redshift_rows
+            and len(app.lead_queue) == 0
+            and app.lead_pool.in_flight() == 0
+        ):
+            return time.monotonic() - start
+        time.sleep(0.05)
+    return -1.0
+
+
+# ============================================================
+# Résultats
+# ============================================================
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pct(p):
+        return round(values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))] * 1000, 2)
+
+    return {"p50": pct(50), "p95": pct(95), "p99": pct(99), "max": round(values[-1] * 1000, 2),
+            "mean": round(sum(values) / len(values) * 1000, 2)}
+
+
+def summarize(args, records, elapsed, unique_phones, drain, fakes) -> dict:
+    ok = [r for r in records if r["status"] < 400]
+    # le sheet stocke le E.164 (+336...), Vonage reçoit le numéro sans "+" :
+    # tout est rapproché sur la forme normalisée
+    accepted = {}
+    for r in ok:
+        accepted.setdefault(normalize_phone(r["phone"]), r["accepted_at"])
+
+    def lags(sent_at: dict) -> list:
+        by_phone = {}
+        for phone, t in sent_at.items():
+            phone = normalize_phone(phone)
+            if phone in accepted:
+                by_phone[phone] = min(t, by_phone.get(phone, t))
+        return [t - accepted[p] for p, t in by_phone.items()]
+
+    sheet_lag = lags(fakes["sheets"].spreadsheet.written_at)
+    sms_lag = lags(fakes["vonage"].sent)
+
+    leads = max(1, len(fakes["sheets"].spreadsheet.written_at))
+    sheets_calls = dict(fakes["sheets"].calls)
+    redshift_calls = dict(fakes["redshift"].calls)
+    s3_calls = dict(fakes["s3"].calls)
+    vonage_calls = dict(fakes["vonage"].calls)
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "requests": {
+            "sent": len(records),
+            "ok": len(ok),
+            "errors": len(records) - len(ok),
+            "rps": round(len(records) / elapsed, 2) if elapsed else 0,
+            "latency_ms": percentiles([r["latency"] for r in records]),
+            "service_ms": percentiles([r["service"] for r in records]),
+        },
+        "pipeline": {
+            "unique_phones": unique_phones,
+            "leads_written": len(fakes["sheets"].spreadsheet.written_at),
+            "sms_sent": len(fakes["vonage"].sent),
+            "redshift_rows": fakes["redshift"].rows,
+            "drain_seconds": round(drain, 3),
+            "drained": drain >= 0,
+            "sheet_lag_ms": percentiles(sheet_lag),
+            "sms_lag_ms": percentiles(sms_lag),
+        },
+        "api_calls": {
+            "sheets": sheets_calls,
+            "vonage": vonage_calls,
+            "redshift": redshift_calls,
+            "s3": s3_calls,
+            "per_lead": {
+                "sheets": round(sum(sheets_calls.values()) / leads, 3),
+                "vonage": round(sum(vonage_calls.values()) / leads, 3),
+                # requêtes qui écrivent (INSERT / COPY), hors BEGIN / COMMIT
+                "redshift": round((redshift_calls.get("insert", 0) + redshift_calls.get("copy", 0)) / leads, 3),
+            },
+        },
+    }
+
+
+def _flatten(d: dict, prefix: str = ""):
+    for k, v in d.items():
+        if isinstance(v, dict):
+            yield from _flatten(v, f"{prefix}{k}.")
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            yield f"{prefix}{k}", v
+
+
+def compare(results: dict, baseline: dict) -> list:
+    """Lignes "métrique  avant -> après (delta %)" pour les sections mesurées."""
+    lines = []
+    before = dict(_flatten({k: baseline.get(k, {}) for k in ("requests", "pipeline", "api_calls")}))
+    after = dict(_flatten({k: results.get(k, {}) for k in ("requests", "pipeline", "api_calls")}))
+    for key in sorted(set(before) & set(after)):
+        a, b = before[key], after[key]
+        delta = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+        lines.append(f"  {key:40s} {a:>10} -> {b:>10}  ({delta})")
+    return lines
+
+
+def main():
+    args = parse_args()
+    out = args.out or os.path.join(BENCH_DIR, "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    out = os.path.abspath(out)
+    baseline = os.path.abspath(args.baseline) if args.baseline else ""
+    stdout = sys.stdout
+
+    s3 = FakeS3(Faults(args.s3_latency, args.s3_jitter, args.s3_fail, args.seed + 3)).start()
+    fakes = {
+        "sheets": FakeGspreadClient(Faults(args.sheets_latency, args.sheets_jitter, args.sheets_fail, args.seed)),
+        "vonage": FakeVonage(Faults(args.vonage_latency, args.vonage_jitter, args.vonage_fail, args.seed + 1)).start(),
+        "s3": s3,
+        "redshift": FakeRedshift(
+            s3, Faults(args.redshift_latency, args.redshift_jitter, args.redshift_fail, args.seed + 2)
+        ).start(),
+    }
+
+    with tempfile.TemporaryDirectory(prefix="webhook-bench-") as workdir:
+        log = open(os.path.join(workdir, "app.log"), "w")
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(log)
+        with quiet:
+            app = load_app(args, workdir, fakes)
+            records, elapsed, unique_phones = drive(app, args)
+            redshift_rows = sum(1 for r in records if r["status"] < 400 and r["endpoint"] == "leads_pv")
+            drain = wait_drain(app, fakes, unique_phones, redshift_rows, args.drain_timeout)
+            results = summarize(args, records, elapsed, unique_phones, drain, fakes)
+            app.shutdown_workers(timeout=10)
+        for name in ("vonage", "redshift", "s3"):
+            fakes[name].stop()
+
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+
+    req, pipe, calls = results["requests"], results["pipeline"], results["api_calls"]["per_lead"]
+    print(f"requêtes   {req['sent']} ({req['errors']} erreurs)  {req['rps']} req/s", file=stdout)
+    print(f"latence    {req['latency_ms']}", file=stdout)
+    print(f"sheet lag  {pipe['sheet_lag_ms']}", file=stdout)
+    print(f"sms lag    {pipe['sms_lag_ms']}", file=stdout)
+    print(f"pipeline   {pipe['leads_written']}/{pipe['unique_phones']} leads, {pipe['sms_sent']} SMS, "
+          f"{pipe['redshift_rows']} rows Redshift, drain {pipe['drain_seconds']}s", file=stdout)
+    print(f"appels/lead sheets={calls['sheets']} vonage={calls['vonage']} redshift={calls['redshift']}", file=stdout)
+    print(f"résultats  {out}", file=stdout)
+    if baseline:
+        with open(baseline, "r", encoding="utf-8") as f:
+            print("comparaison avec", baseline, file=stdout)
+            print("\n".join(compare(results, json.load(f))), file=stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+
+from metrics import REGISTRY
+
+BREAKER_REJECTED = REGISTRY.counter(
+    "circuit_breaker_rejected_total", "Appels refusés sans I/O (circuit ouvert)", ("target",)
+)
+BREAKER_TRANSITIONS = REGISTRY.counter(
+    "circuit_breaker_transitions_total", "Changements d'état des disjoncteurs", ("target", "state")
+)
+
+
+# ============================================================
+# Disjoncteurs (circuit breakers) par dépendance externe
+# ============================================================
+# state_path : état partagé entre process (workers gunicorn). Ouverture et
+# fermeture y sont écrites (écriture atomique, échéance en temps absolu) ;
+# chaque process le relit quand son mtime change et adopte l'état : un
+# circuit ouvert par un worker coupe les appels de tous les autres, et
+# /health montre le même état quel que soit le process qui répond.
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Dépendance coupée : à représenter dans `retry_after` secondes."""
+
+    def __init__(self, target: str, retry_after: float):
+        super().__init__(f"{target}: circuit ouvert (nouvel essai dans {retry_after:.0f}s)")
+        self.target = target
+        self.retry_after = retry_after
+
+
+def circuit_open(error) -> CircuitOpen:
+    """Le CircuitOpen à l'origine de `error` (chaîne __cause__ / __context__), ou None."""
+    seen = 0
+    while error is not None and seen < 10:
+        if isinstance(error, CircuitOpen):
+            return error
+        error = error.__cause__ or error.__context__
+        seen += 1
+    return None
+
+
+class CircuitBreaker:
+    """
+    closed    : appels normaux ; s'ouvre si, sur les `window_seconds`
+                dernières secondes, au moins `min_calls` appels dont une part
+                >= `failure_rate` en échec
+    open      : CircuitOpen immédiat pendant `open_seconds` (aucune I/O)
+    half_open : `half_open_calls` appels d'essai ; succès -> closed, échec -> open
+    S'utilise comme `limiter` : `with breaker: appel()` ; réentrant par
+    thread (un appel imbriqué compte une fois). `is_failure(exc)` choisit
+    les exceptions qui comptent (défaut : toutes sauf CircuitOpen).
+    La fenêtre d'appels reste locale au process ; seul l'état est partagé.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        min_calls: int = 5,
+        window_seconds: float = 30,
+        open_seconds: float = 15,
+        half_open_calls: int = 1,
+        is_failure=None,
+        state_path: str = None,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._is_failure = is_failure or (lambda exc: True)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._buckets = deque()   # [seconde, succès, échecs]
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self.opened = 0
+        self.state_path = state_path
+        self._mtime = None
+
+    # ---------------- fenêtre ----------------
+    def _trim(self, now: float):
+        while self._buckets and self._buckets[0][0] <= now - self.window_seconds:
+            self._buckets.popleft()
+
+    def _counts(self):
+        ok = sum(b[1] for b in self._buckets)
+        failed = sum(b[2] for b in self._buckets)
+        return ok, failed
+
+    def _set_state(self, state: str):
+        # appelé sous self._lock
+        if state == self.state:
+            return
+        self.state = state
+        self._probes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.opened += 1
+            print(f"⛔ Circuit {self.name} ouvert ({self.open_seconds:.0f}s)")
+        elif state == CLOSED:
+            self._buckets.clear()
+            print(f"✅ Circuit {self.name} refermé")
+        BREAKER_TRANSITIONS.inc(target=self.name, state=state)
+        if state != HALF_OPEN:
+            self._save()
+
+    # ---------------- état partagé ----------------
+    def _save(self):
+        # appelé sous self._lock ; half_open reste local (essai de ce process)
+        if not self.state_path:
+            return
+        remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+        record = {
+            "state": self.state,
+            "open_until": time.time() + remaining if self.state == OPEN else 0,
+            "opened": self.opened,
+            "pid": os.getpid(),
+        }
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            tmp = "%s.%d.tmp" % (self.state_path, os.getpid())
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(record, f)
+            os.replace(tmp, self.state_path)
+            self._mtime = os.stat(self.state_path).st_mtime_ns
+        except OSError as e:
+            print(f"❌ Circuit {self.name}: état non partagé:", str(e))
+
+    def _reload(self):
+        # appelé sous self._lock
+        if not self.state_path:
+            return
+        try:
+            mtime = os.stat(self.state_path).st_mtime_ns
+            if mtime == self._mtime:
+                return
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._mtime = mtime
+        self.opened = max(self.opened, int(record.get("opened", 0)))
+        if record.get("state") == OPEN:
+            remaining = float(record.get("open_until", 0)) - time.time()
+            if remaining > 0:
+                # ouvert par un autre process : même échéance ici
+                if self.state != OPEN:
+                    print(f"⛔ Circuit {self.name} ouvert (process {record.get('pid')}, {remaining:.0f}s)")
+                self.state = OPEN
+                self._probes = 0
+                self._opened_at = time.monotonic() - (self.open_seconds - remaining)
+        elif record.get("state") == CLOSED and self.state != CLOSED:
+            print(f"✅ Circuit {self.name} refermé (process {record.get('pid')})")
+            self.state = CLOSED
+            self._probes = 0
+            self._buckets.clear()
+
+    # ---------------- appels ----------------
+    def before_call(self):
+        with self._lock:
+            self._reload()
+            if self.state == OPEN:
+                remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+                if remaining > 0:
+                    BREAKER_REJECTED.inc(target=self.name)
+                    raise CircuitOpen(self.name, remaining)
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    BREAKER_REJECTED.inc(target=self.name)
+                    raise CircuitOpen(self.name, self.open_seconds)
+                self._probes += 1
+
+    def record(self, ok: bool):
+        now = time.monotonic()
+        second = int(now)
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._set_state(CLOSED if ok else OPEN)
+                return
+            if self.state == OPEN:
+                return   # appel lancé avant l'ouverture
+            if not self._buckets or self._buckets[-1][0] != second:
+                self._buckets.append([second, 0, 0])
+            self._buckets[-1][1 if ok else 2] += 1
+            if ok:
+                return
+            self._trim(now)
+            succeeded, failed = self._counts()
+            total = succeeded + failed
+            if total >= self.min_calls and failed / total >= self.failure_rate:
+                self._set_state(OPEN)
+
+    def __enter__(self):
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            self.before_call()
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._local.depth -= 1
+        if self._local.depth:
+            return False
+        if exc_type is None:
+            self.record(True)
+        elif not isinstance(exc, CircuitOpen):
+            self.record(not self._is_failure(exc))
+        elif self.state == HALF_OPEN:
+            # essai interrompu par un autre disjoncteur : on libère la place
+            with self._lock:
+                self._probes = max(0, self._probes - 1)
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._reload()
+            self._trim(time.monotonic())
+            succeeded, failed = self._counts()
+            body = {"state": self.state, "calls": succeeded + failed, "failures": failed, "opened": self.opened}
+            if self.state == OPEN:
+                body["retry_in"] = round(max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)), 1)
+            return body
@@ -0,0 +1,30 @@
+import os
+import multiprocessing
+
+# ============================================================
+# Serveur de production : gunicorn multi-process (gthread)
+# ============================================================
+# Le démarrage des threads de fond est piloté par les hooks ci-dessous
+# (un seul process les lance, cf. élection du leader dans app.py).
+os.environ.setdefault("APP_MANAGED_START", "1")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", "8"))
+timeout = int(os.environ.get("WEB_TIMEOUT", "60"))
+# Heroku envoie SIGKILL 30s après SIGTERM
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "25"))
+keepalive = 5
+preload_app = False
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    import app
+    app.init_process()
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown_workers(timeout=graceful_timeout)
@@ -0,0 +1,99 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from cachetools import TTLCache
+
+
+# ============================================================
+# Idempotence des webhooks (retries Typeform / Unbounce / front)
+# ============================================================
+# Clé, par ordre de préférence : header Idempotency-Key, event_id
+# Typeform, sinon hash du payload JSON canonique. Vérifiée avant toute
+# normalisation / I/O / enqueue.
+
+
+def idempotency_key(scope: str, header_key: str, payload: dict) -> str:
+    if header_key:
+        return f"{scope}:h:{header_key.strip()[:200]}"
+    event_id = payload.get("event_id") if isinstance(payload, dict) else None
+    if event_id:
+        return f"{scope}:e:{event_id}"
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return f"{scope}:c:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+
+class IdempotencyStore:
+    """
+    claim(key) -> True la première fois, False pour un doublon dans le TTL.
+    Cache mémoire borné (TTLCache) devant une table SQLite optionnelle
+    (`path`) : partagée entre les workers gunicorn et conservée au
+    redémarrage. release(key) si le traitement a échoué (le retry passera).
+    """
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, ttl: float = 86400, maxsize: int = 100000, path: str = None):
+        self.ttl = ttl
+        self.path = path
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._claims = 0
+        self.duplicates = 0
+        if path:
+            self._conn().execute(
+                "CREATE TABLE IF NOT EXISTS idempotency (key TEXT PRIMARY KEY, expires_at REAL)"
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def claim(self, key: str) -> bool:
+        with self._lock:
+            if key in self._cache:
+                self.duplicates += 1
+                return False
+            self._cache[key] = True
+            self._claims += 1
+            purge = self.path and self._claims % self.PURGE_EVERY == 0
+        if not self.path:
+            return True
+
+        now = time.time()
+        try:
+            # insert, ou reprise d'une clé expirée ; rowcount 0 = déjà prise
+            cur = self._conn().execute(
+                "INSERT INTO idempotency (key, expires_at) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at "
+                "WHERE idempotency.expires_at < ?",
+                (key, now + self.ttl, now),
+            )
+            if purge:
+                self._conn().execute("DELETE FROM idempotency WHERE expires_at < ?", (now,))
+        except sqlite3.Error as e:
+            # store indisponible : on ne bloque pas la réception du lead
+            print("❌ Idempotency store error:", str(e))
+            return True
+        if cur.rowcount == 0:
+            with self._lock:
+                self.duplicates += 1
+            return False
+        return True
+
+    def release(self, key: str):
+        with self._lock:
+            self._cache.pop(key, None)
+        if self.path:
+            try:
+                self._conn().execute("DELETE FROM idempotency WHERE key = ?", (key,))
+            except sqlite3.Error as e:
+                print("❌ Idempotency release failed:", str(e))
@@ -0,0 +1,516 @@
+import os
+import json
+import time
+import zlib
+import fcntl
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import REGISTRY
+from queue_backend import QueueBackend, QUEUE_OPS
+
+
+# ============================================================
+# Journal append-only segmenté (file d'attente persistante)
+# ============================================================
+# Layout d'un répertoire de queue :
+#   00000000000000000001.seg   segments append-only, 1 record par ligne :
+#                              "<crc32 hex> <json>\n"
+#   consumer.offset            offset acquitté "segment position records_acquittés"
+#   producer.count             records ajoutés (tous process, mis à jour sous flock)
+#   .lock                      flock inter-process (plusieurs workers web)
+#
+# - put() : append en O(1) + fsync groupé (un seul fsync couvre tous les
+#   producteurs qui attendaient en même temps)
+# - get() : lecture séquentielle en O(1) ; l'offset consommateur n'avance
+#   qu'à l'ack(), jusqu'au premier élément pas encore acquitté : après un
+#   crash, tout ce qui n'a pas été ack est relu (au moins une fois)
+# - rotation quand un segment dépasse segment_bytes, suppression des
+#   segments entièrement acquittés (compaction)
+# - plusieurs process peuvent produire (append sous flock) ; un seul
+#   process consomme (cf. élection du leader dans app.py). take_over()
+#   relit l'offset acquitté sur disque : l'état consommateur chargé à
+#   l'ouverture est périmé dès que l'ancien leader a ack / supprimé des segments
+# - fsync : "always" (chaque put, groupé), "interval" (toutes les
+#   fsync_interval_ms, un crash perd au plus cet intervalle) ou "os"
+# - recovery : la fin du dernier segment est vérifiée (checksum) et une
+#   queue corrompue est coupée (copiée dans <segment>.corrupt) ; un record
+#   corrompu au milieu d'un segment est sauté à la lecture
+# - len() : producer.count - records acquittés, lus sur disque : la même
+#   profondeur vue depuis n'importe quel process
+
+SEGMENT_SUFFIX = ".seg"
+OFFSET_FILE = "consumer.offset"
+PRODUCED_FILE = "producer.count"
+_OFFSET_FMT = "%020d %020d %020d\n"
+_COUNT_FMT = "%020d\n"
+
+QUEUE_PUT_SECONDS = REGISTRY.histogram("queue_put_seconds", "Latence d'enqueue (fsync inclus)", ("queue",))
+
+FSYNC_POLICIES = ("always", "interval", "os")
+
+
+class CorruptRecord(ValueError):
+    pass
+
+
+def _encode(item) -> bytes:
+    payload = json.dumps(item, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return b"%08x " % zlib.crc32(payload) + payload + b"\n"
+
+
+def _decode(line: bytes):
+    """Ligne complète (avec \\n) -> élément ; CorruptRecord si checksum / JSON invalide."""
+    body = line[:-1]
+    if body[8:9] != b" ":
+        raise CorruptRecord("missing checksum")
+    try:
+        crc = int(body[:8], 16)
+    except ValueError:
+        raise CorruptRecord("invalid checksum")
+    payload = body[9:]
+    if zlib.crc32(payload) != crc:
+        raise CorruptRecord("checksum mismatch")
+    try:
+        return json.loads(payload)
+    except ValueError as e:
+        raise CorruptRecord(str(e))
+
+
+def _seg_name(n: int) -> str:
+    return "%020d%s" % (n, SEGMENT_SUFFIX)
+
+
+def _count_lines(path: str, start: int = 0) -> int:
+    n = 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            n += chunk.count(b"\n")
+    return n
+
+
+def _recover_tail(path: str, start: int = 0, check_bytes: int = 1 << 20) -> int:
+    """
+    Vérifie la fin d'un segment : ligne incomplète (crash pendant un write)
+    ou records invalides en fin de fichier (page non écrite, zéros...) sont
+    retirés et copiés dans <segment>.corrupt. Seuls les `check_bytes`
+    derniers octets sont relus. Retourne le nombre d'octets retirés.
+    """
+    size = os.path.getsize(path)
+    if size <= start:
+        return 0
+    with open(path, "r+b") as f:
+        begin = max(start, size - check_bytes)
+        if begin > start:
+            # se caler sur un début de ligne
+            f.seek(begin - 1)
+            if f.read(1) != b"\n":
+                f.readline()
+                begin = f.tell()
+        f.seek(begin)
+        good_end = begin
+        pos = begin
+        for line in f:
+            pos += len(line)
+            if not line.endswith(b"\n"):
+                break
+            try:
+                _decode(line)
+            except CorruptRecord:
+                continue
+            good_end = pos
+        if good_end >= size:
+            return 0
+        f.seek(good_end)
+        tail = f.read()
+        with open(path + ".corrupt", "ab") as out:
+            out.write(tail)
+        f.truncate(good_end)
+        f.flush()
+        os.fsync(f.fileno())
+    print(f"⚠️ Journal: {len(tail)} octet(s) invalides retirés en fin de {path}")
+    return len(tail)
+
+
+class SegmentedQueue(QueueBackend):
+    """
+    File FIFO durable basée sur un journal append-only segmenté.
+    Thread-safe ; enqueue et dequeue coûtent O(1) quelle que soit la taille
+    du backlog.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 8 * 1024 * 1024,
+        fsync="always",
+        name: str = None,
+        fsync_interval_ms: float = 50,
+    ):
+        self.directory = directory
+        self.name = name or os.path.basename(os.path.normpath(directory))
+        self.segment_bytes = segment_bytes
+        if fsync is True or fsync is False:
+            fsync = "always" if fsync else "os"
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {FSYNC_POLICIES}, got {fsync!r}")
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval_ms / 1000.0
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+
+        self._appended = 0   # records écrits depuis le démarrage (+ backlog initial)
+        self._synced = 0
+        self._consumed = 0
+        # lus et pas encore ack, dans l'ordre de lecture : [segment, fin du record, ack, records]
+        self._unacked = deque()
+        self._delivered = {}   # id(élément) -> entrée de _unacked
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(directory, ".lock"), os.O_CREAT | os.O_RDWR, 0o644)
+        with self._file_lock():
+            self._recover()
+
+        self._closed = threading.Event()
+        if self.fsync == "interval":
+            threading.Thread(target=self._sync_loop, name=f"{self.name}-fsync", daemon=True).start()
+
+    @contextmanager
+    def _file_lock(self):
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    # ---------------- recovery ----------------
+    def _segments(self):
+        segs = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segs.append(int(name[: -len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    pass
+        return sorted(segs)
+
+    def _path(self, seg: int) -> str:
+        return os.path.join(self.directory, _seg_name(seg))
+
+    def _recover(self):
+        segs = self._segments()
+        if not segs:
+            segs = [1]
+            open(self._path(1), "ab").close()
+
+        read_seg, read_pos, acked = segs[0], 0, 0
+        offset_path = os.path.join(self.directory, OFFSET_FILE)
+        if os.path.exists(offset_path):
+            try:
+                with open(offset_path, "r") as f:
+                    s, p, acked = (int(field) for field in f.read().split())
+                    if s >= segs[0]:
+                        read_seg, read_pos = s, p
+            except Exception:
+                pass
+        else:
+            with open(offset_path, "w") as f:
+                f.write(_OFFSET_FMT % (read_seg, read_pos, acked))
+
+        self._write_seg = segs[-1]
+        _recover_tail(self._path(self._write_seg), read_pos if read_seg == self._write_seg else 0)
+
+        # segments entièrement consommés laissés par un crash
+        for s in segs:
+            if s < read_seg:
+                try:
+                    os.remove(self._path(s))
+                except FileNotFoundError:
+                    pass
+        if read_seg > self._write_seg or not os.path.exists(self._path(read_seg)):
+            read_seg, read_pos = self._write_seg, 0
+
+        # backlog initial (scan unique au démarrage)
+        pending = 0
+        for s in self._segments():
+            if s >= read_seg:
+                pending += _count_lines(self._path(s), read_pos if s == read_seg else 0)
+        self._appended = pending
+        self._synced = pending
+        # compteur partagé recalé sur le disque (queue coupée)
+        self._produced_fd = os.open(os.path.join(self.directory, PRODUCED_FILE), os.O_CREAT | os.O_RDWR, 0o644)
+        os.pwrite(self._produced_fd, (_COUNT_FMT % (acked + pending)).encode(), 0)
+
+        self._write_fh = open(self._path(self._write_seg), "ab")
+        self._read_seg = read_seg
+        self._read_pos = read_pos
+        self._read_fh = open(self._path(read_seg), "rb")
+        self._read_fh.seek(read_pos)
+        self._offset_fd = os.open(offset_path, os.O_RDWR)
+        self._committed = (read_seg, read_pos, acked)
+
+    # ---------------- producer ----------------
+    def put(self, item):
+        self.put_many([item])
+
+    def put_many(self, items):
+        """Ajout groupé : une seule prise de verrou et un seul fsync pour le lot."""
+        if not items:
+            return
+        start = time.perf_counter()
+        lines = [_encode(item) for item in items]
+        with self._lock:
+            with self._file_lock():
+                self._follow_rotation()
+                for line in lines:
+                    self._write_fh.write(line)
+                    self._appended += 1
+                    if self._write_fh.tell() >= self.segment_bytes:
+                        self._rotate()
+                self._write_fh.flush()
+                os.pwrite(self._produced_fd, (_COUNT_FMT % (self._read_count(self._produced_fd) + len(lines))).encode(), 0)
+                seq = self._appended
+        if self.fsync == "always":
+            self._sync(seq)
+        with self._lock:
+            if len(lines) == 1:
+                self._not_empty.notify()
+            else:
+                self._not_empty.notify_all()
+        QUEUE_PUT_SECONDS.observe(time.perf_counter() - start, queue=self.name)
+        QUEUE_OPS.inc(len(lines), queue=self.name, op="put")
+
+    def _follow_rotation(self):
+        # appelé sous self._lock + flock : un autre process a pu créer des
+        # segments, et le consommateur supprimer le nôtre (st_nlink == 0)
+        # ainsi que les suivants déjà acquittés. Le plus récent existe
+        # toujours : il n'est ni supprimé ni remplacé sans le flock.
+        if os.fstat(self._write_fh.fileno()).st_nlink and not os.path.exists(self._path(self._write_seg + 1)):
+            return
+        self._write_fh.close()
+        self._write_seg = self._segments()[-1]
+        self._write_fh = open(self._path(self._write_seg), "ab")
+
+    def _rotate(self):
+        # appelé sous self._lock + flock
+        self._write_fh.flush()
+        if self.fsync != "os":
+            os.fsync(self._write_fh.fileno())
+        self._write_fh.close()
+        self._write_seg += 1
+        self._write_fh = open(self._path(self._write_seg), "ab")
+        self._synced = max(self._synced, self._appended)
+
+    def _sync(self, seq: int):
+        """
+        fsync groupé : le premier thread qui obtient _sync_lock synchronise
+        tout ce qui a été écrit jusque-là, les suivants repartent sans I/O.
+        """
+        with self._sync_lock:
+            if self._synced >= seq:
+                return
+            with self._lock:
+                target = self._appended
+                fd = os.dup(self._write_fh.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            with self._lock:
+                self._synced = max(self._synced, target)
+
+    def _sync_loop(self):
+        # politique "interval" : un fsync au plus toutes les fsync_interval
+        while not self._closed.wait(self.fsync_interval):
+            if self._synced < self._appended:
+                try:
+                    self._sync(self._appended)
+                except (OSError, ValueError):
+                    # fichier fermé pendant une rotation / close
+                    pass
+
+    # ---------------- consumer ----------------
+    def take_over(self):
+        """Reprise par un nouveau consommateur : relecture de l'offset et des segments sous flock."""
+        with self._lock:
+            with self._file_lock():
+                self._write_fh.close()
+                self._read_fh.close()
+                os.close(self._offset_fd)
+                os.close(self._produced_fd)
+                self._unacked.clear()
+                self._delivered.clear()
+                self._consumed = 0
+                self._recover()
+
+    def get(self, timeout: float = None):
+        """
+        Retourne le prochain élément, ou None si la file est vide
+        (après avoir attendu au plus `timeout` secondes si fourni).
+        L'élément reste dû (relu après un redémarrage) jusqu'à ack(item).
+        """
+        with self._lock:
+            item = self._read_next()
+            if item is None and timeout:
+                # réveil immédiat pour un put du même process ; les appends
+                # d'autres process sont vus au plus tard après `timeout`
+                self._not_empty.wait(timeout)
+                item = self._read_next()
+            return item
+
+    def _read_line(self):
+        while True:
+            line = self._read_fh.readline()
+            if not line.endswith(b"\n"):
+                # EOF (ou ligne en cours d'écriture) : on se repositionne
+                self._read_fh.seek(self._read_pos)
+                return None
+            self._read_pos += len(line)
+            self._consumed += 1
+            self._appended = max(self._appended, self._consumed)
+            entry = [self._read_seg, self._read_pos, False, 1]
+            self._unacked.append(entry)
+            try:
+                item = _decode(line)
+            except CorruptRecord as e:
+                QUEUE_OPS.inc(queue=self.name, op="corrupt")
+                print(f"⚠️ Journal {self.name}: record corrompu ignoré ({e}) segment {self._read_seg}")
+                with open(self._path(self._read_seg) + ".corrupt", "ab") as out:
+                    out.write(line)
+                entry[2] = True
+                self._advance()
+                continue
+            self._delivered[id(item)] = entry
+            QUEUE_OPS.inc(queue=self.name, op="get")
+            return item
+
+    def _read_next(self):
+        # appelé sous self._lock
+        while True:
+            item = self._read_line()
+            if item is not None:
+                return item
+            if not os.path.exists(self._path(self._read_seg + 1)):
+                return None
+            # segment suivant créé : plus aucun append ici, on relit une
+            # dernière fois avant de passer au suivant
+            item = self._read_line()
+            if item is not None:
+                return item
+            self._next_read_segment()
+
+    def _next_read_segment(self):
+        # appelé sous self._lock : le segment courant est entièrement lu ; il
+        # sera supprimé quand l'offset acquitté aura atteint le suivant
+        self._read_fh.close()
+        self._read_seg += 1
+        self._read_pos = 0
+        self._read_fh = open(self._path(self._read_seg), "rb")
+        self._unacked.append([self._read_seg, 0, True, 0])
+        self._advance()
+
+    def ack(self, item):
+        """Élément traité : l'offset avance jusqu'au premier élément encore en cours."""
+        with self._lock:
+            entry = self._delivered.pop(id(item), None)
+            if entry is None:
+                return
+            entry[2] = True
+            self._advance()
+
+    def nack(self, item, delay: float = 0):
+        """Élément à représenter : ré-ajouté en fin de journal (delay ignoré) puis ack."""
+        with self._lock:
+            if id(item) not in self._delivered:
+                return
+        self.put(item)
+        self.ack(item)
+
+    def _advance(self):
+        # appelé sous self._lock
+        done, records = None, 0
+        while self._unacked and self._unacked[0][2]:
+            done = self._unacked.popleft()
+            records += done[3]
+        if done is None:
+            return
+        old_seg = self._committed[0]
+        self._committed = (done[0], done[1], self._committed[2] + records)
+        self._commit_offset()
+        for seg in range(old_seg, done[0]):
+            try:
+                os.remove(self._path(seg))
+            except FileNotFoundError:
+                pass
+
+    def _commit_offset(self):
+        os.pwrite(self._offset_fd, (_OFFSET_FMT % self._committed).encode(), 0)
+
+    # ---------------- misc ----------------
+    @staticmethod
+    def _read_count(fd: int, field: int = 0) -> int:
+        try:
+            return int(os.pread(fd, 64, 0).split()[field])
+        except (ValueError, IndexError):
+            return 0
+
+    def __len__(self):
+        """Éléments ajoutés et pas encore acquittés (en cours inclus), tous process confondus."""
+        produced = self._read_count(self._produced_fd)
+        acked = self._read_count(self._offset_fd, 2)
+        return max(0, produced - acked)
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self._write_fh.flush()
+            os.fsync(self._write_fh.fileno())
+            self._write_fh.close()
+            self._read_fh.close()
+            os.close(self._offset_fd)
+            os.close(self._produced_fd)
+            os.close(self._lock_fd)
+
+
+def import_legacy_json(queue: QueueBackend, path: str):
+    """
+    Migre une ancienne file JSON (tableau complet réécrit à chaque opération)
+    vers la file, puis la renomme en *.migrated. Tout se passe sous un flock
+    dédié (<path>.lock) : les workers qui démarrent ensemble attendent, puis
+    ne trouvent plus rien à migrer. *.migrating marque une migration
+    interrompue (crash), reprise au démarrage suivant.
+    """
+    if not os.path.exists(path) and not os.path.exists(path + ".migrating"):
+        return 0
+    migrating = path + ".migrating"
+    fd = os.open(path + ".lock", os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            os.replace(path, migrating)
+        except FileNotFoundError:
+            # reprise d'une migration interrompue, sinon déjà faite par un autre process
+            if not os.path.exists(migrating):
+                return 0
+        try:
+            with open(migrating, "r") as f:
+                items = json.load(f)
+        except Exception as e:
+            print(f"❌ Migration {path} impossible:", str(e))
+            return 0
+        if not isinstance(items, list):
+            items = []
+        queue.put_many(items)
+        os.replace(migrating, path + ".migrated")
+    finally:
+        os.close(fd)
+    if items:
+        print(f"✅ {len(items)} élément(s) migré(s) depuis {path}")
+    return len(items)
@@ -0,0 +1,283 @@
+import re
+import json
+import unicodedata
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from phones import normalize_phone
+
+
+# ============================================================
+# Normalisation des leads (chemin rapide, un seul passage)
+# ============================================================
+ISO_FMT = "%Y-%m-%dT%H:%M:%SZ"
+_WS_RE = re.compile(r"\s+")
+# formats acceptés en plus de fromisoformat (fractions non standard, etc.)
+_FALLBACK_FORMATS = ("%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%d %H:%M:%S%z")
+
+HOUSE = "Maison ✅"
+APARTMENT = "Appartement ❌"
+OWNER = "Propriétaire ✅"
+TENANT = "Locataire ❌"
+
+
+def utc_iso() -> str:
+    return datetime.utcnow().strftime(ISO_FMT)
+
+
+def trunc(v, max_len=1000) -> str:
+    if v is None:
+        return ""
+    s = v if isinstance(v, str) else str(v)
+    return s if len(s) <= max_len else s[:max_len]
+
+
+def first_ip(xff: str) -> str:
+    if not xff:
+        return ""
+    return xff.split(",", 1)[0].strip()
+
+
+def parse_datetime(value):
+    """ISO-8601 (Z, offset ±HH:MM, fractions) -> datetime UTC, ou None."""
+    if not value:
+        return None
+    s = str(value).strip()
+    if s[-1:] in ("Z", "z"):
+        s = s[:-1] + "+00:00"
+    try:
+        dt = datetime.fromisoformat(s)
+    except ValueError:
+        dt = None
+        for fmt in _FALLBACK_FORMATS:
+            try:
+                dt = datetime.strptime(s, fmt)
+                break
+            except ValueError:
+                pass
+        if dt is None:
+            return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def format_iso(dt: datetime) -> str:
+    return "%04d-%02d-%02dT%02d:%02d:%02dZ" % (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+
+
+def parse_iso(dt_str: str) -> str:
+    """
+    Normalise une date ISO reçue (avec ou sans ms / offset), sinon now UTC.
+    Output: YYYY-MM-DDTHH:MM:SSZ
+    """
+    dt = parse_datetime(dt_str)
+    return format_iso(dt) if dt is not None else utc_iso()
+
+
+def display_date(iso: str) -> str:
+    """YYYY-MM-DDTHH:MM:SSZ -> "DD-MM-YYYY HH:MM" (affichage sheet)."""
+    return f"{iso[8:10]}-{iso[5:7]}-{iso[0:4]} {iso[11:16]}"
+
+
+@lru_cache(maxsize=2048)
+def norm_txt(s: str) -> str:
+    if not s:
+        return ""
+    # étoiles typeform "*...*", accents, casse, espaces
+    s = unicodedata.normalize("NFKD", s.replace("*", " ")).encode("ascii", "ignore").decode("ascii")
+    return _WS_RE.sub(" ", s.lower()).strip()
+
+
+@lru_cache(maxsize=1024)
+def classify_choice(raw_label: str) -> tuple:
+    """Libellé libre -> (type habitation, statut), "" si non reconnu."""
+    label = norm_txt(raw_label)
+    type_label = HOUSE if "maison" in label else APARTMENT if "appartement" in label else ""
+    # propriet couvre proprietaire / propriete, locat couvre locataire / location
+    own_label = OWNER if "propriet" in label else TENANT if "locat" in label else ""
+    return type_label, own_label
+
+
+def merge_analytics(analytics_str: str, extra: dict) -> str:
+    """
+    analytics est stocké dans Redshift en VARCHAR(1000).
+    On essaie de conserver du JSON et d'ajouter ip/headers côté serveur.
+    """
+    base = None
+    if analytics_str:
+        if analytics_str.lstrip()[:1] == "{":
+            try:
+                base = json.loads(analytics_str)
+            except ValueError:
+                base = None
+        if not isinstance(base, dict):
+            base = {"raw": analytics_str}
+        base.update(extra)
+    else:
+        base = extra
+    return trunc(json.dumps(base, separators=(",", ":"), ensure_ascii=False), 1000)
+
+
+# ============================================================
+# Lead typé (format interne) <-> dict typeform-like (files)
+# ============================================================
+class LeadRecord:
+    """
+    Lead normalisé, sans dict imbriqués. Les files gardent le format
+    typeform-like (to_queue / from_queue) : compatible avec les éléments
+    déjà en attente et les dead-letters.
+    """
+
+    __slots__ = (
+        "telephone", "nom", "prenom", "email", "code_postal", "civilite", "utm_source", "code",
+        "submitted_at", "type_label", "own_label", "page",
+    )
+    HIDDEN = ("telephone", "nom", "prenom", "email", "code_postal", "civilite", "utm_source", "code")
+
+    def __init__(self, telephone="", nom="", prenom="", email="", code_postal="", civilite="",
+                 utm_source="", code="", submitted_at="", type_label="", own_label="", page=""):
+        self.telephone = telephone
+        self.nom = nom
+        self.prenom = prenom
+        self.email = email
+        self.code_postal = code_postal
+        self.civilite = civilite
+        self.utm_source = utm_source
+        self.code = code
+        self.submitted_at = submitted_at
+        self.type_label = type_label
+        self.own_label = own_label
+        self.page = page
+
+    @classmethod
+    def from_flat(cls, data: dict) -> "LeadRecord":
+        """Payload React "plat"."""
+        get = data.get
+        prop = get("property_type") or get("reponse_1") or get("propertyType") or ""
+        own = get("ownership_status") or get("reponse_2") or get("ownershipStatus") or ""
+        telephone = get("telephone", "")
+        return cls(
+            normalize_phone(telephone) or telephone, get("nom", ""), get("prenom", ""), get("email", ""),
+            get("code_postal", ""), get("civilite", ""), get("utm_source", ""), get("code", ""),
+            parse_iso(get("submitted_at") or get("date_import") or get("timestamp")),
+            HOUSE if prop == "house" else APARTMENT if prop == "apartment" else "",
+            OWNER if own == "owner" else TENANT if own == "tenant" else "",
+            get("page", ""),
+        )
+
+    @classmethod
+    def from_queue(cls, lead: dict) -> "LeadRecord":
+        fr = lead["form_response"]
+        hidden = fr["hidden"]
+        answers = fr.get("answers", []) or []
+        return cls(
+            *(hidden.get(name, "") for name in cls.HIDDEN),
+            fr.get("submitted_at", ""),
+            (answers[0].get("choice", {}).get("label", "") or "") if len(answers) > 0 else "",
+            (answers[1].get("choice", {}).get("label", "") or "") if len(answers) > 1 else "",
+            lead.get("page", ""),
+        )
+
+    def to_queue(self) -> dict:
+        return {
+            "form_response": {
+                "hidden": {
+                    "telephone": self.telephone,
+                    "nom": self.nom,
+                    "prenom": self.prenom,
+                    "email": self.email,
+                    "code_postal": self.code_postal,
+                    "civilite": self.civilite,
+                    "utm_source": self.utm_source,
+                    "code": self.code,
+                },
+                "submitted_at": self.submitted_at,
+                "answers": [
+                    {"type": "choice", "choice": {"label": self.type_label}},
+                    {"type": "choice", "choice": {"label": self.own_label}},
+                ],
+            },
+            "page": self.page,
+        }
+
+
+def normalize_lead(data: dict) -> dict:
+    """
+    Convertit un payload React "plat" vers le format attendu par process_lead
+    (typeform-like: form_response.hidden + form_response.answers).
+    Si déjà au format typeform, renvoie tel quel (date et téléphone normalisés).
+    Le téléphone passe en E.164 ; un numéro invalide est gardé tel quel
+    (process_lead l'écarte avant tout appel réseau).
+    """
+    if isinstance(data, dict) and "form_response" in data:
+        fr = data.get("form_response", {})
+        fr["submitted_at"] = parse_iso(fr.get("submitted_at"))
+        hidden = fr.get("hidden")
+        if isinstance(hidden, dict) and hidden.get("telephone"):
+            hidden["telephone"] = normalize_phone(hidden["telephone"]) or hidden["telephone"]
+
+        # question "tout en une" : un seul choix -> les 2 réponses attendues
+        answers = fr.get("answers", []) or []
+        if len(answers) == 1:
+            raw_label = (answers[0].get("choice", {}) or {}).get("label", "") or ""
+            type_label, own_label = classify_choice(raw_label)
+            if type_label or own_label:
+                fr["answers"] = [
+                    {"type": "choice", "choice": {"label": type_label}},
+                    {"type": "choice", "choice": {"label": own_label}},
+                ]
+
+        data["form_response"] = fr
+        return data
+
+    return LeadRecord.from_flat(data).to_queue()
+
+
+_REDSHIFT_TEXT = ("civilite", "code", "code_postal", "cohort", "email", "nom", "prenom", "telephone", "utm_source")
+_REDSHIFT_MID = ("network_id", "browser")
+_REDSHIFT_ANSWERS = ("reponse_1", "reponse_2", "reponse_3")
+
+
+def normalize_redshift_row(payload: dict, req) -> dict:
+    """
+    Attend le payload React "plat" et retourne une row conforme à la table Redshift.
+    Champs attendus:
+      analytics, civilite, code, code_postal, cohort, email, nom, prenom, telephone, utm_source,
+      user_agent, platform, referer, network_id, browser, date_import, submitted_at,
+      reponse_1, reponse_2, reponse_3
+    """
+    headers = req.headers
+    get = payload.get
+    xff = headers.get("X-Forwarded-For", "")
+    now = utc_iso()
+
+    submitted = parse_datetime(get("submitted_at") or get("timestamp"))
+    submitted_at = format_iso(submitted) if submitted is not None else now
+    date_import = get("date_import")
+    date_import = parse_iso(date_import) if date_import else submitted_at
+
+    row = {
+        "analytics": merge_analytics(
+            trunc(get("analytics", ""), 1000),
+            {
+                "ip": first_ip(xff) or (req.remote_addr or ""),
+                "xff": xff,
+                "accept_language": headers.get("Accept-Language", ""),
+                "server_received_at": now,
+            },
+        ),
+    }
+    for name in _REDSHIFT_TEXT:
+        row[name] = trunc(get(name, ""), 1000)
+    row["telephone"] = normalize_phone(row["telephone"]) or row["telephone"]
+    row["user_agent"] = trunc(get("user_agent") or headers.get("User-Agent", ""), 1000)
+    row["platform"] = trunc(get("platform", ""), 1000)
+    row["referer"] = trunc(get("referer") or headers.get("Referer", ""), 1000)
+    for name in _REDSHIFT_MID:
+        row[name] = trunc(get(name, ""), 1000)
+    row["date_import"] = trunc(date_import, 1000)
+    row["submitted_at"] = trunc(submitted_at, 1000)
+    for name in _REDSHIFT_ANSWERS:
+        row[name] = trunc(get(name, ""), 50)
+    return row
@@ -0,0 +1,392 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import threading
+from contextlib import contextmanager
+
+
+# ============================================================
+# Métriques format Prometheus (texte), sans dépendance externe
+# ============================================================
+# - Counter / Histogram : incrément en O(1) sous un petit verrou
+# - Gauge : fonction évaluée seulement au scrape (coût nul sinon)
+# Sous gunicorn, MultiProcessCollector agrège les process via un dossier
+# partagé : counters / histogrammes sommés (process morts compris), gauges
+# prises au leader, sommées, ou évaluées localement (état déjà partagé).
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _fmt_labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def _fmt_value(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self, values=None):
+        items = (self.snapshot() if values is None else values).items()
+        for key, v in items:
+            yield self.name, _fmt_labels(self.labelnames, key), v
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}   # key -> [counts par bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {k: list(v) for k, v in self._values.items()}
+
+    def samples(self, values=None):
+        items = (self.snapshot() if values is None else values).items()
+        for key, state in items:
+            cumulative = 0
+            for i, b in enumerate(self.buckets):
+                cumulative += state[i]
+                yield self.name + "_bucket", _fmt_labels(self.labelnames, key, ("le", _fmt_value(b))), cumulative
+            yield self.name + "_bucket", _fmt_labels(self.labelnames, key, ("le", "+Inf")), state[-1]
+            yield self.name + "_sum", _fmt_labels(self.labelnames, key), state[-2]
+            yield self.name + "_count", _fmt_labels(self.labelnames, key), state[-1]
+
+
+GAUGE_MODES = ("leader", "sum", "local")
+
+
+class Gauge:
+    """
+    Valeur calculée au scrape : fn() -> nombre, ou {labels_tuple: nombre}.
+    multiprocess : "leader" (état tenu par le leader), "sum" (somme des
+    process) ou "local" (évaluée par le process qui sert /metrics).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn, labelnames=(), multiprocess: str = "leader"):
+        if multiprocess not in GAUGE_MODES:
+            raise ValueError(f"multiprocess must be one of {GAUGE_MODES}, got {multiprocess!r}")
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.multiprocess = multiprocess
+
+    def snapshot(self) -> dict:
+        try:
+            value = self.fn()
+        except Exception:
+            return {}
+        if isinstance(value, dict):
+            return {(k if isinstance(k, tuple) else (k,)): v for k, v in value.items()}
+        return {(): value}
+
+    def samples(self, values=None):
+        for key, v in (self.snapshot() if values is None else values).items():
+            yield self.name, _fmt_labels(self.labelnames, key), v
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, fn, labelnames=(), multiprocess: str = "leader") -> Gauge:
+        return self._register(Gauge(name, help, fn, labelnames, multiprocess))
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self, values=None) -> str:
+        """values : {nom: {labels_tuple: valeur}} déjà agrégées ; les autres sont lues localement."""
+        values = values or {}
+        lines = []
+        for m in self.metrics():
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples(values.get(m.name)):
+                lines.append(f"{name}{labels} {_fmt_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# ============================================================
+# Agrégation multi-process (workers gunicorn)
+# ============================================================
+# <dir>/<pid>-<id>.json : snapshot d'un process, réécrit toutes les
+#                         `interval` secondes (écriture atomique)
+# <dir>/archive.json    : counters / histogrammes des process arrêtés
+# <dir>/.lock           : flock pendant les replis dans l'archive
+# Un process mort sans close() (kill -9) est replié par le prochain scrape :
+# les counters ne repartent jamais de zéro quand gunicorn recycle un worker.
+
+ARCHIVE_FILE = "archive.json"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _encode_values(values: dict) -> list:
+    return [[list(k), v] for k, v in values.items()]
+
+
+def _merge(into: dict, entries: list):
+    """Somme entries ([[labels, valeur]], format JSON) dans into, par nom de labels."""
+    for key, v in entries:
+        key = tuple(key)
+        current = into.get(key)
+        if current is None:
+            into[key] = list(v) if isinstance(v, list) else v
+        elif isinstance(v, list):
+            into[key] = [a + b for a, b in zip(current, v)]
+        else:
+            into[key] = current + v
+
+
+class MultiProcessCollector:
+    """
+    Sert /metrics pour tous les process : chaque process publie un snapshot
+    dans `directory`, render() les agrège (le process courant en direct).
+    role : fn() -> "leader" | "web", pour les gauges "leader".
+    """
+
+    def __init__(self, registry: Registry, directory: str, interval: float = 5.0, role=lambda: "web"):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.role = role
+        self._path = os.path.join(directory, "%d-%s.json" % (os.getpid(), uuid.uuid4().hex[:8]))
+        self._stop = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._publish()
+        self._thread = threading.Thread(target=self._loop, name="metrics-snapshot", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._publish()
+            except Exception as e:
+                print("❌ Snapshot métriques:", str(e))
+
+    def _snapshot(self) -> dict:
+        counters, gauges = {}, {}
+        for m in self.registry.metrics():
+            if m.kind != "gauge":
+                counters[m.name] = _encode_values(m.snapshot())
+            elif m.multiprocess != "local":
+                gauges[m.name] = _encode_values(m.snapshot())
+        return {"pid": os.getpid(), "role": self.role(), "counters": counters, "gauges": gauges}
+
+    def _publish(self):
+        tmp = self._path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._snapshot(), f)
+        os.replace(tmp, self._path)
+
+    @contextmanager
+    def _dir_lock(self):
+        fd = os.open(os.path.join(self.directory, ".lock"), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _read(path: str):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_archive(self, archive: dict):
+        path = os.path.join(self.directory, ARCHIVE_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"counters": archive}, f)
+        os.replace(path + ".tmp", path)
+
+    def _fold(self, archive: dict, snapshot: dict):
+        for name, entries in snapshot.get("counters", {}).items():
+            merged = {}
+            _merge(merged, archive.get(name, []))
+            _merge(merged, entries)
+            archive[name] = _encode_values(merged)
+
+    def render(self) -> str:
+        own = self._snapshot()
+        live = [own]
+        totals = {}
+        now = time.time()
+        with self._dir_lock():
+            archive = (self._read(os.path.join(self.directory, ARCHIVE_FILE)) or {}).get("counters", {})
+            folded = False
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not name.endswith(".json") or name == ARCHIVE_FILE or path == self._path:
+                    continue
+                data = self._read(path)
+                if data is None:
+                    continue
+                if not _pid_alive(data.get("pid", 0)):
+                    self._fold(archive, data)
+                    os.remove(path)
+                    folded = True
+                    continue
+                for metric, entries in data.get("counters", {}).items():
+                    _merge(totals.setdefault(metric, {}), entries)
+                try:
+                    if now - os.path.getmtime(path) <= 3 * self.interval:
+                        live.append(data)
+                except OSError:
+                    pass
+            if folded:
+                self._write_archive(archive)
+        for source in (archive, own["counters"]):
+            for metric, entries in source.items():
+                _merge(totals.setdefault(metric, {}), entries)
+
+        values = {}
+        for m in self.registry.metrics():
+            if m.kind != "gauge":
+                values[m.name] = totals.get(m.name, {})
+            elif m.multiprocess == "sum":
+                merged = values[m.name] = {}
+                for data in live:
+                    _merge(merged, data["gauges"].get(m.name, []))
+            elif m.multiprocess == "leader":
+                # pas de leader vivant : rien plutôt que les valeurs d'un process web
+                leader = next((d for d in live if d.get("role") == "leader"), None)
+                values[m.name] = {}
+                if leader is not None:
+                    _merge(values[m.name], leader["gauges"].get(m.name, []))
+        return self.registry.render(values)
+
+    def close(self):
+        """Replie les counters de ce process dans l'archive (arrêt propre)."""
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        os.makedirs(self.directory, exist_ok=True)
+        with self._dir_lock():
+            path = os.path.join(self.directory, ARCHIVE_FILE)
+            archive = (self._read(path) or {}).get("counters", {})
+            self._fold(archive, self._snapshot())
+            self._write_archive(archive)
+            try:
+                os.remove(self._path)
+            except FileNotFoundError:
+                pass
+
+
+REGISTRY = Registry()
+
+# Appels aux services externes (Sheets, Vonage, Redshift, S3)
+EXTERNAL_CALL_SECONDS = REGISTRY.histogram(
+    "external_call_seconds", "Latence des appels externes", ("target", "op")
+)
+EXTERNAL_CALLS = REGISTRY.counter(
+    "external_calls_total", "Appels externes par résultat", ("target", "op", "result")
+)
+
+
+@contextmanager
+def track(target: str, op: str):
+    """Chronomètre + compte un appel externe (result=ok|error)."""
+    start = time.perf_counter()
+    result = "error"
+    try:
+        yield
+        result = "ok"
+    finally:
+        EXTERNAL_CALL_SECONDS.observe(time.perf_counter() - start, target=target, op=op)
+        EXTERNAL_CALLS.inc(target=target, op=op, result=result)
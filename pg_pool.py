@@ -0,0 +1,167 @@
+import time
+import threading
+
+from metrics import REGISTRY
+
+POOL_WAIT_SECONDS = REGISTRY.histogram(
+    "db_pool_wait_seconds", "Attente d'une connexion libre", ("pool",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0),
+)
+POOL_EVENTS = REGISTRY.counter(
+    "db_pool_connections_total", "Connexions créées / jetées / recyclées", ("pool", "event")
+)
+
+
+# ============================================================
+# Pool de connexions Postgres/Redshift thread-safe
+# ============================================================
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Remplace psycopg2 SimpleConnectionPool (pas thread-safe) :
+    - getconn() attend au plus `checkout_timeout` quand le pool est plein
+    - validation au checkout (connexion fermée, ou "SELECT 1" si inactive
+      depuis `validate_after` secondes)
+    - putconn(conn, close=True) jette une connexion cassée
+    - recyclage des connexions plus vieilles que `max_lifetime`
+    - closeall() à l'arrêt : les connexions rendues ensuite sont fermées
+    `connect()` crée une connexion (keepalives TCP dans ses paramètres).
+    """
+
+    def __init__(
+        self,
+        connect,
+        maxconn: int = 5,
+        checkout_timeout: float = 10,
+        max_lifetime: float = 3600,
+        validate_after: float = 30,
+        name: str = "redshift",
+    ):
+        self._connect = connect
+        self.maxconn = maxconn
+        self.checkout_timeout = checkout_timeout
+        self.max_lifetime = max_lifetime
+        self.validate_after = validate_after
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._idle = []        # [(conn, created_at, last_used)] LIFO
+        self._in_use = {}      # id(conn) -> created_at
+        self._opening = 0
+        self._closed = False
+        self.waits = 0
+        self.timeouts = 0
+
+    # ---------------- checkout ----------------
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                    self._in_use[id(conn)] = created_at
+                    break
+                if len(self._in_use) + self._opening < self.maxconn:
+                    self._opening += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"{self.name}: pas de connexion libre après {self.checkout_timeout}s")
+                if not waited:
+                    waited = True
+                    self.waits += 1
+                self._cond.wait(remaining)
+
+        if conn is None:
+            conn = self._open()
+        elif not self._usable(conn, created_at, last_used):
+            self._discard(conn, "discarded")
+            with self._cond:
+                self._opening += 1
+            conn = self._open()
+        POOL_WAIT_SECONDS.observe(time.monotonic() - start, pool=self.name)
+        return conn
+
+    def _open(self):
+        # appelé avec une place réservée (_opening)
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._opening -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opening -= 1
+            self._in_use[id(conn)] = time.monotonic()
+        POOL_EVENTS.inc(pool=self.name, event="created")
+        return conn
+
+    def _usable(self, conn, created_at: float, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - created_at > self.max_lifetime:
+            POOL_EVENTS.inc(pool=self.name, event="recycled")
+            return False
+        if time.monotonic() - last_used < self.validate_after:
+            return True
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    # ---------------- return ----------------
+    def putconn(self, conn, close: bool = False):
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+        if created_at is None:
+            return
+        expired = time.monotonic() - created_at > self.max_lifetime
+        if close or conn.closed or expired or self._closed:
+            self._discard(conn, "recycled" if expired and not close else "discarded")
+            with self._cond:
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, conn, event: str):
+        with self._cond:
+            self._in_use.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+        POOL_EVENTS.inc(pool=self.name, event=event)
+
+    # ---------------- misc ----------------
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "max": self.maxconn,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+            }
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
@@ -0,0 +1,94 @@
+from collections import namedtuple
+from functools import lru_cache
+
+
+# ============================================================
+# Normalisation des téléphones (E.164) : clé unique de dédup / SMS
+# ============================================================
+# "+33 6 12 34 56 78", "0033612345678", "06.12.34.56.78", "33612345678"
+# et "612345678" donnent tous "+33612345678". Le résultat est mis en cache :
+# un numéro déjà vu ne coûte qu'un lookup.
+
+PhoneInfo = namedtuple("PhoneInfo", "e164 kind")   # kind "" = invalide
+
+INVALID = PhoneInfo("", "")
+
+# indicatifs traités avec les règles françaises (numéro national à 9 chiffres)
+FR_CODES = ("33", "262", "590", "594", "596")
+
+# premier chiffre du numéro national (sans le 0) -> type de ligne
+FR_KINDS = {
+    "1": "landline", "2": "landline", "3": "landline", "4": "landline", "5": "landline",
+    "6": "mobile", "7": "mobile", "8": "special", "9": "voip",
+}
+
+# préfixes nationaux des DOM (sans le 0) -> indicatif ; 0692... = +262 692...
+OVERSEAS_PREFIXES = {
+    "262": "262", "263": "262", "269": "262", "639": "262", "692": "262", "693": "262",
+    "590": "590", "690": "590", "691": "590",
+    "594": "594", "694": "594",
+    "596": "596", "696": "596", "697": "596",
+}
+OVERSEAS_MOBILE = {"639", "692", "693", "690", "691", "694", "696", "697"}
+
+# types de ligne auxquels on envoie un SMS (étranger : on laisse Vonage juger)
+SMS_KINDS = ("mobile", "foreign")
+
+
+def _french(cc: str, nsn: str) -> PhoneInfo:
+    if len(nsn) != 9 or nsn[0] == "0":
+        return INVALID
+    overseas = OVERSEAS_PREFIXES.get(nsn[:3])
+    if overseas:
+        # +33 692... (saisi avec l'indicatif métropole) : c'est un numéro de La Réunion
+        cc = overseas
+    elif cc != "33":
+        return INVALID
+    if cc == "33":
+        kind = FR_KINDS.get(nsn[0], "")
+    else:
+        kind = "mobile" if nsn[:3] in OVERSEAS_MOBILE else "landline"
+    return PhoneInfo("+" + cc + nsn, kind) if kind else INVALID
+
+
+@lru_cache(maxsize=65536)
+def parse_phone(raw: str) -> PhoneInfo:
+    """Numéro tel que reçu -> PhoneInfo(e164, kind) ; INVALID si inexploitable."""
+    s = str(raw or "").strip()
+    digits = "".join(c for c in s if c.isdigit())
+    if not digits:
+        return INVALID
+
+    if s.startswith("+"):
+        intl = digits
+    elif digits.startswith("00"):
+        intl = digits[2:]
+    elif digits.startswith("0"):
+        # format national : 06..., 0692...
+        return _french("33", digits[1:])
+    elif len(digits) == 9 and digits[0] in "67":
+        # mobile saisi sans le 0
+        return _french("33", digits)
+    else:
+        # format historique sans "+" (33612345678)
+        intl = digits
+
+    for cc in FR_CODES:
+        if intl.startswith(cc):
+            nsn = intl[len(cc):]
+            # "+33 (0)6..." : le 0 national en trop
+            if len(nsn) == 10 and nsn[0] == "0":
+                nsn = nsn[1:]
+            return _french(cc, nsn)
+    if 8 <= len(intl) <= 15 and intl[0] != "0":
+        return PhoneInfo("+" + intl, "foreign")
+    return INVALID
+
+
+def normalize_phone(raw) -> str:
+    """Forme E.164 ("+33612345678"), "" si le numéro est invalide."""
+    return parse_phone(raw if isinstance(raw, str) else str(raw or "")).e164
+
+
+def sms_capable(phone) -> bool:
+    return parse_phone(phone if isinstance(phone, str) else str(phone or "")).kind in SMS_KINDS
@@ -0,0 +1,283 @@
+import os
+import abc
+import json
+import time
+import sqlite3
+import threading
+
+from metrics import REGISTRY
+
+
+# ============================================================
+# Backends de file : interface commune + implémentation SQLite
+# ============================================================
+# QUEUE_BACKEND=journal (défaut, journal.SegmentedQueue) ou sqlite.
+# Les consommateurs appellent ack(item) une fois l'élément traité : avance
+# de l'offset pour le journal, fin du bail pour SQLite. Un élément lu mais
+# pas ack est relivré après un crash ou un redémarrage.
+
+QUEUE_OPS = REGISTRY.counter("queue_ops_total", "Enqueue / dequeue par file", ("queue", "op"))
+
+
+class QueueBackend(abc.ABC):
+    """
+    put(item) / put_many(items) : enqueue durable
+    get(timeout) -> item | None : prochain élément (attente bornée)
+    ack(item) : traitement terminé ; nack(item, delay) : à représenter plus tard
+    take_over() : ce process devient le consommateur (leader élu)
+    len(queue) : éléments en attente ; close()
+    """
+
+    name = "queue"
+
+    def put(self, item):
+        self.put_many([item])
+
+    @abc.abstractmethod
+    def put_many(self, items):
+        ...
+
+    @abc.abstractmethod
+    def get(self, timeout: float = None):
+        ...
+
+    def ack(self, item):
+        pass
+
+    def nack(self, item, delay: float = 0):
+        # remis en file avant l'ack : un put qui échoue ne perd pas l'élément
+        self.put(item)
+        self.ack(item)
+
+    def take_over(self):
+        pass
+
+    @abc.abstractmethod
+    def __len__(self):
+        ...
+
+    def close(self):
+        pass
+
+
+class SqliteQueue(QueueBackend):
+    """
+    File dans une table SQLite (WAL), partagée par tous les process.
+    Un élément est "réservé" par bail (lease) : s'il n'est pas ack avant
+    `lease_seconds` (crash du consommateur), il redevient disponible.
+    get() réserve `batch_size` lignes par transaction et les sert une à une ;
+    le bail d'une ligne servie à moins d'un demi-bail de son expiration est
+    prolongé (sinon un autre consommateur a pu la reprendre : elle est sautée).
+    Les éléments livrés sont gardés `retention_seconds` puis purgés.
+    len() est mis en cache `len_ttl` secondes (/metrics, /ready).
+    """
+
+    PURGE_EVERY = 1000
+
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        lease_seconds: float = 300,
+        batch_size: int = 32,
+        retention_seconds: float = 86400,
+        poll_seconds: float = 0.2,
+        len_ttl: float = 1.0,
+    ):
+        self.path = path
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        self.retention_seconds = retention_seconds
+        self.poll_seconds = poll_seconds
+        self.len_ttl = len_ttl
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._buffer = []     # (rowid, item, lease_until) réservés, pas encore servis
+        self._leases = {}     # id(item) -> (rowid, lease_until)
+        self._acks = 0
+        self._len = None      # (monotonic, valeur) : cache de len()
+
+        conn = self._conn()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")   # effectif seulement sur une base neuve
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue_items ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " queue TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'ready',"      # ready | leased | done
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL,"
+            " lease_until REAL,"
+            " created_at REAL NOT NULL,"
+            " done_at REAL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS queue_items_claim ON queue_items (queue, status, next_attempt_at)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS queue_items_lease ON queue_items (queue, status, lease_until)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---------------- producer ----------------
+    def put_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (self.name, json.dumps(item, ensure_ascii=False, separators=(",", ":")), now, now)
+            for item in items
+        ]
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO queue_items (queue, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?)", rows
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self._not_empty.notify_all()
+        QUEUE_OPS.inc(len(rows), queue=self.name, op="put")
+
+    # ---------------- consumer ----------------
+    def _claim(self):
+        """Réserve jusqu'à batch_size lignes dues (ou au bail expiré) en une transaction."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, payload FROM queue_items WHERE queue = ? AND status = 'ready' AND next_attempt_at <= ? "
+                "UNION ALL "
+                "SELECT id, payload FROM queue_items WHERE queue = ? AND status = 'leased' AND lease_until < ? "
+                "ORDER BY id LIMIT ?",
+                (self.name, now, self.name, now, self.batch_size),
+            ).fetchall()
+            lease_until = now + self.lease_seconds
+            if rows:
+                conn.execute(
+                    f"UPDATE queue_items SET status = 'leased', lease_until = ?, attempts = attempts + 1 "
+                    f"WHERE id IN ({','.join('?' * len(rows))})",
+                    [lease_until] + [r[0] for r in rows],
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [(rowid, json.loads(payload), lease_until) for rowid, payload in rows]
+
+    def _renew(self, rowid: int, lease_until: float):
+        """Nouveau lease_until si la ligne est toujours à nous (même lease_until), sinon None."""
+        renewed = time.time() + self.lease_seconds
+        cur = self._conn().execute(
+            "UPDATE queue_items SET lease_until = ? WHERE id = ? AND status = 'leased' AND lease_until = ?",
+            (renewed, rowid, lease_until),
+        )
+        return renewed if cur.rowcount == 1 else None
+
+    def get(self, timeout: float = None):
+        deadline = time.monotonic() + (timeout or 0)
+        with self._lock:
+            while True:
+                if not self._buffer:
+                    self._buffer = self._claim()
+                while self._buffer:
+                    rowid, item, lease_until = self._buffer.pop(0)
+                    if lease_until - time.time() < self.lease_seconds / 2:
+                        lease_until = self._renew(rowid, lease_until)
+                        if lease_until is None:
+                            continue   # bail expiré et repris par un autre consommateur
+                    self._leases[id(item)] = (rowid, lease_until)
+                    QUEUE_OPS.inc(queue=self.name, op="get")
+                    return item
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                # réveil par un put du même process, sinon polling (autres process)
+                self._not_empty.wait(min(self.poll_seconds, remaining))
+
+    def ack(self, item):
+        with self._lock:
+            lease = self._leases.pop(id(item), None)
+            self._acks += 1
+            purge = self._acks % self.PURGE_EVERY == 0
+        if lease is None:
+            return
+        # bail repris entre-temps par un autre consommateur : c'est à lui de conclure
+        self._conn().execute(
+            "UPDATE queue_items SET status = 'done', done_at = ?, lease_until = NULL "
+            "WHERE id = ? AND status = 'leased' AND lease_until = ?",
+            (time.time(), *lease),
+        )
+        if purge:
+            self.purge()
+
+    def nack(self, item, delay: float = 0):
+        with self._lock:
+            lease = self._leases.pop(id(item), None)
+        if lease is None:
+            return
+        self._conn().execute(
+            "UPDATE queue_items SET status = 'ready', next_attempt_at = ?, lease_until = NULL "
+            "WHERE id = ? AND status = 'leased' AND lease_until = ?",
+            (time.time() + delay, *lease),
+        )
+
+    # ---------------- maintenance ----------------
+    def purge(self) -> int:
+        """Supprime les éléments livrés plus vieux que retention_seconds et rend la place."""
+        conn = self._conn()
+        cur = conn.execute(
+            "DELETE FROM queue_items WHERE queue = ? AND status = 'done' AND done_at < ?",
+            (self.name, time.time() - self.retention_seconds),
+        )
+        if cur.rowcount:
+            conn.execute("PRAGMA incremental_vacuum")
+        return cur.rowcount
+
+    def __len__(self):
+        cached = self._len
+        if cached is not None and time.monotonic() - cached[0] < self.len_ttl:
+            return cached[1]
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM queue_items WHERE queue = ? AND status != 'done'", (self.name,)
+        ).fetchone()
+        self._len = (time.monotonic(), row[0])
+        return row[0]
+
+    def close(self):
+        # éléments réservés mais pas servis : rendus tout de suite
+        with self._lock:
+            buffered, self._buffer = self._buffer, []
+        if buffered:
+            self._conn().execute(
+                f"UPDATE queue_items SET status = 'ready', lease_until = NULL "
+                f"WHERE id IN ({','.join('?' * len(buffered))})",
+                [rowid for rowid, _, _ in buffered],
+            )
+
+
+def open_queue(backend: str, directory: str, name: str, **options) -> QueueBackend:
+    """
+    backend "journal" : journal.SegmentedQueue dans directory/name
+    backend "sqlite"  : SqliteQueue dans directory/queues.db (une table, une colonne queue)
+    """
+    if backend == "sqlite":
+        os.makedirs(directory, exist_ok=True)
+        return SqliteQueue(os.path.join(directory, "queues.db"), name, **options)
+    if backend == "journal":
+        from journal import SegmentedQueue
+        return SegmentedQueue(os.path.join(directory, name), name=name, **options)
+    raise ValueError(f"unknown queue backend {backend!r}")
@@ -0,0 +1,223 @@
+import gzip
+import json
+import time
+import uuid
+import threading
+from contextlib import nullcontext
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from metrics import track, REGISTRY
+
+REDSHIFT_ROWS = REGISTRY.counter("redshift_rows_total", "Rows Redshift par mode et résultat", ("mode", "result"))
+
+
+# ============================================================
+# Ingestion Redshift par micro-batchs
+# ============================================================
+# - petits batchs : INSERT multi-lignes (execute_values), 1 transaction
+# - gros batchs   : fichier NDJSON gzip sur S3 + COPY (si S3 configuré)
+# Flush déclenché par taille (flush_rows) ou par âge (flush_seconds).
+# on_flushed(rows) est appelé une fois le batch inséré (ou confié à
+# on_failure) : c'est là que la file source peut ack ses éléments. Si
+# on_failure échoue, on_dropped(rows) rend la main à la source (nack) pour
+# que sa progression continue.
+
+
+class RedshiftIngestor:
+    def __init__(
+        self,
+        get_pool,
+        table: str,
+        columns: tuple,
+        flush_rows: int = 500,
+        flush_seconds: float = 2.0,
+        copy_min_rows: int = 200,
+        s3_bucket: str = "",
+        s3_prefix: str = "redshift-staging",
+        iam_role: str = "",
+        s3_endpoint_url: str = None,
+        on_failure=None,
+        retry_delay: float = 5.0,
+        breaker=None,
+        on_flushed=None,
+        on_dropped=None,
+    ):
+        self._get_pool = get_pool
+        self.table = table
+        self.columns = columns
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.copy_min_rows = copy_min_rows
+        self.s3_bucket = s3_bucket
+        self.s3_prefix = s3_prefix.strip("/")
+        self.iam_role = iam_role
+        self.s3_endpoint_url = s3_endpoint_url
+        self.on_failure = on_failure
+        self.on_flushed = on_flushed
+        self.on_dropped = on_dropped
+        self.retry_delay = retry_delay
+        self._breaker = breaker or nullcontext()
+
+        self._buffer = []
+        self._first_at = None
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._s3 = None
+
+    # ---------------- buffer ----------------
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def add(self, row: dict):
+        with self._cond:
+            if not self._buffer:
+                self._first_at = time.monotonic()
+            self._buffer.append(row)
+            # 1re row : le thread arme son timer d'âge ; buffer plein : flush
+            if len(self._buffer) == 1 or len(self._buffer) >= self.flush_rows:
+                self._cond.notify()
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def _take(self):
+        # appelé sous self._cond
+        batch = self._buffer[: self.flush_rows]
+        del self._buffer[: self.flush_rows]
+        self._first_at = time.monotonic() if self._buffer else None
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._buffer and (
+                        self._stopped
+                        or len(self._buffer) >= self.flush_rows
+                        or time.monotonic() - self._first_at >= self.flush_seconds
+                    ):
+                        break
+                    if self._stopped:
+                        return
+                    timeout = None
+                    if self._buffer:
+                        timeout = max(0.0, self.flush_seconds - (time.monotonic() - self._first_at))
+                    self._cond.wait(timeout)
+                batch = self._take()
+            if not self.flush(batch) and not self._stopped:
+                time.sleep(self.retry_delay)
+
+    def stop(self, timeout: float = None):
+        """Flush du buffer restant puis arrêt du thread."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # ---------------- flush ----------------
+    def flush(self, rows: list) -> bool:
+        if not rows:
+            return True
+        mode = "copy" if self.s3_bucket and self.iam_role and len(rows) >= self.copy_min_rows else "insert"
+        try:
+            if mode == "copy":
+                self.copy_rows(rows)
+                print(f"✅ Redshift COPY OK ({len(rows)} rows)")
+            else:
+                self.insert_rows(rows)
+                print(f"✅ Redshift insert OK ({len(rows)} rows)")
+            REDSHIFT_ROWS.inc(len(rows), mode=mode, result="ok")
+            ok = True
+        except Exception as e:
+            REDSHIFT_ROWS.inc(len(rows), mode=mode, result="error")
+            print(f"❌ Redshift batch failed ({len(rows)} rows):", str(e))
+            ok = False
+            if self.on_failure:
+                try:
+                    self.on_failure(rows, e)
+                except Exception as e:
+                    # rows ni insérées ni reprogrammées : rendues à la source
+                    print("❌ Redshift retry impossible:", str(e))
+                    if self.on_dropped:
+                        try:
+                            self.on_dropped(rows)
+                        except Exception as e:
+                            print("❌ Redshift rows non rendues à la file:", str(e))
+                    return False
+        if self.on_flushed:
+            self.on_flushed(rows)
+        return ok
+
+    def _execute(self, fn):
+        pool = self._get_pool()
+        if pool is None:
+            raise RuntimeError("Redshift not configured (missing REDSHIFT_* env vars)")
+        # circuit ouvert : CircuitOpen immédiat, pas d'attente du connect_timeout
+        with self._breaker:
+            self._execute_on(pool, fn)
+
+    def _execute_on(self, pool, fn):
+        conn = pool.getconn()
+        broken = False
+        try:
+            conn.autocommit = False
+            with conn.cursor() as cur:
+                fn(cur)
+            conn.commit()
+        except Exception as e:
+            # connexion coupée : jetée au lieu de revenir dans le pool
+            broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            pool.putconn(conn, close=broken)
+
+    def insert_rows(self, rows: list):
+        """INSERT multi-lignes, une seule transaction."""
+        sql = f"INSERT INTO {self.table} ({','.join(self.columns)}) VALUES %s"
+        values = [tuple(row[c] for c in self.columns) for row in rows]
+        with track("redshift", "insert"):
+            self._execute(lambda cur: execute_values(cur, sql, values, page_size=self.flush_rows))
+
+    def _s3_client(self):
+        if self._s3 is None:
+            import boto3
+            self._s3 = boto3.client("s3", endpoint_url=self.s3_endpoint_url)
+        return self._s3
+
+    def copy_rows(self, rows: list):
+        """Dépose un NDJSON gzip sur S3 puis COPY dans la table."""
+        key = f"{self.s3_prefix}/{time.strftime('%Y%m%d')}/{uuid.uuid4().hex}.json.gz"
+        body = gzip.compress(
+            "".join(
+                json.dumps({c: row[c] for c in self.columns}, ensure_ascii=False) + "\n"
+                for row in rows
+            ).encode("utf-8")
+        )
+        s3 = self._s3_client()
+        with track("s3", "put_object"):
+            s3.put_object(Bucket=self.s3_bucket, Key=key, Body=body)
+        sql = (
+            f"COPY {self.table} ({','.join(self.columns)}) "
+            f"FROM 's3://{self.s3_bucket}/{key}' "
+            f"IAM_ROLE '{self.iam_role}' "
+            f"FORMAT AS JSON 'auto' GZIP"
+        )
+        try:
+            with track("redshift", "copy"):
+                self._execute(lambda cur: cur.execute(sql))
+        finally:
+            try:
+                s3.delete_object(Bucket=self.s3_bucket, Key=key)
+            except Exception as e:
+                print("❌ S3 staging cleanup failed:", str(e))
@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import heapq
+import random
+import threading
+from contextlib import contextmanager
+
+from breaker import circuit_open
+from metrics import REGISTRY
+
+RETRIES = REGISTRY.counter("retries_total", "Échecs reprogrammés ou envoyés en dead-letter", ("queue", "outcome"))
+
+
+# ============================================================
+# Retries : backoff exponentiel + jitter, budget, dead-letter
+# ============================================================
+RETRY_KEY = "_retry"   # métadonnées stockées dans l'élément : attempts, last_error
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _atomic_write_lines(path: str, lines):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 8, base_delay: float = 5.0, max_delay: float = 3600.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        """Backoff exponentiel plafonné, jitter entre 50% et 100%."""
+        d = min(self.max_delay, self.base_delay * (2 ** max(0, attempt - 1)))
+        return d * random.uniform(0.5, 1.0)
+
+
+class DelayQueue:
+    """
+    Tas (heap) d'éléments ordonnés par date d'échéance, persisté en JSONL :
+    une ligne {"id", "due", "queue", "item"} par programmation, puis une
+    ligne {"done": id} dès que l'élément est remis en file. Le fichier est
+    relu par start() (process qui consomme les files) sans les entrées
+    déjà remises en file, puis réécrit ; il est aussi compacté à l'arrêt,
+    quand il grossit trop, et vidé quand le tas l'est.
+    """
+
+    def __init__(self, path: str, on_due):
+        self.path = path
+        self._on_due = on_due
+        self._heap = []
+        self._seq = 0
+        self._fired = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._fh = None
+
+    def _load(self):
+        # appelé sous self._cond
+        entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        if "done" in entry:
+                            entries.pop(entry["done"], None)
+                        else:
+                            entries[entry["id"]] = entry
+                    except Exception:
+                        continue
+        for entry_id, entry in entries.items():
+            self._push(entry["due"], entry_id, entry["queue"], entry["item"])
+
+    def _push(self, due: float, entry_id: str, queue_name: str, item):
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, entry_id, queue_name, item))
+
+    def _write(self, line: dict):
+        # appelé sous self._cond
+        if self._fh is None:
+            self._fh = open(self.path, "a", encoding="utf-8")
+        self._fh.write(_dumps(line) + "\n")
+        self._fh.flush()
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return self
+            # le fichier fait foi (programmations des autres process comprises)
+            self._heap = []
+            self._load()
+            self._compact(force=True)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def schedule(self, delay: float, queue_name: str, item):
+        due = time.time() + delay
+        entry_id = uuid.uuid4().hex
+        with self._cond:
+            self._write({"id": entry_id, "due": due, "queue": queue_name, "item": item})
+            self._push(due, entry_id, queue_name, item)
+            self._cond.notify()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._heap and self._heap[0][0] <= time.time():
+                        break
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, entry_id, queue_name, item = heapq.heappop(self._heap)
+            try:
+                self._on_due(queue_name, item)
+            except Exception as e:
+                print("❌ Retry requeue failed:", str(e))
+                self.schedule(5.0, queue_name, item)
+            with self._cond:
+                # remis en file (ou reprogrammé) : ne doit plus être rechargé
+                self._write({"done": entry_id})
+                self._fired += 1
+                self._compact()
+
+    def _compact(self, force: bool = False):
+        # appelé sous self._cond
+        if not self._heap:
+            if self._fh is None:
+                self._fh = open(self.path, "a", encoding="utf-8")
+            self._fh.truncate(0)
+            self._fh.seek(0)
+            self._fired = 0
+        elif force or (self._fired > 1000 and self._fired > len(self._heap)):
+            if self._fh is not None:
+                self._fh.close()
+            _atomic_write_lines(self.path, (
+                _dumps({"id": entry_id, "due": due, "queue": q, "item": item})
+                for due, _, entry_id, q, item in self._heap
+            ))
+            self._fh = open(self.path, "a", encoding="utf-8")
+            self._fired = 0
+
+    def stop(self, timeout: float = 5):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is None:
+            return   # process qui ne consomme pas : le fichier appartient au leader
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            return   # remise en file en cours : le journal tel quel reste correct
+        with self._cond:
+            self._compact(force=True)
+
+
+class DeadLetterStore:
+    """
+    Éléments ayant épuisé leur budget de retries (JSONL, consultable /
+    rejouable). Verrou thread + flock : le leader écrit, les process web
+    lisent et rejouent.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        if not os.path.exists(path):
+            open(path, "a").close()
+
+    @contextmanager
+    def _lock(self):
+        with self._thread_lock:
+            with open(self.path + ".lock", "a") as lf:
+                fcntl.flock(lf, fcntl.LOCK_EX)
+                yield
+
+    def add(self, queue_name: str, item, error: str):
+        entry = {
+            "id": uuid.uuid4().hex,
+            "queue": queue_name,
+            "failed_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "attempts": (item.get(RETRY_KEY) or {}).get("attempts", 0) if isinstance(item, dict) else 0,
+            "error": error,
+            "item": item,
+        }
+        with self._lock():
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(_dumps(entry) + "\n")
+        return entry["id"]
+
+    def _read(self):
+        entries = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except Exception:
+                    continue
+        return entries
+
+    def list(self, queue_name: str = None, limit: int = 100):
+        with self._lock():
+            entries = self._read()
+        if queue_name:
+            entries = [e for e in entries if e.get("queue") == queue_name]
+        return entries[:limit]
+
+    def take(self, ids=None, queue_name: str = None, handle=None):
+        """
+        Retire et retourne les entrées sélectionnées (par id, par queue, ou
+        toutes). handle(entry) est appelé sous le verrou avant le retrait :
+        s'il échoue, cette entrée et les suivantes restent dans le fichier.
+        """
+        ids = set(ids or [])
+        with self._lock():
+            entries = self._read()
+            taken, kept = [], []
+            failed = False
+            for e in entries:
+                selected = (e.get("id") in ids) if ids else (not queue_name or e.get("queue") == queue_name)
+                if selected and not failed and handle is not None:
+                    try:
+                        handle(e)
+                    except Exception as exc:
+                        print(f"❌ Dead-letter {e.get('id')} non rejouée:", str(exc))
+                        failed = True
+                (taken if selected and not failed else kept).append(e)
+            if taken:
+                _atomic_write_lines(self.path, (_dumps(e) for e in kept))
+        return taken
+
+
+class RetryManager:
+    """
+    fail(queue, item, error) : incrémente le compteur de tentatives, puis
+    reprogramme l'élément après backoff, ou l'envoie en dead-letter si le
+    budget est épuisé.
+    """
+
+    def __init__(self, directory: str, queues: dict, policy: RetryPolicy = None):
+        os.makedirs(directory, exist_ok=True)
+        self.queues = queues
+        self.policy = policy or RetryPolicy()
+        # démarré uniquement par le process qui consomme les files (leader)
+        self.delayed = DelayQueue(os.path.join(directory, "retry_schedule.jsonl"), self._requeue)
+        self.dead_letters = DeadLetterStore(os.path.join(directory, "dead_letters.jsonl"))
+
+    def _requeue(self, queue_name: str, item):
+        self.queues[queue_name](item)
+
+    def fail(self, queue_name: str, item: dict, error):
+        # dépendance coupée (disjoncteur) : on repasse après sa réouverture,
+        # sans consommer de tentative
+        opened = circuit_open(error)
+        if opened is not None:
+            RETRIES.inc(queue=queue_name, outcome="deferred")
+            self.delayed.schedule(max(1.0, opened.retry_after) * random.uniform(1.0, 1.5), queue_name, item)
+            return
+
+        meta = dict(item.get(RETRY_KEY) or {})
+        meta["attempts"] = meta.get("attempts", 0) + 1
+        meta["last_error"] = str(error)[:500]
+        item[RETRY_KEY] = meta
+
+        if meta["attempts"] >= self.policy.max_attempts:
+            RETRIES.inc(queue=queue_name, outcome="dead_letter")
+            self.dead_letters.add(queue_name, item, meta["last_error"])
+            print(f"☠️ {queue_name}: dead-letter après {meta['attempts']} tentatives:", meta["last_error"])
+            return
+
+        RETRIES.inc(queue=queue_name, outcome="scheduled")
+        delay = self.policy.delay(meta["attempts"])
+        self.delayed.schedule(delay, queue_name, item)
+        print(f"🔁 {queue_name}: retry {meta['attempts']}/{self.policy.max_attempts} dans {delay:.0f}s")
+
+    def replay(self, ids=None, queue_name: str = None) -> int:
+        """Remet en file les dead-letters sélectionnées, compteur remis à zéro."""
+        def requeue(entry):
+            item = entry["item"]
+            if isinstance(item, dict):
+                item.pop(RETRY_KEY, None)
+            self._requeue(entry["queue"], item)
+
+        # retirée seulement une fois remise en file : un échec ne perd rien
+        return len(self.dead_letters.take(ids, queue_name, handle=requeue))
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import threading
+
+
+# ============================================================
+# Routage département -> clients (index inversé, caps journaliers)
+# ============================================================
+# Règles : {"Client": [54, 55, "2A"]} ou {"Client": {"departments": [...], "daily_cap": 20}}
+# Départements acceptés : 1..95 / "01".."95", "2A", "2B" ("20" = les deux),
+# DOM "971".."976".
+CORSICA = ("2A", "2B")
+
+
+def department_code(zipcode: str) -> str:
+    """Code postal -> département ("06", "2A", "971"), "" si inconnu."""
+    zipcode = (zipcode or "").strip().replace(" ", "")
+    if len(zipcode) == 4 and zipcode.isdigit():
+        zipcode = "0" + zipcode
+    if len(zipcode) < 2:
+        return ""
+    if zipcode[:2] == "20" and zipcode[2:3].isdigit():
+        # Corse : 200xx-201xx = Corse-du-Sud, 202xx-206xx = Haute-Corse
+        return "2A" if zipcode[2] in "01" else "2B"
+    if zipcode[:2] in ("97", "98") and len(zipcode) >= 3:
+        return zipcode[:3]
+    return zipcode[:2]
+
+
+def _dep_keys(value):
+    """Une valeur de règle -> codes département normalisés."""
+    text = str(value).strip().upper()
+    if not text:
+        return ()
+    if text in ("20", "2A", "2B"):
+        return CORSICA if text == "20" else (text,)
+    if text.isdigit():
+        return ("%02d" % int(text),) if len(text) <= 2 else (text,)
+    return (text,)
+
+
+class LeadRouter:
+    """
+    Index inversé département -> clients, reconstruit à partir de
+    load_rules() toutes les `reload_seconds` (fichier / sheet modifiés sans
+    redémarrage). assign() applique le cap journalier de chaque client et
+    ne le consomme que pour un lead réellement routé (count=True) ;
+    release() rend les places si le lead n'est finalement pas enregistré.
+    """
+
+    def __init__(self, load_rules, reload_seconds: float = 60, counts_path: str = None):
+        self._load_rules = load_rules
+        self.reload_seconds = reload_seconds
+        self.counts_path = counts_path
+        self._lock = threading.Lock()
+        self._index = {}
+        self._caps = {}
+        self._loaded_at = None
+        self._day = None
+        self._counts = {}
+        self._load_counts()
+
+    # ---------------- règles ----------------
+    def _build(self, rules: dict):
+        index, caps = {}, {}
+        for client, rule in rules.items():
+            if isinstance(rule, dict):
+                departments = rule.get("departments") or []
+                if rule.get("daily_cap") not in (None, ""):
+                    caps[client] = int(rule["daily_cap"])
+            else:
+                departments = rule
+            for dep in departments:
+                for key in _dep_keys(dep):
+                    clients = index.setdefault(key, [])
+                    if client not in clients:
+                        clients.append(client)
+        self._index = {k: tuple(v) for k, v in index.items()}
+        self._caps = caps
+
+    def _ensure_fresh(self):
+        # appelé sous self._lock
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.reload_seconds:
+            return
+        try:
+            rules = self._load_rules()
+            if rules is not None:
+                self._build(rules)
+        except Exception as e:
+            # on garde les règles précédentes
+            print("❌ Routing: chargement des règles impossible:", str(e))
+        self._loaded_at = time.monotonic()
+
+    def reload(self):
+        with self._lock:
+            self._loaded_at = None
+            self._ensure_fresh()
+
+    # ---------------- caps ----------------
+    def _load_counts(self):
+        if not self.counts_path or not os.path.exists(self.counts_path):
+            return
+        try:
+            with open(self.counts_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self._day, self._counts = state.get("day"), state.get("counts") or {}
+        except Exception as e:
+            print("❌ Routing: compteurs illisibles:", str(e))
+
+    def _save_counts(self):
+        if not self.counts_path:
+            return
+        tmp = self.counts_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"day": self._day, "counts": self._counts}, f)
+        os.replace(tmp, self.counts_path)
+
+    def _roll_day(self):
+        today = time.strftime("%Y-%m-%d")
+        if self._day != today:
+            self._day, self._counts = today, {}
+
+    # ---------------- API ----------------
+    def clients_for(self, department: str) -> tuple:
+        with self._lock:
+            self._ensure_fresh()
+            return self._index.get(department, ())
+
+    def assign(self, department: str, count: bool = True) -> list:
+        """Clients intéressés par le département et encore sous leur cap (compté si `count`)."""
+        if not department:
+            return []
+        with self._lock:
+            self._ensure_fresh()
+            candidates = self._index.get(department, ())
+            if not candidates:
+                return []
+            self._roll_day()
+            assigned = [
+                c for c in candidates
+                if c not in self._caps or self._counts.get(c, 0) < self._caps[c]
+            ]
+            if not count:
+                return assigned
+            for c in assigned:
+                self._counts[c] = self._counts.get(c, 0) + 1
+            if assigned:
+                self._save_counts()
+            return assigned
+
+    def release(self, clients: list):
+        if not clients:
+            return
+        with self._lock:
+            for c in clients:
+                if self._counts.get(c, 0) > 0:
+                    self._counts[c] -= 1
+            self._save_counts()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._ensure_fresh()
+            clients = sorted({c for v in self._index.values() for c in v})
+            return {
+                "departments": len(self._index),
+                "clients": clients,
+                "caps": dict(self._caps),
+                "day": self._day,
+                "counts": dict(self._counts),
+            }
+
+
+# ============================================================
+# Sources de règles
+# ============================================================
+def file_rules(path: str):
+    """Règles JSON dans un fichier ; relu seulement si son mtime a changé."""
+    state = {"mtime": None}
+
+    def load():
+        mtime = os.path.getmtime(path)
+        if mtime == state["mtime"]:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            rules = json.load(f)
+        state["mtime"] = mtime
+        print(f"🔀 Routing: règles rechargées depuis {path} ({len(rules)} clients)")
+        return rules
+
+    return load
+
+
+def sheet_rules(get_values):
+    """
+    Règles dans un onglet : colonnes client | départements (séparés par
+    virgules) | cap journalier (optionnel), une ligne d'en-tête.
+    """
+
+    def load():
+        rules = {}
+        for row in get_values()[1:]:
+            if not row or not row[0].strip():
+                continue
+            departments = [d for d in (row[1] if len(row) > 1 else "").replace(";", ",").split(",") if d.strip()]
+            cap = row[2].strip() if len(row) > 2 else ""
+            rules[row[0].strip()] = {"departments": departments, "daily_cap": int(cap) if cap else None}
+        return rules
+
+    return load
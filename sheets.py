@@ -0,0 +1,561 @@
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+from datetime import datetime
+from contextlib import nullcontext
+
+from metrics import track
+
+
+# ============================================================
+# Index téléphone -> numéro de ligne (Google Sheet)
+# ============================================================
+PHONE_COL = 6          # tel en colonne F
+STATUS_COL = 11        # colonne K ("DÉSINSCRIT")
+UNSUBSCRIBED = "DÉSINSCRIT"
+
+
+# Adresse d'une ligne : onglet ("" = sheet1) + numéro de ligne (1-based)
+RowRef = namedtuple("RowRef", "tab row")
+
+
+class PhoneIndex:
+    """
+    Index process-wide des téléphones déjà présents dans le sheet, tous
+    onglets (shards) confondus. Chaque shard est chargé une fois
+    (get_all_values), mis à jour à chaque ajout / désinscription, puis
+    resynchronisé pour rattraper les modifications faites à la main :
+    toutes les `resync_seconds` pour le shard actif, toutes les
+    `archive_resync_seconds` pour les anciens (qui ne reçoivent plus de leads).
+    `key(phone)` normalise les numéros lus dans le sheet (ex: E.164).
+    Une réservation reste en attente (et survit aux rechargements) jusqu'à
+    confirm() après l'écriture, ou release() si elle échoue.
+    """
+
+    def __init__(self, load_rows, resync_seconds: float = 300, shards=None, archive_resync_seconds: float = 3600,
+                 key=None):
+        self._load_rows = load_rows
+        self._key = key
+        self._shards = shards
+        self.resync_seconds = resync_seconds
+        self.archive_resync_seconds = archive_resync_seconds
+        self._lock = threading.Lock()
+        self._rows = {}           # téléphone -> RowRef
+        self._pending = {}        # téléphone -> RowRef réservé, pas encore écrit
+        self._unsubscribed = {}   # téléphone -> onglet
+        self._used = {}           # onglet -> lignes utilisées
+        self._loaded_at = {}      # onglet -> time.monotonic() du dernier chargement
+
+    def _tabs(self) -> list:
+        return self._shards.tabs() if self._shards is not None else [""]
+
+    def _load(self, tab: str):
+        values = self._load_rows(tab)
+        rows = {phone: ref for phone, ref in self._rows.items() if ref.tab != tab}
+        unsubscribed = {phone: t for phone, t in self._unsubscribed.items() if t != tab}
+        for index, row in enumerate(values):
+            if len(row) < PHONE_COL:
+                continue
+            phone = row[PHONE_COL - 1]
+            if not phone:
+                continue
+            if self._key is not None:
+                phone = self._key(phone) or phone
+            rows.setdefault(phone, RowRef(tab, index + 1))
+            if len(row) >= STATUS_COL and row[STATUS_COL - 1] == UNSUBSCRIBED:
+                unsubscribed[phone] = tab
+        # réservations dont l'écriture est encore en attente dans le writer
+        used = len(values)
+        for phone, ref in self._pending.items():
+            if ref.tab == tab:
+                rows.setdefault(phone, ref)
+                used = max(used, ref.row)
+        self._rows = rows
+        self._unsubscribed = unsubscribed
+        self._used[tab] = used
+        self._loaded_at[tab] = time.monotonic()
+
+    def _ensure_fresh(self):
+        # appelé sous self._lock
+        tabs = self._tabs()
+        now = time.monotonic()
+        for tab in tabs:
+            ttl = self.resync_seconds if tab == tabs[-1] else self.archive_resync_seconds
+            loaded_at = self._loaded_at.get(tab)
+            if loaded_at is None or now - loaded_at > ttl:
+                self._load(tab)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at.clear()
+
+    def lookup(self, phone: str):
+        """RowRef (onglet, ligne) du téléphone, ou None."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._rows.get(phone)
+
+    def __contains__(self, phone: str) -> bool:
+        return self.lookup(phone) is not None
+
+    def reserve(self, phone: str):
+        """
+        Réserve la prochaine ligne libre du shard actif pour `phone`.
+        Retourne un RowRef, ou None si le téléphone existe déjà (tous shards).
+        """
+        with self._lock:
+            self._ensure_fresh()
+            if phone in self._rows:
+                return None
+            tab = self._shards.active(self._used) if self._shards is not None else ""
+            if tab not in self._loaded_at:
+                self._load(tab)   # nouveau shard (en-tête éventuel)
+            self._used[tab] += 1
+            ref = RowRef(tab, self._used[tab])
+            self._rows[phone] = ref
+            self._pending[phone] = ref
+            return ref
+
+    def confirm(self, phone: str):
+        """La ligne réservée est écrite : elle fait désormais partie du sheet."""
+        with self._lock:
+            self._pending.pop(phone, None)
+
+    def release(self, phone: str):
+        """
+        Annule une réservation après un échec d'écriture. La ligne n'est
+        reprise que si c'est la dernière du shard ; sinon elle reste vide
+        (les réservations suivantes sont peut-être en cours d'écriture).
+        """
+        with self._lock:
+            ref = self._pending.pop(phone, None)
+            if ref is None or self._rows.get(phone) != ref:
+                return
+            del self._rows[phone]
+            if self._used.get(ref.tab) == ref.row:
+                self._used[ref.tab] -= 1
+
+    def mark_unsubscribed(self, phone: str):
+        with self._lock:
+            ref = self._rows.get(phone)
+            self._unsubscribed[phone] = ref.tab if ref else ""
+
+    def is_unsubscribed(self, phone: str) -> bool:
+        with self._lock:
+            self._ensure_fresh()
+            return phone in self._unsubscribed
+
+    def unsubscribed(self) -> list:
+        """Téléphones marqués DÉSINSCRIT dans le sheet (tous shards)."""
+        with self._lock:
+            self._ensure_fresh()
+            return list(self._unsubscribed)
+
+    def shard_rows(self) -> dict:
+        """Lignes utilisées par onglet (tel que vu par ce process)."""
+        return dict(self._used)
+
+    def __len__(self):
+        return len(self._rows)
+
+
+# ============================================================
+# Shards : un onglet par mois ou par volume, catalogue partagé
+# ============================================================
+SHARD_MODES = ("", "month", "rows")
+
+
+class SheetShards:
+    """
+    Catalogue des onglets qui reçoivent les leads. sheet1 reste toujours le
+    premier shard (l'historique continue de servir à la dédup).
+    mode ""      : tout dans sheet1 (comportement historique)
+    mode "month" : un onglet par mois, "<prefix> 2026-10"
+    mode "rows"  : nouvel onglet "<prefix> 001"... quand le courant atteint max_rows
+    Le catalogue (JSON) est partagé entre les process et relu quand il
+    change ; seul le leader (process_lead) crée des onglets. La création
+    passe par `breaker` et `limiter`, comme les autres appels Sheets.
+    """
+
+    def __init__(self, get_worksheet, path: str, mode: str = "", prefix: str = "Leads",
+                 max_rows: int = 50000, initial_rows: int = 1000, limiter=None, breaker=None):
+        if mode not in SHARD_MODES:
+            raise ValueError(f"unknown shard mode {mode!r}")
+        self._get_worksheet = get_worksheet
+        self.path = path
+        self.mode = mode
+        self.prefix = prefix
+        self.max_rows = max_rows
+        self.initial_rows = initial_rows
+        self._limiter = limiter or nullcontext()
+        self._breaker = breaker or nullcontext()
+        self._lock = threading.Lock()
+        self._shards = [{"tab": "", "created_at": None}]
+        self._mtime = None
+
+    def _reload(self):
+        # appelé sous self._lock
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            shards = json.load(f).get("shards") or []
+        if not shards or shards[0].get("tab") != "":
+            shards.insert(0, {"tab": "", "created_at": None})
+        self._shards = shards
+        self._mtime = mtime
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"shards": self._shards}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def tabs(self) -> list:
+        """Onglets du plus ancien au plus récent ; le dernier reçoit les leads."""
+        with self._lock:
+            self._reload()
+            return [shard["tab"] for shard in self._shards]
+
+    def active(self, used_rows: dict) -> str:
+        """Onglet qui doit recevoir le prochain lead (créé si besoin)."""
+        with self._lock:
+            self._reload()
+            last = self._shards[-1]["tab"]
+            if self.mode == "month":
+                title = f"{self.prefix} {time.strftime('%Y-%m')}"
+                if title == last:
+                    return last
+            elif self.mode == "rows":
+                if used_rows.get(last, 0) < self.max_rows:
+                    return last
+                title = f"{self.prefix} {len(self._shards):03d}"
+            else:
+                return last
+            self._create(title)
+            self._shards.append({"tab": title, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())})
+            self._save()
+            print(f"🗂️ Nouveau shard Sheets: {title}")
+            return title
+
+    def _create(self, title: str):
+        base = self._get_worksheet("")
+        sh = base.spreadsheet
+        with self._breaker, self._limiter:
+            try:
+                with track("sheets", "add_worksheet"):
+                    ws = sh.add_worksheet(title=title, rows=self.initial_rows, cols=LAST_COL)
+            except Exception:
+                # déjà là (catalogue perdu / recréé) : on le reprend tel quel
+                with track("sheets", "worksheet"):
+                    sh.worksheet(title)
+                return
+            # même ligne d'en-tête que sheet1
+            with track("sheets", "row_values"):
+                header = base.row_values(1)
+            if header:
+                with track("sheets", "batch_update"):
+                    sh.batch_update({"requests": [{"updateCells": {
+                        "start": {"sheetId": ws.id, "rowIndex": 0, "columnIndex": 0},
+                        "rows": [{"values": [{"userEnteredValue": {"stringValue": str(v)}} for v in header]}],
+                        "fields": "userEnteredValue",
+                    }}]})
+
+    def catalog(self) -> list:
+        with self._lock:
+            self._reload()
+            return [dict(shard) for shard in self._shards]
+
+
+# ============================================================
+# Writer Sheets batché (1 batch_update pour N leads)
+# ============================================================
+LAST_COL = 15          # A..O formatées, A..N remplies
+WHITE = {"red": 1.0, "green": 1.0, "blue": 1.0}
+RED = {"red": 1.0, "green": 0.0, "blue": 0.0}
+
+
+class PendingWrite:
+    """
+    Résultat d'une écriture soumise au writer (succès / erreur par lead).
+    add_done_callback(fn) : fn(pending) appelé une fois l'écriture terminée,
+    depuis le thread du writer.
+    """
+
+    def __init__(self, ref: RowRef, values=None, red: bool = False, status: str = None):
+        self.tab, self.row = ref
+        self.values = values
+        self.red = red
+        self.status = status
+        self.ok = None
+        self.error = None
+        self.exception = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _resolve(self, ok: bool, error: str = None, exception: Exception = None):
+        self.ok = ok
+        self.error = error
+        self.exception = exception
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            self._run_callback(fn)
+
+    def _run_callback(self, fn):
+        try:
+            fn(self)
+        except Exception as e:
+            print("❌ Callback d'écriture Sheets:", str(e))
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        self._run_callback(fn)
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """True si l'écriture a réussi dans le délai."""
+        return self._done.wait(timeout) and bool(self.ok)
+
+
+def _cell(value=None, color=None) -> dict:
+    cell = {"userEnteredFormat": {"backgroundColor": color}}
+    if value is not None:
+        cell["userEnteredValue"] = {"stringValue": str(value)}
+    return cell
+
+
+class SheetsWriter:
+    """
+    Regroupe les lignes / couleurs en attente pendant `window_seconds`
+    puis les envoie en un seul spreadsheet.batch_update (valeurs + fond
+    A:O, tous onglets confondus). Les lignes manquantes sont ajoutées par
+    paquets de `row_chunk` : pas d'ajout de lignes à chaque lead.
+    `get_worksheet(tab)` retourne l'onglet ("" = sheet1). Circuit
+    `breaker` ouvert : le batch échoue tout de suite, sans appel.
+    """
+
+    def __init__(self, get_worksheet, window_seconds: float = 0.5, max_batch: int = 100, limiter=None,
+                 row_chunk: int = 500, breaker=None):
+        self._get_worksheet = get_worksheet
+        self._limiter = limiter or nullcontext()
+        self._breaker = breaker or nullcontext()
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self.row_chunk = max(1, row_chunk)
+        self._pending = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._known_rows = {}   # onglet -> row_count connu
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, ref: RowRef, values: list, red: bool = False) -> PendingWrite:
+        """Nouvelle ligne A:N, fond blanc (ou rouge si lead KO) sur A:O."""
+        return self._enqueue(PendingWrite(ref, values=values, red=red))
+
+    def submit_status(self, ref: RowRef, status: str, red: bool = True) -> PendingWrite:
+        """Écrit la colonne K (ex: DÉSINSCRIT) et repeint la ligne."""
+        return self._enqueue(PendingWrite(ref, red=red, status=status))
+
+    def _enqueue(self, item: PendingWrite) -> PendingWrite:
+        with self._cond:
+            if self._stopped:
+                item._resolve(False, "writer stopped")
+                return item
+            self._pending.append(item)
+            self._cond.notify()
+        return item
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if not self._pending and self._stopped:
+                    return
+            # fenêtre de regroupement
+            if not self._stopped:
+                time.sleep(self.window_seconds)
+            with self._cond:
+                batch = self._pending[: self.max_batch]
+                del self._pending[: self.max_batch]
+            self._flush(batch)
+
+    def _requests(self, ws, batch):
+        reqs = []
+        max_row = max(item.row for item in batch)
+        row_count = max(ws.row_count, self._known_rows.get(ws.id, 0))
+        if max_row > row_count:
+            length = max(max_row - row_count, self.row_chunk)
+            reqs.append({"appendDimension": {"sheetId": ws.id, "dimension": "ROWS", "length": length}})
+            row_count += length
+
+        for item in batch:
+            color = RED if item.red else WHITE
+            if item.values is not None:
+                cells = [_cell(v, color) for v in item.values]
+                cells += [_cell(None, color) for _ in range(LAST_COL - len(cells))]
+                reqs.append({"updateCells": {
+                    "start": {"sheetId": ws.id, "rowIndex": item.row - 1, "columnIndex": 0},
+                    "rows": [{"values": cells}],
+                    "fields": "userEnteredValue,userEnteredFormat.backgroundColor",
+                }})
+            else:
+                reqs.append({"repeatCell": {
+                    "range": {"sheetId": ws.id, "startRowIndex": item.row - 1, "endRowIndex": item.row,
+                              "startColumnIndex": 0, "endColumnIndex": LAST_COL},
+                    "cell": _cell(None, color),
+                    "fields": "userEnteredFormat.backgroundColor",
+                }})
+                if item.status is not None:
+                    reqs.append({"updateCells": {
+                        "start": {"sheetId": ws.id, "rowIndex": item.row - 1, "columnIndex": STATUS_COL - 1},
+                        "rows": [{"values": [{"userEnteredValue": {"stringValue": item.status}}]}],
+                        "fields": "userEnteredValue",
+                    }})
+        return reqs, row_count
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        by_tab = {}
+        for item in batch:
+            by_tab.setdefault(item.tab, []).append(item)
+        try:
+            with self._breaker, self._limiter:
+                reqs, known, spreadsheet = [], {}, None
+                for tab, items in by_tab.items():
+                    ws = self._get_worksheet(tab)
+                    spreadsheet = ws.spreadsheet
+                    tab_reqs, known[ws.id] = self._requests(ws, items)
+                    reqs.extend(tab_reqs)
+                with track("sheets", "batch_update"):
+                    spreadsheet.batch_update({"requests": reqs})
+            self._known_rows.update(known)
+        except Exception as e:
+            print("❌ Sheets batch_update failed:", str(e))
+            for item in batch:
+                item._resolve(False, str(e), e)
+            return
+        for item in batch:
+            item._resolve(True)
+
+    def stop(self, timeout: float = None):
+        """Arrête le writer après avoir vidé les écritures en attente."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+# ============================================================
+# Cache des handles gspread (spreadsheet + onglet)
+# ============================================================
+class WorksheetCache:
+    """
+    Ouvre chaque spreadsheet une seule fois (par clé ; par titre seulement
+    au premier accès, puis par la clé découverte), garde le worksheet en
+    cache et ne recharge ses métadonnées (row_count...) qu'après
+    `metadata_ttl` secondes ou invalidate(). Le token OAuth est renouvelé
+    `token_margin` secondes avant son expiration. Les appels (ouverture,
+    refresh du token) passent par `breaker`.
+    """
+
+    def __init__(self, client, metadata_ttl: float = 600, token_margin: float = 300, breaker=None):
+        self.client = client
+        self._breaker = breaker or nullcontext()
+        self.metadata_ttl = metadata_ttl
+        self.token_margin = token_margin
+        self._lock = threading.Lock()
+        self._token_lock = threading.Lock()
+        self._handles = {}      # (spreadsheet, tab) -> (worksheet, loaded_at)
+        self._keys = {}         # titre -> clé
+        self.hits = 0
+        self.misses = 0
+        self.token_refreshes = 0
+
+    def _ensure_token(self):
+        creds = getattr(self.client, "auth", None)
+        if creds is None or not hasattr(creds, "refresh"):
+            return
+        expiry = getattr(creds, "expiry", None)
+        if expiry is not None and (expiry - datetime.utcnow()).total_seconds() > self.token_margin:
+            return
+        with self._token_lock:
+            expiry = getattr(creds, "expiry", None)
+            if expiry is not None and (expiry - datetime.utcnow()).total_seconds() > self.token_margin:
+                return
+            from google.auth.transport.requests import Request
+            with self._breaker, track("sheets", "token_refresh"):
+                creds.refresh(Request())
+            self.token_refreshes += 1
+
+    def _open(self, spreadsheet: str, tab: str):
+        key = self._keys.get(spreadsheet, spreadsheet)
+        try:
+            with track("sheets", "open_by_key"):
+                sh = self.client.open_by_key(key)
+        except Exception:
+            if key != spreadsheet:
+                raise
+            # pas une clé : recherche Drive par titre, une seule fois
+            with track("sheets", "open"):
+                sh = self.client.open(spreadsheet)
+            self._keys[spreadsheet] = sh.id
+        if not tab:
+            return sh.sheet1
+        with track("sheets", "worksheet"):
+            return sh.worksheet(tab)
+
+    def get(self, spreadsheet: str, tab: str = None):
+        self._ensure_token()
+        cache_key = (spreadsheet, tab)
+        with self._lock:
+            entry = self._handles.get(cache_key)
+            if entry is not None and time.monotonic() - entry[1] < self.metadata_ttl:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            with self._breaker:
+                ws = self._open(spreadsheet, tab)
+            self._handles[cache_key] = (ws, time.monotonic())
+            return ws
+
+    def invalidate(self, spreadsheet: str = None, tab: str = None):
+        with self._lock:
+            if spreadsheet is None:
+                self._handles.clear()
+            else:
+                self._handles.pop((spreadsheet, tab), None)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "token_refreshes": self.token_refreshes,
+            "handles": len(self._handles),
+        }
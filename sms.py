@@ -0,0 +1,297 @@
+import hmac
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+from contextlib import nullcontext
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from breaker import CircuitOpen
+from metrics import track
+
+
+# ============================================================
+# Envoi SMS Vonage : outbox durable + pool HTTP keep-alive
+# ============================================================
+VONAGE_SMS_PATH = "/sms/json"
+# statuts Vonage à retenter (1 = Throttled) ; les autres sont définitifs
+TRANSIENT_STATUSES = {"1"}
+# écart max accepté sur le timestamp d'un webhook signé
+SIGNATURE_MAX_SKEW = 300
+
+
+def vonage_signature(params: dict, secret: str, method: str = "md5hash") -> str:
+    """
+    Signature des webhooks SMS Vonage : paramètres triés "&clé=valeur"
+    ('&' et '=' des valeurs remplacés par '_'), puis md5(chaîne + secret)
+    ou HMAC (method = "sha256", "sha512"...) avec le secret.
+    """
+    if method == "md5hash":
+        hasher = hashlib.md5()
+    else:
+        hasher = hmac.new(secret.encode(), digestmod=method)
+    for key in sorted(params):
+        value = params[key]
+        if isinstance(value, str):
+            value = value.replace("&", "_").replace("=", "_")
+        hasher.update(f"&{key}={value}".encode("utf-8"))
+    if method == "md5hash":
+        hasher.update(secret.encode())
+    return hasher.hexdigest()
+
+
+def verify_vonage_signature(params: dict, secret: str, method: str = "md5hash") -> bool:
+    """Paramètre `sig` valide et timestamp récent (rejeu borné)."""
+    params = dict(params)
+    sig = str(params.pop("sig", ""))
+    try:
+        fresh = abs(time.time() - int(params.get("timestamp", ""))) <= SIGNATURE_MAX_SKEW
+    except ValueError:
+        return False
+    expected = vonage_signature(params, secret, method)
+    return fresh and hmac.compare_digest(sig.lower(), expected.lower())
+
+
+class TokenBucket:
+    """Limiteur de débit : `rate` jetons/s, rafale max `burst`."""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SmsError(Exception):
+    def __init__(self, message: str, transient: bool):
+        super().__init__(message)
+        self.transient = transient
+
+
+class SmsStatusStore:
+    """
+    Statut par SMS (queued / sent / delivered / failed) dans SQLite (WAL) :
+    partagé entre les process web (DLR, consultation) et le leader (envoi).
+    """
+
+    FIELDS = ("status", "to_phone", "ref", "message_id", "error", "dlr_err_code", "updated_at")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sms_status ("
+                " id TEXT PRIMARY KEY, status TEXT, to_phone TEXT, ref TEXT,"
+                " message_id TEXT, error TEXT, dlr_err_code TEXT, updated_at TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sms_status_message_id ON sms_status (message_id)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def update(self, sms_id: str, **fields):
+        if "to" in fields:
+            fields["to_phone"] = fields.pop("to")
+        fields["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        cols = [c for c in self.FIELDS if c in fields]
+        self._conn().execute(
+            f"INSERT INTO sms_status (id, {', '.join(cols)}) VALUES (?{', ?' * len(cols)}) "
+            f"ON CONFLICT(id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in cols)}",
+            [sms_id] + [fields[c] for c in cols],
+        )
+
+    def get(self, sms_id: str):
+        row = self._conn().execute(
+            f"SELECT {', '.join(self.FIELDS)} FROM sms_status WHERE id = ?", (sms_id,)
+        ).fetchone()
+        return dict(zip(self.FIELDS, row)) if row else None
+
+    def by_message_id(self, message_id: str):
+        row = self._conn().execute("SELECT id FROM sms_status WHERE message_id = ?", (message_id,)).fetchone()
+        return row[0] if row else None
+
+
+class SmsDispatcher:
+    """
+    Les handlers de leads appellent seulement enqueue() ; `senders` threads
+    vident l'outbox en partageant une session HTTP keep-alive, au débit du
+    token bucket. Échecs transitoires -> on_failure (retry/backoff).
+    `suppressed(to)` est vérifié juste avant chaque envoi (désinscriptions).
+    Circuit `breaker` ouvert : échec transitoire immédiat, sans appel HTTP.
+    """
+
+    def __init__(
+        self,
+        outbox,
+        status_store: SmsStatusStore,
+        api_key: str,
+        api_secret: str,
+        base_url: str = "https://rest.nexmo.com",
+        rate: float = 30,
+        senders: int = 4,
+        timeout: float = 10,
+        on_failure=None,
+        limiter=None,
+        suppressed=None,
+        breaker=None,
+    ):
+        self.outbox = outbox
+        self.status = status_store
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.url = base_url.rstrip("/") + VONAGE_SMS_PATH
+        self.bucket = TokenBucket(rate)
+        self.senders = senders
+        self.timeout = timeout
+        self.on_failure = on_failure
+        self._limiter = limiter or nullcontext()
+        self.suppressed = suppressed
+        self._breaker = breaker or nullcontext()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=senders)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if not self._threads:
+            for i in range(self.senders):
+                t = threading.Thread(target=self._run, name=f"sms-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def enqueue(self, to: str, text: str, sender: str = "RDV TEL", ref: str = "") -> str:
+        """Met le SMS dans l'outbox durable ; retourne son id interne."""
+        sms_id = uuid.uuid4().hex
+        self.status.update(sms_id, status="queued", to=to, ref=ref)
+        self.outbox.put({"id": sms_id, "from": sender, "to": to, "text": text, "ref": ref})
+        return sms_id
+
+    def requeue(self, message: dict):
+        self.status.update(message["id"], status="queued")
+        self.outbox.put(message)
+
+    def _set_status(self, sms_id: str, **fields):
+        # statut indicatif : une écriture SQLite en échec ne doit pas tuer le thread
+        try:
+            self.status.update(sms_id, **fields)
+        except Exception as e:
+            print("❌ Statut SMS non enregistré:", sms_id, str(e))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                message = self.outbox.get(timeout=1.0)
+            except Exception as e:
+                print("❌ Outbox SMS illisible:", str(e))
+                self._stopping.wait(1.0)
+                continue
+            if message is None:
+                continue
+            ack = True
+            try:
+                if self.suppressed is not None and self.suppressed(message["to"]):
+                    self._set_status(message["id"], status="suppressed")
+                    print("🚫 SMS non envoyé (désinscrit):", message["to"])
+                    continue
+                message_id = self.send(message)
+                self._set_status(message["id"], status="sent", message_id=message_id, error="")
+                print("✅ SMS envoyé:", message["to"], message_id)
+            except SmsError as e:
+                print("Erreur SMS:", message["to"], str(e))
+                if e.transient and self.on_failure:
+                    self._set_status(message["id"], status="retrying", error=str(e))
+                    try:
+                        self.on_failure(message, e)
+                    except Exception as e:
+                        # reprogrammation impossible : l'outbox le représentera
+                        print("❌ Retry SMS impossible:", message["to"], str(e))
+                        ack = False
+                else:
+                    self._set_status(message["id"], status="failed", error=str(e))
+            except Exception as e:
+                print("Erreur SMS inattendue:", message.get("to"), str(e))
+                self._set_status(message["id"], status="failed", error=str(e))
+            finally:
+                try:
+                    if ack:
+                        self.outbox.ack(message)
+                    else:
+                        self.outbox.nack(message)
+                except Exception as e:
+                    print("❌ Outbox SMS non acquittée:", message.get("to"), str(e))
+
+    def send(self, message: dict) -> str:
+        """Un appel HTTP sur la session partagée ; retourne le message-id Vonage."""
+        try:
+            with self._breaker:
+                return self._post(message)
+        except CircuitOpen as e:
+            raise SmsError(str(e), transient=True) from e
+
+    def _post(self, message: dict) -> str:
+        self.bucket.acquire()
+        try:
+            with self._limiter, track("vonage", "send_message"):
+                resp = self.session.post(self.url, data={
+                    "api_key": self.api_key,
+                    "api_secret": self.api_secret,
+                    "from": message["from"],
+                    "to": message["to"].lstrip("+"),   # Vonage : E.164 sans "+"
+                    "text": message["text"],
+                }, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise SmsError(str(e), transient=True)
+
+        if resp.status_code >= 500 or resp.status_code == 429:
+            raise SmsError(f"HTTP {resp.status_code}", transient=True)
+        if resp.status_code >= 400:
+            raise SmsError(f"HTTP {resp.status_code}", transient=False)
+
+        first = (resp.json().get("messages") or [{}])[0]
+        status = str(first.get("status", ""))
+        if status != "0":
+            raise SmsError(first.get("error-text", "unknown"), transient=status in TRANSIENT_STATUSES)
+        return first.get("message-id", "")
+
+    def delivery_receipt(self, message_id: str, status: str, err_code: str = ""):
+        """Accusé de réception Vonage (DLR) -> statut final du SMS."""
+        sms_id = self.status.by_message_id(message_id)
+        if sms_id is None:
+            return False
+        self.status.update(sms_id, status=status or "unknown", dlr_err_code=err_code)
+        return True
+
+    def stop(self, timeout: float = None):
+        """Arrêt des threads d'envoi (au plus `timeout` en tout)."""
+        self._stopping.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for t in self._threads:
+            t.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
@@ -0,0 +1,199 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+from metrics import REGISTRY
+
+SMS_EVENTS = REGISTRY.counter("sms_events_total", "Événements SMS (Senddo) stockés", ("result",))
+
+
+# ============================================================
+# Événements de livraison SMS (webhook Senddo)
+# ============================================================
+# Le webhook vérifie la signature puis met l'événement dans une file
+# durable ; le leader les vide par batchs : une transaction SQLite
+# (historique + index de statut par message_id), puis Redshift si configuré.
+
+MESSAGE_ID_KEYS = ("message_id", "messageId", "sms_id", "smsId", "id")
+# déjà stocké mais pas encore dans Redshift (retry / replay) : transmis même en doublon
+FORWARD_KEY = "_forward"
+
+
+def event_record(event: dict, data, received_at: str) -> dict:
+    """Événement du webhook -> élément de file (clé stable pour dédoublonner les rejeux)."""
+    data = data if isinstance(data, dict) else {"value": data}
+    message_id = next((str(data[k]) for k in MESSAGE_ID_KEYS if data.get(k)), "")
+    event_type = str(event.get("type") or "")
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    ts = str(event.get("timestamp") or "")
+    return {
+        "key": hashlib.sha256(f"{event_type}|{ts}|{payload}".encode("utf-8")).hexdigest(),
+        "message_id": message_id,
+        "event_type": event_type,
+        "status": str(data.get("status") or event_type),
+        "event_at": ts,
+        "received_at": received_at,
+        "payload": payload,
+    }
+
+
+class SmsEventStore:
+    """
+    SQLite (WAL) partagé par les process : historique `sms_events` et
+    `sms_event_status` (dernier statut par message_id, lecture par clé).
+    """
+
+    STATUS_FIELDS = ("message_id", "status", "event_type", "event_at", "received_at")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sms_events ("
+            " key TEXT PRIMARY KEY, message_id TEXT, event_type TEXT, status TEXT,"
+            " event_at TEXT, received_at TEXT, payload TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sms_events_message_id ON sms_events (message_id)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sms_event_status ("
+            " message_id TEXT PRIMARY KEY, status TEXT, event_type TEXT, event_at TEXT, received_at TEXT)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add_many(self, records: list) -> list:
+        """Un batch en une transaction ; retourne les événements nouveaux (hors rejeux)."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            known = set()
+            for i in range(0, len(records), 500):
+                keys = [r["key"] for r in records[i:i + 500]]
+                known.update(k for (k,) in conn.execute(
+                    f"SELECT key FROM sms_events WHERE key IN ({','.join('?' * len(keys))})", keys
+                ))
+            fresh = []
+            for r in records:
+                if r["key"] not in known:
+                    known.add(r["key"])
+                    fresh.append(r)
+            conn.executemany(
+                "INSERT INTO sms_events"
+                " (key, message_id, event_type, status, event_at, received_at, payload)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (r["key"], r["message_id"], r["event_type"], r["status"],
+                     r["event_at"], r["received_at"], r["payload"])
+                    for r in fresh
+                ],
+            )
+            # dernier événement par message_id (les DLR arrivent parfois dans le désordre)
+            conn.executemany(
+                "INSERT INTO sms_event_status (message_id, status, event_type, event_at, received_at)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(message_id) DO UPDATE SET status = excluded.status,"
+                " event_type = excluded.event_type, event_at = excluded.event_at,"
+                " received_at = excluded.received_at"
+                " WHERE CAST(excluded.event_at AS REAL) >= CAST(sms_event_status.event_at AS REAL)",
+                [
+                    (r["message_id"], r["status"], r["event_type"], r["event_at"], r["received_at"])
+                    for r in fresh if r["message_id"]
+                ],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return fresh
+
+    def status(self, message_id: str):
+        row = self._conn().execute(
+            f"SELECT {', '.join(self.STATUS_FIELDS)} FROM sms_event_status WHERE message_id = ?",
+            (message_id,),
+        ).fetchone()
+        return dict(zip(self.STATUS_FIELDS, row)) if row else None
+
+
+class SmsEventSink:
+    """
+    Consommateur de la file d'événements : lit jusqu'à `batch_size`
+    éléments (ou `flush_seconds` après le premier), les écrit dans le store
+    en une transaction, passe les nouveaux à `forward` (ex: ingestion
+    Redshift) puis ack. Échec du store : nack, le batch est représenté plus tard.
+    """
+
+    def __init__(self, source, store: SmsEventStore, forward=None, batch_size: int = 500,
+                 flush_seconds: float = 0.5, retry_delay: float = 5.0):
+        self.source = source
+        self.store = store
+        self.forward = forward
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.retry_delay = retry_delay
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sms-events", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                item = self.source.get(timeout=1.0)
+            except Exception as e:
+                print("❌ sms-events: lecture de la file impossible:", str(e))
+                self._stopping.wait(1.0)
+                continue
+            if item is None:
+                continue
+            batch = [item]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                item = self.source.get(timeout=remaining)
+                if item is None:
+                    break
+                batch.append(item)
+            self.flush(batch)
+
+    def flush(self, batch: list) -> bool:
+        try:
+            fresh = self.store.add_many(batch)
+        except Exception as e:
+            print(f"❌ sms-events: écriture impossible ({len(batch)} événements):", str(e))
+            for item in batch:
+                self.source.nack(item, self.retry_delay)
+            self._stopping.wait(self.retry_delay)
+            return False
+        SMS_EVENTS.inc(len(fresh), result="stored")
+        SMS_EVENTS.inc(len(batch) - len(fresh), result="duplicate")
+        if self.forward is not None:
+            seen = {id(r) for r in fresh}
+            for record in fresh + [r for r in batch if r.get(FORWARD_KEY) and id(r) not in seen]:
+                try:
+                    self.forward(record)
+                except Exception as e:
+                    print("❌ sms-events: forward impossible:", str(e))
+        for item in batch:
+            self.source.ack(item)
+        return True
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,240 @@
+import math
+import time
+import hashlib
+import sqlite3
+import threading
+
+from metrics import REGISTRY
+from phones import normalize_phone
+
+SUPPRESSION_CHECKS = REGISTRY.counter(
+    "suppression_checks_total", "Vérifications de la liste de désinscription", ("result",)
+)
+
+
+# ============================================================
+# Liste de désinscription (DÉSINSCRIT) : SQLite + filtre de Bloom
+# ============================================================
+# Clé = numéro E.164 ("+33612345678"). La table SQLite (clé primaire triée
+# sur disque) fait foi ; le filtre de Bloom en mémoire répond "absent" sans
+# I/O pour la quasi-totalité des numéros, seuls ses positifs vont en base.
+
+class BloomFilter:
+    """Filtre de Bloom (double hachage blake2b) : pas de faux négatif."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        if key in self:
+            return
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class SuppressionList:
+    """
+    Numéros désinscrits, partagés entre les process (SQLite WAL).
+    add() écrit en base et dans le filtre local ; les ajouts des autres
+    process sont relus (par rowid croissant) au plus toutes les
+    `refresh_seconds`, et avant chaque réponse "absent" passé ce délai.
+    `synced` = 0 tant que la ligne n'a pas été marquée DÉSINSCRIT dans le sheet.
+    """
+
+    def __init__(self, path: str, capacity: int = 1000000, error_rate: float = 0.001, refresh_seconds: float = 0.5):
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_seconds = refresh_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._last_rowid = 0
+        self._refreshed_at = 0.0
+        self.false_positives = 0
+
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS suppressed ("
+            " phone TEXT PRIMARY KEY, raw TEXT, source TEXT, created_at TEXT,"
+            " synced INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS suppressed_pending ON suppressed (synced) WHERE synced = 0")
+        self._refresh(force=True)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _refresh(self, force: bool = False):
+        if not force and time.monotonic() - self._refreshed_at < self.refresh_seconds:
+            return
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT rowid, phone FROM suppressed WHERE rowid > ? ORDER BY rowid", (self._last_rowid,)
+            ).fetchall()
+            if rows and self._bloom.count + len(rows) > self._bloom.capacity:
+                self._rebuild()
+            else:
+                for rowid, phone in rows:
+                    self._bloom.add(phone)
+                    self._last_rowid = rowid
+            self._refreshed_at = time.monotonic()
+
+    def _rebuild(self):
+        # appelé sous self._lock : filtre plein, on double la capacité
+        self.capacity *= 2
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        last = 0
+        for rowid, phone in self._conn().execute("SELECT rowid, phone FROM suppressed ORDER BY rowid"):
+            bloom.add(phone)
+            last = rowid
+        self._bloom = bloom
+        self._last_rowid = last
+
+    def add(self, phone: str, source: str = "unsubscribe") -> bool:
+        """True si le numéro n'était pas encore désinscrit."""
+        return self.add_many([phone], source) == 1
+
+    def add_many(self, phones, source: str = "unsubscribe", synced: bool = False) -> int:
+        rows = [(normalize_phone(p), str(p)) for p in phones]
+        rows = [(key, raw) for key, raw in rows if key]
+        if not rows:
+            return 0
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        conn = self._conn()
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO suppressed (phone, raw, source, created_at, synced) VALUES (?, ?, ?, ?, ?)",
+            [(key, raw, source, now, 1 if synced else 0) for key, raw in rows],
+        )
+        with self._lock:
+            for key, _ in rows:
+                self._bloom.add(key)
+        return conn.total_changes - before
+
+    def contains(self, phone: str) -> bool:
+        key = normalize_phone(phone)
+        if not key:
+            return False
+        if key not in self._bloom:
+            self._refresh()
+            if key not in self._bloom:
+                SUPPRESSION_CHECKS.inc(result="clear")
+                return False
+        row = self._conn().execute("SELECT 1 FROM suppressed WHERE phone = ?", (key,)).fetchone()
+        if row is None:
+            self.false_positives += 1
+            SUPPRESSION_CHECKS.inc(result="false_positive")
+            return False
+        SUPPRESSION_CHECKS.inc(result="suppressed")
+        return True
+
+    __contains__ = contains
+
+    def pending_sync(self, limit: int = 200) -> list:
+        """[(e164, numéro reçu)] pas encore reportés dans le sheet."""
+        return self._conn().execute(
+            "SELECT phone, raw FROM suppressed WHERE synced = 0 ORDER BY rowid LIMIT ?", (limit,)
+        ).fetchall()
+
+    def mark_synced(self, phones: list):
+        if phones:
+            self._conn().executemany("UPDATE suppressed SET synced = 1 WHERE phone = ?", [(p,) for p in phones])
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM suppressed").fetchone()[0]
+
+    def stats(self) -> dict:
+        return {
+            "bloom_entries": self._bloom.count,
+            "bloom_bits": self._bloom.size,
+            "false_positives": self.false_positives,
+        }
+
+
+class SuppressionSync:
+    """
+    Thread (leader) qui reporte les désinscriptions dans le sheet par
+    paquets : `apply_batch(rows)` reçoit [(e164, raw)] et retourne les
+    numéros traités (écrits ou absents du sheet), marqués synced.
+    `seed()` est appelé une fois au démarrage (ex: import des DÉSINSCRIT
+    déjà présents dans le sheet).
+    """
+
+    def __init__(self, suppression: SuppressionList, apply_batch, interval: float = 5.0, batch_size: int = 200,
+                 seed=None):
+        self.suppression = suppression
+        self.apply_batch = apply_batch
+        self.interval = interval
+        self.batch_size = batch_size
+        self._seed = seed
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="suppression-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def notify(self):
+        self._wake.set()
+
+    def _run(self):
+        if self._seed is not None:
+            try:
+                added = self._seed()
+                if added:
+                    print(f"🚫 {added} désinscription(s) importée(s) depuis le sheet")
+            except Exception as e:
+                print("❌ Import des désinscriptions impossible:", str(e))
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.sync_once()
+
+    def sync_once(self) -> int:
+        done = 0
+        while not self._stopping.is_set():
+            rows = self.suppression.pending_sync(self.batch_size)
+            if not rows:
+                break
+            try:
+                synced = self.apply_batch(rows)
+            except Exception as e:
+                print("❌ Sync des désinscriptions vers le sheet:", str(e))
+                break
+            self.suppression.mark_synced(synced)
+            done += len(synced)
+            if len(synced) < len(rows):
+                break   # échecs partiels : on réessaie au prochain tour
+        return done
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
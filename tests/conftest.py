@@ -0,0 +1,38 @@
+import os
+import sys
+
+# modules de l'app (racine du dépôt) et fakes des benchmarks
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """app.py importé une fois, sans consumers, Sheets remplacé par le fake des benchmarks."""
+    import rsa
+    from fakes import FakeGspreadClient
+
+    _, key = rsa.newkeys(1024)
+    os.environ.update({
+        "TYPE": "service_account",
+        "PROJECT_ID": "test",
+        "PRIVATE_KEY_ID": "test",
+        "PRIVATE_KEY": key.save_pkcs1().decode("ascii"),
+        "CLIENT_EMAIL": "test@test.iam.gserviceaccount.com",
+        "CLIENT_ID": "1",
+        "TOKEN_URI": "https://oauth2.googleapis.com/token",
+        "APP_MANAGED_START": "1",
+        "RUN_CONSUMERS": "0",
+        "QUEUE_DIR": str(tmp_path_factory.mktemp("queues")),
+        "SHEET_KEY": "fake-spreadsheet",
+        "ADMIN_TOKEN": "test-admin",
+        "ROUTING_FILE": "",
+        "ROUTING_SHEET_TAB": "",
+    })
+    import app
+
+    app.worksheet_cache.client = FakeGspreadClient()
+    return app
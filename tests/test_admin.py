@@ -0,0 +1,13 @@
+def test_admin_routes_require_the_token(app_module):
+    client = app_module.app.test_client()
+    assert client.get("/dead_letters").status_code == 401
+    assert client.get("/dead_letters", headers={"X-Admin-Token": "wrong"}).status_code == 401
+    assert client.get("/dead_letters", headers={"X-Admin-Token": "test-admin"}).status_code == 200
+
+
+def test_admin_routes_are_closed_without_a_configured_token(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "")
+    client = app_module.app.test_client()
+    for method, path in (("get", "/dead_letters"), ("post", "/dead_letters/replay"), ("get", "/routing"),
+                         ("post", "/leads_pv/bulk"), ("get", "/sms/abc")):
+        assert getattr(client, method)(path, headers={"X-Admin-Token": ""}).status_code == 401, path
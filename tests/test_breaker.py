@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from breaker import CircuitBreaker, CircuitOpen, CLOSED, OPEN
+
+
+def _pair(tmp_path, **options):
+    """Deux process qui partagent le même fichier d'état."""
+    path = str(tmp_path / "breakers" / "sheets.json")
+    options.setdefault("min_calls", 2)
+    return (CircuitBreaker("sheets", state_path=path, **options),
+            CircuitBreaker("sheets", state_path=path, **options))
+
+
+def _fail(breaker, n):
+    for _ in range(n):
+        with pytest.raises(RuntimeError):
+            with breaker:
+                raise RuntimeError("503")
+
+
+def test_circuit_opened_in_one_process_is_open_in_the_others(tmp_path):
+    leader, web = _pair(tmp_path)
+    _fail(leader, 2)
+    assert leader.state == OPEN
+
+    stats = web.stats()   # /health servi par un autre worker
+    assert stats["state"] == OPEN and stats["opened"] == 1
+    assert 0 < stats["retry_in"] <= leader.open_seconds
+    with pytest.raises(CircuitOpen):
+        web.before_call()
+
+
+def test_close_is_shared(tmp_path):
+    leader, web = _pair(tmp_path, open_seconds=0.2)
+    _fail(leader, 2)
+    assert web.stats()["state"] == OPEN
+
+    time.sleep(0.25)
+    with leader:   # essai half_open réussi
+        pass
+    assert leader.state == CLOSED
+    assert web.stats()["state"] == CLOSED
+
+
+def test_expired_state_from_a_previous_run_is_ignored(tmp_path):
+    old, _ = _pair(tmp_path, open_seconds=0.01)
+    _fail(old, 2)
+    time.sleep(0.05)
+    fresh = CircuitBreaker("sheets", state_path=old.state_path)
+    assert fresh.stats()["state"] == CLOSED
+    with fresh:
+        pass
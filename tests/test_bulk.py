@@ -0,0 +1,65 @@
+import json
+import uuid
+
+ADMIN = {"X-Admin-Token": "test-admin"}
+
+
+def _lead(phone):
+    return {"telephone": phone, "nom": "Bulk", "prenom": "Lead", "email": "b@bulk.fr",
+            "code_postal": "54000", "nonce": uuid.uuid4().hex}
+
+
+def _post(app, records):
+    body = "".join(json.dumps(r) + "\n" for r in records)
+    response = app.app.test_client().post("/leads_pv/bulk", data=body, headers=ADMIN,
+                                          content_type="application/x-ndjson")
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_duplicate_phones_in_the_body_are_queued_once(app_module):
+    before = len(app_module.lead_queue)
+    lines = _post(app_module, [_lead("0612000001"), _lead("0612000001"), _lead("12")])
+    assert [r.get("status") for r in lines[:3]] == ["queued", "duplicate", "invalid"]
+    assert lines[-1]["summary"]["queued"] == 1
+    assert len(app_module.lead_queue) == before + 1
+
+
+def test_failing_line_does_not_lose_the_others(app_module, monkeypatch):
+    records = [_lead("06120000%02d" % i) for i in range(2, 6)]
+    real = app_module.normalize_phone
+    calls = []
+
+    def flaky(phone):
+        calls.append(phone)
+        if len(calls) == 3:
+            raise RuntimeError("sheets indisponible")
+        return real(phone)
+
+    monkeypatch.setattr(app_module, "normalize_phone", flaky)
+    before = len(app_module.lead_queue)
+    lines = _post(app_module, records)
+    assert [r["status"] for r in lines[:4]] == ["queued", "queued", "error", "queued"]
+    assert len(app_module.lead_queue) == before + 3
+
+    # retry du client : seule la ligne en échec est traitée à nouveau
+    monkeypatch.setattr(app_module, "normalize_phone", real)
+    lines = _post(app_module, records)
+    assert [r["status"] for r in lines[:4]] == ["duplicate", "duplicate", "queued", "duplicate"]
+    assert len(app_module.lead_queue) == before + 4
+
+
+def test_interrupted_stream_still_queues_claimed_lines(app_module, monkeypatch):
+    records = [_lead("0612000010"), _lead("0612000011")]
+
+    def broken(stream, content_type):
+        yield 1, records[0]
+        yield 2, records[1]
+        raise OSError("connexion coupée")
+
+    monkeypatch.setattr(app_module, "_bulk_records", broken)
+    before = len(app_module.lead_queue)
+    try:
+        _post(app_module, records)
+    except OSError:
+        pass
+    assert len(app_module.lead_queue) == before + 2
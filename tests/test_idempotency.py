@@ -0,0 +1,41 @@
+import time
+
+from idempotency import IdempotencyStore, idempotency_key
+
+
+def test_key_prefers_header_then_event_id_then_payload_hash():
+    payload = {"event_id": "ev1", "b": 1, "a": 2}
+    assert idempotency_key("leads", " abc ", payload) == "leads:h:abc"
+    assert idempotency_key("leads", "", payload) == "leads:e:ev1"
+    # hash du JSON canonique : l'ordre des clés ne compte pas
+    assert idempotency_key("leads", "", {"b": 1, "a": 2}) == idempotency_key("leads", "", {"a": 2, "b": 1})
+    assert idempotency_key("leads", "", {"a": 1}) != idempotency_key("leads_pv", "", {"a": 1})
+
+
+def test_claim_is_refused_until_the_ttl_expires():
+    store = IdempotencyStore(ttl=0.1)
+    assert store.claim("k")
+    assert not store.claim("k")
+    assert store.duplicates == 1
+    time.sleep(0.15)
+    assert store.claim("k")
+
+
+def test_release_lets_the_retry_through(tmp_path):
+    store = IdempotencyStore(path=str(tmp_path / "idempotency.db"))
+    other = IdempotencyStore(path=str(tmp_path / "idempotency.db"))
+    assert store.claim("k")
+    store.release("k")
+    assert other.claim("k")
+    assert not store.claim("k")
+
+
+def test_claims_are_shared_between_processes_until_they_expire(tmp_path):
+    path = str(tmp_path / "idempotency.db")
+    store, other = IdempotencyStore(ttl=0.1, path=path), IdempotencyStore(ttl=0.1, path=path)
+    assert store.claim("k")
+    assert not other.claim("k")
+    assert other.duplicates == 1
+    time.sleep(0.15)
+    # clé expirée en base : reprise par un autre worker
+    assert IdempotencyStore(ttl=0.1, path=path).claim("k")
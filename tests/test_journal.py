@@ -0,0 +1,126 @@
+import os
+
+from journal import SegmentedQueue, SEGMENT_SUFFIX
+
+
+def _open(path, **options):
+    options.setdefault("fsync", "os")
+    return SegmentedQueue(str(path), **options)
+
+
+def _drain(q):
+    items = []
+    while True:
+        item = q.get()
+        if item is None:
+            return items
+        items.append(item)
+
+
+def _segments(path):
+    return sorted(n for n in os.listdir(path) if n.endswith(SEGMENT_SUFFIX))
+
+
+def test_fifo_across_restart(tmp_path):
+    q = _open(tmp_path)
+    q.put_many([{"n": i} for i in range(5)])
+    first = q.get()
+    q.ack(first)
+    q.close()
+
+    q = _open(tmp_path)
+    assert _drain(q) == [{"n": i} for i in range(1, 5)]
+
+
+def test_unacked_items_are_delivered_again(tmp_path):
+    q = _open(tmp_path)
+    q.put_many([{"n": 1}, {"n": 2}, {"n": 3}])
+    q.get()    # toujours en cours : l'offset ne bouge pas
+    q.ack(q.get())
+    q.close()
+
+    q = _open(tmp_path)
+    items = _drain(q)
+    assert items == [{"n": 1}, {"n": 2}, {"n": 3}]
+    for item in items:
+        q.ack(item)
+    q.close()
+
+    q = _open(tmp_path)
+    assert q.get() is None
+
+
+def test_segments_are_deleted_once_acked(tmp_path):
+    q = _open(tmp_path, segment_bytes=64)
+    q.put_many([{"payload": "x" * 40, "n": i} for i in range(6)])
+    assert len(_segments(tmp_path)) > 3
+    items = _drain(q)
+    assert len(items) == 6
+    # lus mais pas ack : les segments restent
+    assert len(_segments(tmp_path)) > 3
+    for item in items:
+        q.ack(item)
+    assert len(_segments(tmp_path)) == 1
+
+
+def test_producer_follows_rotation_past_deleted_segments(tmp_path):
+    # un worker web (producteur seul) et le leader sur le même répertoire
+    web = _open(tmp_path, segment_bytes=64)
+    leader = _open(tmp_path, segment_bytes=64)
+    web.put({"n": 0})
+    leader.put_many([{"payload": "x" * 40, "n": i} for i in range(1, 6)])
+    for item in _drain(leader):
+        leader.ack(item)
+    # les segments où écrivait le worker web ont été supprimés
+    assert len(_segments(tmp_path)) == 1
+    web.put({"n": 99})
+    assert leader.get() == {"n": 99}
+
+
+def test_depth_is_shared_between_processes(tmp_path):
+    web = _open(tmp_path)
+    leader = _open(tmp_path, segment_bytes=64)
+    web.put_many([{"payload": "x" * 40, "n": i} for i in range(5)])
+    leader.put({"n": 5})
+    assert len(web) == len(leader) == 6
+
+    items = _drain(leader)
+    assert len(web) == 6   # lus mais pas ack : toujours en file
+    for item in items[:4]:
+        leader.ack(item)
+    assert len(web) == len(leader) == 2
+
+    # un troisième process qui démarre maintenant voit la même profondeur
+    assert len(_open(tmp_path)) == 2
+
+
+def test_new_leader_resumes_from_the_acked_offset(tmp_path):
+    leader = _open(tmp_path, segment_bytes=64)
+    standby = _open(tmp_path, segment_bytes=64)   # ouvert au démarrage, avant les acks
+    leader.put_many([{"payload": "x" * 40, "n": i} for i in range(5)])
+    for item in _drain(leader):
+        leader.ack(item)
+    leader.close()
+
+    standby.take_over()
+    assert standby.get() is None   # rien de relivré
+    standby.put_many([{"payload": "y" * 40, "n": i} for i in range(5, 8)])
+    assert [item["n"] for item in _drain(standby)] == [5, 6, 7]
+
+
+def test_legacy_queue_is_imported_once_by_concurrent_workers(tmp_path):
+    import json
+    import threading
+    from journal import import_legacy_json
+
+    legacy = str(tmp_path / "leads_queue.json")
+    with open(legacy, "w") as f:
+        json.dump([{"n": i} for i in range(50)], f)
+    q = _open(tmp_path / "q")
+    workers = [threading.Thread(target=import_legacy_json, args=(q, legacy)) for _ in range(8)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    assert [item["n"] for item in _drain(q)] == list(range(50))
+    assert os.path.exists(legacy + ".migrated")
@@ -0,0 +1,37 @@
+import uuid
+
+LEADS_PV = "/leads_pv"
+
+
+def _lead(phone):
+    return {"telephone": phone, "nom": "Pv", "prenom": "Lead", "email": "p@pv.fr",
+            "code_postal": "54000", "nonce": uuid.uuid4().hex}
+
+
+def test_failed_lead_enqueue_writes_nothing_and_the_retry_is_processed(app_module, monkeypatch):
+    lead = _lead("0612000101")
+    real = app_module.lead_queue.put
+    monkeypatch.setattr(app_module.lead_queue, "put", lambda item: (_ for _ in ()).throw(OSError("disk full")))
+    before = len(app_module.redshift_queue)
+    client = app_module.app.test_client()
+    assert client.post(LEADS_PV, json=lead).status_code == 500
+    assert len(app_module.redshift_queue) == before
+
+    # retry du client : la clé a été libérée, lead et row partent une seule fois
+    monkeypatch.setattr(app_module.lead_queue, "put", real)
+    leads = len(app_module.lead_queue)
+    assert client.post(LEADS_PV, json=lead).status_code == 200
+    assert len(app_module.lead_queue) == leads + 1
+    assert len(app_module.redshift_queue) == before + 1
+    assert client.post(LEADS_PV, json=lead).get_json()["duplicate"] is True
+    assert len(app_module.redshift_queue) == before + 1
+
+
+def test_failed_redshift_enqueue_is_dead_lettered_once_the_lead_is_queued(app_module, monkeypatch):
+    lead = _lead("0612000102")
+    monkeypatch.setattr(app_module.redshift_queue, "put", lambda item: (_ for _ in ()).throw(OSError("disk full")))
+    dead = len(app_module.retry_manager.dead_letters.list(queue_name="redshift"))
+    leads = len(app_module.lead_queue)
+    assert app_module.app.test_client().post(LEADS_PV, json=lead).status_code == 200
+    assert len(app_module.lead_queue) == leads + 1
+    assert len(app_module.retry_manager.dead_letters.list(queue_name="redshift")) == dead + 1
@@ -0,0 +1,56 @@
+import json
+import os
+
+from metrics import Registry, MultiProcessCollector
+
+
+def _registry(depth, in_flight):
+    registry = Registry()
+    registry.counter("leads_total", "Leads")
+    registry.histogram("lead_seconds", "Latence", buckets=(1.0,))
+    registry.gauge("queue_depth", "Profondeur", lambda: depth, multiprocess="local")
+    registry.gauge("in_flight", "En cours", lambda: in_flight)
+    registry.gauge("pending", "Buffer", lambda: 1, multiprocess="sum")
+    return registry
+
+
+def _values(text):
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+
+
+def _fake_process(directory, pid, role, counters, gauges):
+    with open(os.path.join(directory, "%d-test.json" % pid), "w") as f:
+        json.dump({"pid": pid, "role": role, "counters": counters, "gauges": gauges}, f)
+
+
+def test_counters_are_summed_and_gauges_taken_from_leader(tmp_path):
+    web = _registry(depth=7, in_flight=0)
+    web.metrics()[0].inc(2)
+    collector = MultiProcessCollector(web, str(tmp_path), role=lambda: "web")
+    collector.start()
+    # le leader : un autre process vivant (pid du parent)
+    _fake_process(tmp_path, os.getppid(), "leader",
+                  {"leads_total": [[[], 3]], "lead_seconds": [[[], [1, 0, 0.5, 1]]]},
+                  {"in_flight": [[[], 4]], "pending": [[[], 2]]})
+
+    values = _values(collector.render())
+    assert values["leads_total"] == "5"
+    assert values['lead_seconds_bucket{le="1.0"}'] == "1"
+    assert values["in_flight"] == "4"        # leader, pas le process web
+    assert values["pending"] == "3"          # somme des process
+    assert values["queue_depth"] == "7"      # évaluée localement
+    collector.close()
+
+
+def test_counters_of_dead_processes_are_kept(tmp_path):
+    registry = _registry(depth=0, in_flight=0)
+    first = MultiProcessCollector(registry, str(tmp_path))
+    first.start()
+    _fake_process(tmp_path, 2 ** 22 + 1, "web", {"leads_total": [[[], 4]]}, {})   # pid inexistant
+
+    registry.metrics()[0].inc(1)
+    first.close()   # arrêt propre : replié dans l'archive
+
+    second = MultiProcessCollector(_registry(depth=0, in_flight=0), str(tmp_path))
+    assert _values(second.render())["leads_total"] == "5"
+    assert _values(second.render())["leads_total"] == "5"   # repli fait une seule fois
@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+from pg_pool import ConnectionPool, PoolTimeout
+
+
+class FakeConn:
+    def __init__(self, n):
+        self.n = n
+        self.closed = 0
+        self.autocommit = False
+        self.healthy = True
+        self.selects = 0
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql):
+                conn.selects += 1
+                if not conn.healthy:
+                    raise OSError("server closed the connection")
+
+        return Cursor()
+
+    def close(self):
+        self.closed = 1
+
+
+def _pool(**options):
+    opened = []
+
+    def connect():
+        opened.append(FakeConn(len(opened)))
+        return opened[-1]
+
+    return ConnectionPool(connect, **options), opened
+
+
+def test_checkout_times_out_when_the_pool_is_full():
+    pool, _ = _pool(maxconn=1, checkout_timeout=0.1)
+    conn = pool.getconn()
+    start = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert time.monotonic() - start >= 0.1
+    assert pool.stats()["timeouts"] == 1 and pool.stats()["waits"] == 1
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+
+def test_idle_connection_is_validated_and_discarded_when_broken():
+    pool, opened = _pool(validate_after=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn and conn.selects == 1
+    conn.healthy = False
+    pool.putconn(conn)
+    fresh = pool.getconn()
+    assert fresh is not conn and conn.closed
+    assert len(opened) == 2 and pool.stats()["in_use"] == 1
+
+
+def test_recently_used_connection_skips_validation():
+    pool, _ = _pool(validate_after=60)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn and conn.selects == 0
+
+
+def test_broken_connection_returned_with_close_is_discarded():
+    pool, _ = _pool()
+    conn = pool.getconn()
+    pool.putconn(conn, close=True)
+    assert conn.closed and pool.stats()["idle"] == 0
+
+
+def test_connections_older_than_max_lifetime_are_recycled():
+    pool, opened = _pool(max_lifetime=0.05)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    time.sleep(0.06)
+    pool.putconn(conn)   # trop vieille : fermée au retour
+    assert conn.closed and pool.stats()["idle"] == 0
+    assert pool.getconn() is opened[1]
+
+
+def test_closeall_closes_idle_and_returned_connections():
+    pool, _ = _pool()
+    idle, busy = pool.getconn(), pool.getconn()
+    pool.putconn(idle)
+    pool.closeall()
+    assert idle.closed and not busy.closed
+    pool.putconn(busy)
+    assert busy.closed and pool.stats()["idle"] == 0
@@ -0,0 +1,78 @@
+from sheets import PhoneIndex, RowRef, PHONE_COL
+
+
+def _sheet(*phones):
+    rows = [["header"] * 15]
+    for phone in phones:
+        row = [""] * 15
+        row[PHONE_COL - 1] = phone
+        rows.append(row)
+    return rows
+
+
+class FakeSheet:
+    def __init__(self, *phones):
+        self.rows = _sheet(*phones)
+        self.loads = 0
+
+    def load(self, tab):
+        self.loads += 1
+        return [list(r) for r in self.rows]
+
+    def write(self, ref, phone):
+        while len(self.rows) < ref.row:
+            self.rows.append([""] * 15)
+        self.rows[ref.row - 1][PHONE_COL - 1] = phone
+
+
+def test_reserve_skips_known_phones():
+    index = PhoneIndex(FakeSheet("+33600000001").load)
+    assert index.reserve("+33600000001") is None
+    assert index.reserve("+33600000002") == RowRef("", 3)
+
+
+def test_release_does_not_give_away_pending_rows():
+    sheet = FakeSheet()
+    index = PhoneIndex(sheet.load)
+    a = index.reserve("A")
+    index.reserve("B")
+    index.release("B")
+    c = index.reserve("C")
+    assert a == RowRef("", 2)
+    assert c == RowRef("", 3)
+    assert index.lookup("A") == a
+    assert sheet.loads == 1
+
+
+def test_release_keeps_hole_below_pending_rows():
+    index = PhoneIndex(FakeSheet().load)
+    index.reserve("A")
+    index.reserve("B")
+    index.release("A")
+    assert index.reserve("C") == RowRef("", 4)
+
+
+def test_resync_keeps_pending_reservations():
+    sheet = FakeSheet()
+    index = PhoneIndex(sheet.load, resync_seconds=0)
+    a = index.reserve("A")
+    b = index.reserve("B")
+    sheet.write(a, "A")
+    index.confirm("A")
+    # B pas encore écrit : le rechargement ne doit ni l'oublier ni réutiliser sa ligne
+    c = index.reserve("C")
+    assert sheet.loads > 1
+    assert index.lookup("B") == b
+    assert c == RowRef("", 4)
+    assert index.reserve("B") is None
+
+
+def test_confirmed_rows_come_from_the_sheet():
+    sheet = FakeSheet()
+    index = PhoneIndex(sheet.load, resync_seconds=0)
+    a = index.reserve("A")
+    sheet.write(a, "A")
+    index.confirm("A")
+    index.release("A")   # après confirm : sans effet
+    assert index.lookup("A") == a
+    assert index.reserve("D") == RowRef("", 3)
@@ -0,0 +1,64 @@
+import pytest
+
+from phones import INVALID, PhoneInfo, normalize_phone, parse_phone, sms_capable
+
+
+@pytest.mark.parametrize("raw, e164, kind", [
+    # mobiles métropole, toutes les formes reçues
+    ("06 12 34 56 78", "+33612345678", "mobile"),
+    ("06.12.34.56.78", "+33612345678", "mobile"),
+    ("0712345678", "+33712345678", "mobile"),
+    ("+33 6 12 34 56 78", "+33612345678", "mobile"),
+    ("+33 (0)6 12 34 56 78", "+33612345678", "mobile"),
+    ("0033612345678", "+33612345678", "mobile"),
+    ("33612345678", "+33612345678", "mobile"),
+    ("612345678", "+33612345678", "mobile"),
+    # fixes, numéros spéciaux, VoIP
+    ("01 23 45 67 89", "+33123456789", "landline"),
+    ("+33 5 56 00 00 00", "+33556000000", "landline"),
+    ("0800 12 34 56", "+33800123456", "special"),
+    ("09 51 23 45 67", "+33951234567", "voip"),
+    # DOM : préfixes nationaux ou saisis avec +33
+    ("0692 12 34 56", "+262692123456", "mobile"),
+    ("+33 692 12 34 56", "+262692123456", "mobile"),
+    ("+262 692 12 34 56", "+262692123456", "mobile"),
+    ("0262 20 12 34", "+262262201234", "landline"),
+    ("0690 12 34 56", "+590690123456", "mobile"),
+    ("00590 590 12 34 56", "+590590123456", "landline"),
+    ("0694 12 34 56", "+594694123456", "mobile"),
+    ("0696 12 34 56", "+596696123456", "mobile"),
+    ("+596 596 12 34 56", "+596596123456", "landline"),
+    # étranger : laissé à Vonage
+    ("+44 20 7946 0958", "+442079460958", "foreign"),
+    ("0041 44 668 18 00", "+41446681800", "foreign"),
+])
+def test_valid_numbers(raw, e164, kind):
+    assert parse_phone(raw) == PhoneInfo(e164, kind)
+    assert normalize_phone(raw) == e164
+
+
+@pytest.mark.parametrize("raw", [
+    "", "   ", "abc", "12", "0612", "061234567", "06123456789",
+    "+33012345678", "+3361234567", "0012", "+262 612 34 56 78", "0000000000",
+])
+def test_invalid_numbers(raw):
+    assert parse_phone(raw) == INVALID
+    assert normalize_phone(raw) == ""
+
+
+def test_non_string_input():
+    assert normalize_phone(None) == ""
+    assert normalize_phone(612345678) == "+33612345678"
+
+
+@pytest.mark.parametrize("raw, capable", [
+    ("0612345678", True),
+    ("0692123456", True),
+    ("+442079460958", True),
+    ("0123456789", False),
+    ("0800123456", False),
+    ("0262201234", False),
+    ("12", False),
+])
+def test_sms_capable(raw, capable):
+    assert sms_capable(raw) is capable
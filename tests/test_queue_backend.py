@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+from journal import SegmentedQueue
+from queue_backend import QueueBackend, SqliteQueue
+
+
+def test_backend_must_implement_the_interface():
+    class Incomplete(QueueBackend):
+        def put_many(self, items):
+            pass
+
+    with pytest.raises(TypeError):
+        QueueBackend()
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_backends_are_queue_backends(tmp_path):
+    assert isinstance(SegmentedQueue(str(tmp_path / "journal"), fsync="os"), QueueBackend)
+    assert isinstance(SqliteQueue(str(tmp_path / "queues.db"), "leads"), QueueBackend)
+
+
+def _sqlite(tmp_path, **options):
+    options.setdefault("len_ttl", 0)
+    return SqliteQueue(str(tmp_path / "queues.db"), "leads", **options)
+
+
+def _status(q):
+    return dict(q._conn().execute("SELECT payload, status FROM queue_items ORDER BY id").fetchall())
+
+
+def test_get_claims_a_batch_and_serves_it_one_by_one(tmp_path):
+    q = _sqlite(tmp_path, batch_size=2)
+    q.put_many([{"n": i} for i in range(3)])
+    assert q.get() == {"n": 0}
+    assert list(_status(q).values()) == ["leased", "leased", "ready"]
+    assert q.get() == {"n": 1}
+    assert q.get() == {"n": 2}
+    assert q.get() is None
+
+
+def test_expired_lease_is_claimed_by_another_consumer(tmp_path):
+    q, other = _sqlite(tmp_path, lease_seconds=0.1), _sqlite(tmp_path)
+    q.put({"n": 1})
+    item = q.get()
+    assert other.get() is None
+    time.sleep(0.15)
+    assert other.get() == item
+    # ack tardif du premier consommateur : sans effet sur le bail de l'autre
+    q.ack(item)
+    assert len(q) == 1
+
+
+def test_buffered_rows_get_their_lease_renewed_when_served(tmp_path):
+    q, other = _sqlite(tmp_path, lease_seconds=0.2), _sqlite(tmp_path)
+    q.put_many([{"n": 1}, {"n": 2}])
+    assert q.get() == {"n": 1}
+    time.sleep(0.12)
+    assert q.get() == {"n": 2}   # servi après un demi-bail : bail prolongé
+    time.sleep(0.12)
+    assert other.get() == {"n": 1}
+    assert other.get() is None
+
+
+def test_buffered_row_taken_by_another_consumer_is_skipped(tmp_path):
+    q, other = _sqlite(tmp_path, lease_seconds=0.1), _sqlite(tmp_path, batch_size=1)
+    q.put_many([{"n": 1}, {"n": 2}])
+    q.ack(q.get())
+    time.sleep(0.15)
+    assert other.get() == {"n": 2}
+    assert q.get() is None
+
+
+def test_ack_and_nack(tmp_path):
+    q = _sqlite(tmp_path)
+    q.put_many([{"n": 1}, {"n": 2}])
+    a, b = q.get(), q.get()
+    q.ack(a)
+    q.nack(b, delay=0.1)
+    assert _status(q) == {'{"n":1}': "done", '{"n":2}': "ready"}
+    assert len(q) == 1
+    assert q.get() is None
+    time.sleep(0.15)
+    assert q.get() == b
+
+
+def test_purge_removes_old_done_rows_only(tmp_path):
+    q = _sqlite(tmp_path, retention_seconds=0)
+    q.put_many([{"n": 1}, {"n": 2}])
+    q.ack(q.get())
+    assert q.purge() == 1
+    assert list(_status(q)) == ['{"n":2}']
+
+
+def test_len_is_cached(tmp_path):
+    q = _sqlite(tmp_path, len_ttl=60)
+    assert len(q) == 0
+    q.put({"n": 1})
+    assert len(q) == 0
+    q.len_ttl = 0
+    assert len(q) == 1
@@ -0,0 +1,133 @@
+import psycopg2
+import pytest
+
+from fakes import Faults, FakeRedshift, FakeS3
+from journal import SegmentedQueue
+from pg_pool import ConnectionPool
+from queue_backend import SqliteQueue
+from redshift_ingest import RedshiftIngestor
+
+TABLE = "public.leads"
+COLUMNS = ("telephone", "nom")
+
+
+def _rows(n):
+    return [{"telephone": "+3361234567%d" % i, "nom": "N'%d" % i} for i in range(n)]
+
+
+def _drain(q):
+    items = []
+    while True:
+        item = q.get()
+        if item is None:
+            return items
+        items.append(item)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-3")
+    server = FakeS3().start()
+    yield server
+    server.stop()
+
+
+def _database(s3=None, faults=None):
+    db = FakeRedshift(s3, faults).start()
+    pool = ConnectionPool(lambda: psycopg2.connect(
+        host=db.host, port=db.port, dbname="dev", user="bench", password="bench",
+        sslmode="disable", connect_timeout=5,
+    ), maxconn=2, checkout_timeout=2)
+    return db, pool
+
+
+@pytest.fixture
+def redshift(s3):
+    db, pool = _database(s3)
+    yield db, pool
+    pool.closeall()
+    db.stop()
+
+
+@pytest.fixture
+def failing_redshift():
+    db, pool = _database(faults=Faults(fail_rate=1.0))
+    yield db, pool
+    pool.closeall()
+    db.stop()
+
+
+def test_rows_are_acked_only_after_flush(tmp_path, redshift):
+    db, pool = redshift
+    source = SqliteQueue(str(tmp_path / "queues.db"), "redshift", lease_seconds=0.2, len_ttl=0)
+    source.put_many(_rows(3))
+    ingestor = RedshiftIngestor(lambda: pool, TABLE, COLUMNS, on_flushed=lambda rows: [
+        source.ack(r) for r in rows
+    ])
+    for _ in range(3):
+        ingestor.add(source.get())
+    assert ingestor.pending() == 3
+    # bufferisées mais pas insérées : toujours dues par la file
+    assert len(source) == 3
+
+    with ingestor._cond:
+        batch = ingestor._take()
+    assert ingestor.flush(batch)
+    assert db.tables[TABLE] == _rows(3)
+    assert db.calls["insert"] == 1 and db.calls["commit"] == 1
+    assert len(source) == 0
+
+
+def test_failed_batch_is_rolled_back_and_acked_once_handed_to_retry(failing_redshift):
+    db, pool = failing_redshift
+    retried, acked = [], []
+    ingestor = RedshiftIngestor(lambda: pool, TABLE, COLUMNS,
+                                on_failure=lambda rows, e: retried.extend(rows), on_flushed=acked.extend)
+    rows = _rows(2)
+    assert not ingestor.flush(rows)
+    assert retried == rows
+    assert acked == rows
+    assert db.rows == 0 and db.calls["rollback"] == 1
+    # erreur SQL, pas une coupure : la connexion revient dans le pool
+    assert pool.stats()["idle"] == 1
+
+
+def test_batch_goes_back_to_the_queue_when_retry_fails(tmp_path, failing_redshift):
+    _, pool = failing_redshift
+    source = SegmentedQueue(str(tmp_path / "redshift"), fsync="os")
+    source.put_many(_rows(3))
+    scheduled = []
+
+    def on_failure(rows, e):
+        for row in rows:
+            if len(scheduled) == 1:
+                raise OSError("disk full")
+            scheduled.append(row)
+            source.ack(row)
+
+    ingestor = RedshiftIngestor(lambda: pool, TABLE, COLUMNS, on_failure=on_failure,
+                                on_dropped=lambda rows: [source.nack(r) for r in rows])
+    rows = [source.get() for _ in range(3)]
+    assert not ingestor.flush(rows)
+    # la row déjà reprogrammée n'est pas représentée, les autres le sont
+    assert scheduled == _rows(1)
+    assert _drain(source) == _rows(3)[1:]
+    source.close()
+    # l'offset a progressé : rien n'est rejoué au redémarrage hors rows représentées
+    source = SegmentedQueue(str(tmp_path / "redshift"), fsync="os")
+    assert _drain(source) == _rows(3)[1:]
+
+
+def test_large_batch_is_copied_through_s3(redshift, s3):
+    db, pool = redshift
+    ingestor = RedshiftIngestor(lambda: pool, TABLE, COLUMNS, copy_min_rows=3, s3_bucket="staging",
+                                iam_role="arn:aws:iam::1:role/copy", s3_endpoint_url=s3.endpoint_url)
+    assert ingestor.flush(_rows(3))
+    assert db.tables[TABLE] == _rows(3)
+    assert db.calls["copy"] == 1 and db.calls["insert"] == 0
+    # fichier de staging supprimé après le COPY
+    assert s3.calls["put_object"] == 1 and s3.calls["delete_object"] == 1
+    assert s3.objects == {}
+    assert pool.stats()["in_use"] == 0
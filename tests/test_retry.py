@@ -0,0 +1,72 @@
+import json
+import time
+
+from retry import DelayQueue, RetryManager, RetryPolicy
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_fired_entries_are_not_replayed_after_restart(tmp_path):
+    path = str(tmp_path / "retry_schedule.jsonl")
+    fired = []
+    q = DelayQueue(path, lambda name, item: fired.append(item))
+    q.schedule(0, "sms", {"n": 1})
+    q.schedule(0, "sms", {"n": 2})
+    q.schedule(3600, "sms", {"n": 3})
+    q.start()
+    assert _wait_for(lambda: len(fired) == 2)
+
+    # redémarrage sans arrêt propre (crash, SIGKILL)
+    again = []
+    q2 = DelayQueue(path, lambda name, item: again.append(item)).start()
+    time.sleep(0.2)
+    assert again == []
+    assert len(q2) == 1
+    q2.stop()
+
+
+def test_stop_compacts_the_schedule(tmp_path):
+    path = tmp_path / "retry_schedule.jsonl"
+    fired = []
+    q = DelayQueue(str(path), lambda name, item: fired.append(item))
+    q.start()
+    q.schedule(0, "leads", {"n": 1})
+    q.schedule(3600, "leads", {"n": 2})
+    assert _wait_for(lambda: len(fired) == 1)
+    q.stop()
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["item"] for line in lines] == [{"n": 2}]
+
+
+def test_failures_back_off_then_dead_letter(tmp_path):
+    requeued = []
+    manager = RetryManager(str(tmp_path), {"leads": requeued.append}, RetryPolicy(max_attempts=2, base_delay=60))
+    item = {"n": 1}
+    manager.fail("leads", item, RuntimeError("boom"))
+    assert len(manager.delayed) == 1
+    manager.fail("leads", item, RuntimeError("boom"))
+    [entry] = manager.dead_letters.list("leads")
+    assert entry["attempts"] == 2 and entry["error"] == "boom"
+    assert manager.replay(queue_name="leads") == 1
+    assert requeued == [{"n": 1}]
+
+
+def test_replay_keeps_entries_that_could_not_be_requeued(tmp_path):
+    requeued = []
+
+    def requeue(item):
+        if item["n"] == 2:
+            raise OSError("disk full")
+        requeued.append(item)
+
+    manager = RetryManager(str(tmp_path), {"leads": requeue})
+    for n in (1, 2, 3):
+        manager.dead_letters.add("leads", {"n": n}, "boom")
+    assert manager.replay(queue_name="leads") == 1
+    assert requeued == [{"n": 1}]
+    assert [e["item"]["n"] for e in manager.dead_letters.list("leads")] == [2, 3]
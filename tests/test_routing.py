@@ -0,0 +1,86 @@
+from routing import LeadRouter, department_code, sheet_rules
+
+
+def _router(rules, **options):
+    return LeadRouter(lambda: rules, **options)
+
+
+def test_uncounted_assignments_do_not_use_the_daily_cap():
+    router = _router({"A": {"departments": [54], "daily_cap": 1}})
+    # lead KO (rouge) : affiché avec ses clients, mais pas routé
+    assert router.assign("54", count=False) == ["A"]
+    assert router.stats()["counts"] == {}
+    assert router.assign("54") == ["A"]
+    assert router.assign("54", count=False) == []
+
+
+def test_department_code():
+    assert department_code("54000") == "54"
+    assert department_code("1000") == "01"
+    assert department_code("20000") == "2A"
+    assert department_code("20167") == "2A"
+    assert department_code("20200") == "2B"
+    assert department_code("20600") == "2B"
+    assert department_code("97400") == "974"
+    assert department_code("971 10") == "971"
+    assert department_code("98800") == "988"
+    assert department_code("") == "" and department_code("5") == ""
+
+
+def test_corsica_and_overseas_rules():
+    router = _router({"Corse": [20], "Sud": ["2a"], "Reunion": [974], "Guadeloupe": ["971"], "Ain": [1]})
+    assert router.assign(department_code("20000")) == ["Corse", "Sud"]
+    assert router.assign(department_code("20200")) == ["Corse"]
+    assert router.assign(department_code("97400")) == ["Reunion"]
+    assert router.assign("971") == ["Guadeloupe"]
+    assert router.assign("01") == ["Ain"]
+    assert router.assign("") == [] and router.assign("75") == []
+
+
+def test_daily_cap_release_and_persistence(tmp_path):
+    counts = str(tmp_path / "routing_counts.json")
+    rules = {"A": {"departments": [54], "daily_cap": 2}, "B": [54]}
+    router = _router(rules, counts_path=counts)
+    assert router.assign("54") == ["A", "B"]
+    assert router.assign("54") == ["A", "B"]
+    assert router.assign("54") == ["B"]
+    router.release(["A"])
+    # compteurs partagés avec un redémarrage
+    restarted = _router(rules, counts_path=counts)
+    assert restarted.assign("54") == ["A", "B"]
+    assert restarted.assign("54") == ["B"]
+
+
+def test_counts_reset_on_a_new_day():
+    router = _router({"A": {"departments": [54], "daily_cap": 1}})
+    assert router.assign("54") == ["A"]
+    assert router.assign("54") == []
+    router._day = "2000-01-01"
+    assert router.assign("54") == ["A"]
+
+
+def test_rules_are_reloaded_and_kept_on_error():
+    state = {"rules": {"A": [54]}}
+
+    def load():
+        if state["rules"] is None:
+            raise OSError("sheet indisponible")
+        return state["rules"]
+
+    router = LeadRouter(load, reload_seconds=0)
+    assert router.clients_for("54") == ("A",)
+    state["rules"] = {"B": [54, 55]}
+    assert router.clients_for("55") == ("B",)
+    state["rules"] = None
+    assert router.clients_for("54") == ("B",)
+
+
+def test_sheet_rules():
+    load = sheet_rules(lambda: [
+        ["client", "departements", "cap"],
+        ["A", "54, 55;57", "10"],
+        ["B", "2A", ""],
+        ["", "75", ""],
+    ])
+    assert load() == {"A": {"departments": ["54", " 55", "57"], "daily_cap": 10},
+                      "B": {"departments": ["2A"], "daily_cap": None}}
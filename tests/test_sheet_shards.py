@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from breaker import CircuitBreaker, CircuitOpen
+from fakes import FakeGspreadClient
+from sheets import SheetShards
+
+STRFTIME = time.strftime
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.entered = 0
+
+    def __enter__(self):
+        self.entered += 1
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _shards(tmp_path, client, **options):
+    def get_worksheet(tab):
+        sh = client.open_by_key("key")
+        return sh.worksheet(tab) if tab else sh.sheet1
+    return SheetShards(get_worksheet, str(tmp_path / "sheet_shards.json"), **options)
+
+
+def _month(monkeypatch, month):
+    fixed = time.strptime(month, "%Y-%m")
+    monkeypatch.setattr(time, "strftime", lambda fmt, t=None: STRFTIME(fmt, fixed))
+
+
+def test_single_mode_always_writes_to_sheet1(tmp_path):
+    client = FakeGspreadClient()
+    shards = _shards(tmp_path, client)
+    assert shards.active({"": 10 ** 6}) == ""
+    assert client.calls["add_worksheet"] == 0
+
+
+def test_month_mode_rolls_over_with_the_header(tmp_path, monkeypatch):
+    client = FakeGspreadClient()
+    shards = _shards(tmp_path, client, mode="month", prefix="Leads")
+    _month(monkeypatch, "2026-10")
+    assert shards.active({}) == "Leads 2026-10"
+    assert shards.active({}) == "Leads 2026-10"
+    _month(monkeypatch, "2026-11")
+    assert shards.active({}) == "Leads 2026-11"
+    assert shards.tabs() == ["", "Leads 2026-10", "Leads 2026-11"]
+    assert client.calls["add_worksheet"] == 2
+    assert client.spreadsheet.tabs["Leads 2026-11"].rows[0] == client.spreadsheet.sheet1.rows[0]
+
+
+def test_rows_mode_rolls_over_at_max_rows(tmp_path):
+    client = FakeGspreadClient()
+    shards = _shards(tmp_path, client, mode="rows", prefix="Leads", max_rows=10)
+    assert shards.active({"": 9}) == ""
+    assert shards.active({"": 10}) == "Leads 001"
+    assert shards.active({"": 10, "Leads 001": 9}) == "Leads 001"
+    assert shards.active({"": 10, "Leads 001": 10}) == "Leads 002"
+
+
+def test_catalog_is_shared_between_processes(tmp_path):
+    client = FakeGspreadClient()
+    leader = _shards(tmp_path, client, mode="rows", max_rows=1)
+    web = _shards(tmp_path, client, mode="rows", max_rows=1)
+    assert web.tabs() == [""]
+    leader.active({"": 1})
+    assert web.tabs() == ["", "Leads 001"]
+    [first, created] = web.catalog()
+    assert first == {"tab": "", "created_at": None} and created["created_at"]
+
+
+def test_lost_catalog_reuses_the_existing_tab(tmp_path):
+    client = FakeGspreadClient()
+    _shards(tmp_path, client, mode="rows", max_rows=1).active({"": 1})
+    (tmp_path / "sheet_shards.json").unlink()
+    assert _shards(tmp_path, client, mode="rows", max_rows=1).active({"": 1}) == "Leads 001"
+    assert len(client.spreadsheet.tabs) == 2
+
+
+def test_creation_goes_through_the_breaker_and_limiter(tmp_path):
+    client = FakeGspreadClient()
+    limiter = CountingLimiter()
+    breaker = CircuitBreaker("sheets", state_path=str(tmp_path / "breaker.json"), min_calls=1)
+    shards = _shards(tmp_path, client, mode="rows", max_rows=1, limiter=limiter, breaker=breaker)
+    assert shards.active({"": 1}) == "Leads 001"
+    assert limiter.entered == 1
+
+    with pytest.raises(RuntimeError):
+        with breaker:
+            raise RuntimeError("503")
+    with pytest.raises(CircuitOpen):
+        shards.active({"": 1, "Leads 001": 1})
+    assert client.calls["add_worksheet"] == 1
+    assert shards.tabs() == ["", "Leads 001"]
@@ -0,0 +1,78 @@
+from fakes import FakeGspreadClient
+from sheets import RED, RowRef, SheetsWriter
+
+
+def _writer(client, **options):
+    sh = client.open_by_key("key")
+    options.setdefault("window_seconds", 0.05)
+    return SheetsWriter(lambda tab: sh.worksheet(tab) if tab else sh.sheet1, **options)
+
+
+def _values(phone):
+    return ["Maison ✅", "Propriétaire ✅", "M", "Nom", "Prenom", phone]
+
+
+def test_one_batch_update_per_window_across_tabs():
+    client = FakeGspreadClient()
+    client.spreadsheet.add_worksheet("Leads 001", rows=1000, cols=15)
+    writer = _writer(client).start()
+    writes = [writer.submit(RowRef("", 2 + i), _values("+3361234567%d" % i)) for i in range(5)]
+    writes.append(writer.submit(RowRef("Leads 001", 2), _values("+33612345699"), red=True))
+    assert all(w.wait(2) for w in writes)
+    assert client.calls["batch_update"] == 1
+    assert client.spreadsheet.sheet1.rows[5][5] == "+33612345674"
+    assert client.spreadsheet.tabs["Leads 001"].rows[1][5] == "+33612345699"
+    writer.stop(2)
+
+
+def test_max_batch_splits_the_window():
+    client = FakeGspreadClient()
+    writer = _writer(client, max_batch=2).start()
+    writes = [writer.submit(RowRef("", 2 + i), _values("+3361234567%d" % i)) for i in range(5)]
+    assert all(w.wait(2) for w in writes)
+    assert client.calls["batch_update"] == 3
+    writer.stop(2)
+
+
+def test_rows_are_appended_by_chunks():
+    client = FakeGspreadClient()
+    sheet1 = client.spreadsheet.sheet1
+    writer = _writer(client, row_chunk=500)
+    reqs, row_count = writer._requests(sheet1, [writer.submit(RowRef("", 1001), _values("+33612345678"))])
+    [append] = [r["appendDimension"] for r in reqs if "appendDimension" in r]
+    assert append["length"] == 500 and row_count == 1500
+    # au-delà d'un paquet : juste ce qu'il faut
+    reqs, row_count = writer._requests(sheet1, [writer.submit(RowRef("", 2200), _values("+33612345678"))])
+    assert reqs[0]["appendDimension"]["length"] == 1200
+    reqs, _ = writer._requests(sheet1, [writer.submit(RowRef("", 1000), _values("+33612345678"))])
+    assert not any("appendDimension" in r for r in reqs)
+
+
+def test_known_row_count_avoids_appending_again():
+    client = FakeGspreadClient()
+    writer = _writer(client, row_chunk=100).start()
+    assert writer.submit(RowRef("", 1001), _values("+33612345678")).wait(2)
+    assert writer.submit(RowRef("", 1002), _values("+33612345679")).wait(2)
+    assert client.spreadsheet.sheet1.row_count == 1100
+    writer.stop(2)
+
+
+def test_status_update_paints_the_row():
+    client = FakeGspreadClient()
+    writer = _writer(client)
+    [repaint, status] = writer._requests(client.spreadsheet.sheet1,
+                                         [writer.submit_status(RowRef("", 3), "DÉSINSCRIT")])[0]
+    assert repaint["repeatCell"]["cell"]["userEnteredFormat"]["backgroundColor"] == RED
+    assert status["updateCells"]["rows"][0]["values"][0]["userEnteredValue"]["stringValue"] == "DÉSINSCRIT"
+
+
+def test_failed_batch_resolves_every_write_with_the_error():
+    client = FakeGspreadClient()
+    writer = _writer(client).start()
+    client.spreadsheet.faults.fail_rate = 1.0
+    writes = [writer.submit(RowRef("", 2 + i), _values("+3361234567%d" % i)) for i in range(3)]
+    assert not any(w.wait(2) for w in writes)
+    assert all(w.done() and "panne simulée" in w.error for w in writes)
+    writer.stop(2)
+    late = writer.submit(RowRef("", 9), _values("+33612345670"))
+    assert late.done() and late.error == "writer stopped"
@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+from fakes import Faults, FakeVonage
+from journal import SegmentedQueue
+from sms import SmsDispatcher, SmsStatusStore, vonage_signature, verify_vonage_signature
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def vonage():
+    server = FakeVonage().start()
+    yield server
+    server.stop()
+
+
+def _dispatcher(tmp_path, vonage, **options):
+    outbox = SegmentedQueue(str(tmp_path / "sms"), fsync="os")
+    store = SmsStatusStore(str(tmp_path / "sms_status.db"))
+    options.setdefault("senders", 1)
+    return SmsDispatcher(outbox, store, "key", "secret", base_url=vonage.base_url, rate=1000, **options)
+
+
+def test_message_is_sent_and_delivery_receipt_recorded(tmp_path, vonage):
+    dispatcher = _dispatcher(tmp_path, vonage).start()
+    sms_id = dispatcher.enqueue("+33612345678", "Bonjour")
+    assert _wait_for(lambda: dispatcher.status.get(sms_id)["status"] == "sent")
+    entry = dispatcher.status.get(sms_id)
+    assert entry["message_id"] == "fake-1" and "33612345678" in vonage.sent
+    assert dispatcher.delivery_receipt("fake-1", "delivered")
+    assert dispatcher.status.get(sms_id)["status"] == "delivered"
+    assert not dispatcher.delivery_receipt("unknown", "delivered")
+    dispatcher.stop(2)
+
+
+def test_throttled_message_is_handed_to_retry(tmp_path, vonage):
+    vonage.faults = Faults(fail_rate=1.0)
+    retried = []
+    dispatcher = _dispatcher(tmp_path, vonage, on_failure=lambda message, e: retried.append(message)).start()
+    sms_id = dispatcher.enqueue("+33612345678", "Bonjour")
+    assert _wait_for(lambda: len(retried) == 1)
+    assert dispatcher.status.get(sms_id)["status"] == "retrying"
+    dispatcher.stop(2)
+
+
+def test_status_write_failure_does_not_kill_the_sender(tmp_path, vonage, monkeypatch):
+    dispatcher = _dispatcher(tmp_path, vonage)
+    dispatcher.enqueue("+33612345678", "Un")
+    dispatcher.enqueue("+33612345679", "Deux")
+
+    def broken(sms_id, **fields):
+        raise OSError("database is locked")
+
+    monkeypatch.setattr(dispatcher.status, "update", broken)
+    dispatcher.start()
+    assert _wait_for(lambda: len(vonage.sent) == 2)
+    assert dispatcher._threads[0].is_alive()
+    dispatcher.stop(2)
+
+
+def test_message_goes_back_to_the_outbox_when_retry_fails(tmp_path, vonage):
+    vonage.faults = Faults(fail_rate=1.0)
+    attempts = []
+
+    def on_failure(message, e):
+        attempts.append(message["id"])
+        if len(attempts) == 1:
+            raise OSError("disk full")
+
+    dispatcher = _dispatcher(tmp_path, vonage, on_failure=on_failure).start()
+    sms_id = dispatcher.enqueue("+33612345678", "Bonjour")
+    assert _wait_for(lambda: len(attempts) == 2)
+    assert attempts == [sms_id, sms_id]
+    dispatcher.stop(2)
+
+
+def test_vonage_signature():
+    params = {"messageId": "abc", "status": "delivered", "timestamp": str(int(time.time()))}
+    for method in ("md5hash", "sha256"):
+        signed = dict(params, sig=vonage_signature(params, "s3cret", method))
+        assert verify_vonage_signature(signed, "s3cret", method)
+        assert not verify_vonage_signature(dict(signed, status="failed"), "s3cret", method)
+        assert not verify_vonage_signature(signed, "other", method)
+    stale = dict(params, timestamp=str(int(time.time()) - 3600))
+    assert not verify_vonage_signature(dict(stale, sig=vonage_signature(stale, "s3cret")), "s3cret")
+    assert not verify_vonage_signature({"messageId": "abc"}, "s3cret")
+
+
+def test_delivery_receipt_route_requires_authentication(app_module, monkeypatch):
+    client = app_module.app.test_client()
+    query = {"messageId": "unknown", "status": "delivered", "timestamp": str(int(time.time()))}
+    assert client.get("/vonage/dlr", query_string=query).status_code == 401
+
+    monkeypatch.setattr(app_module, "VONAGE_DLR_TOKEN", "dlr-token")
+    assert client.get("/vonage/dlr", query_string=dict(query, token="wrong")).status_code == 401
+    assert client.get("/vonage/dlr", query_string=dict(query, token="dlr-token")).status_code == 204
+
+    monkeypatch.setattr(app_module, "VONAGE_SIGNATURE_SECRET", "s3cret")
+    assert client.get("/vonage/dlr", query_string=dict(query, token="dlr-token")).status_code == 401
+    signed = dict(query, sig=vonage_signature(query, "s3cret"))
+    assert client.get("/vonage/dlr", query_string=signed).status_code == 204
@@ -0,0 +1,94 @@
+import hashlib
+import hmac
+import time
+
+from queue_backend import SqliteQueue
+from sms_events import FORWARD_KEY, SmsEventSink, SmsEventStore, event_record
+
+
+def _event(message_id, status, ts):
+    return event_record({"type": "delivery", "timestamp": ts}, {"message_id": message_id, "status": status},
+                        "2024-05-01T10:00:00Z")
+
+
+def _sink(tmp_path, forwarded):
+    source = SqliteQueue(str(tmp_path / "queues.db"), "sms_events", len_ttl=0)
+    store = SmsEventStore(str(tmp_path / "sms_events.db"))
+    return source, SmsEventSink(source, store, forward=forwarded.append)
+
+
+def _drain(source, sink):
+    batch = []
+    while True:
+        item = source.get()
+        if item is None:
+            break
+        batch.append(item)
+    return sink.flush(batch)
+
+
+def test_retried_events_are_forwarded_again(tmp_path):
+    forwarded = []
+    source, sink = _sink(tmp_path, forwarded)
+    event = _event("m1", "delivered", "1714557600")
+    source.put_many([event, event])   # rejeu du webhook
+    assert _drain(source, sink)
+    assert [r["message_id"] for r in forwarded] == ["m1"]
+
+    # échec Redshift puis retry : déjà dans le store, transmis quand même
+    source.put(dict(event, **{FORWARD_KEY: True}))
+    assert _drain(source, sink)
+    assert len(forwarded) == 2
+    assert len(source) == 0
+
+
+def test_status_index_keeps_the_latest_event(tmp_path):
+    store = SmsEventStore(str(tmp_path / "sms_events.db"))
+    delivered, sent = _event("m1", "delivered", "1714557700"), _event("m1", "sent", "1714557600")
+    # DLR dans le désordre : "sent" arrive après "delivered"
+    assert store.add_many([delivered]) == [delivered]
+    assert store.add_many([sent, delivered]) == [sent]
+    assert store.status("m1")["status"] == "delivered"
+    assert store.status("m1")["event_at"] == "1714557700"
+    assert store.status("unknown") is None
+
+
+def test_event_key_identifies_webhook_replays():
+    a = event_record({"type": "delivery", "timestamp": "1"}, {"message_id": "m1", "status": "sent"}, "t1")
+    b = event_record({"type": "delivery", "timestamp": "1"}, {"status": "sent", "message_id": "m1"}, "t2")
+    c = event_record({"type": "delivery", "timestamp": "2"}, {"message_id": "m1", "status": "sent"}, "t1")
+    assert a["key"] == b["key"] != c["key"]
+    assert event_record({"type": "delivery"}, {"smsId": 42}, "t")["message_id"] == "42"
+
+
+def _signed(app_module, timestamp):
+    message = f"{app_module.API_KEY}{timestamp}{app_module.WEBHOOK_SECRET}".encode()
+    signature = hmac.new(app_module.WEBHOOK_SECRET.encode(), message, hashlib.sha256).hexdigest()
+    return {"event": {"type": "delivery", "timestamp": timestamp, "signature": signature},
+            "data": {"message_id": "m-webhook", "status": "delivered"}}
+
+
+def test_webhook_checks_signature_and_replay_window(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "API_KEY", "senddo-key")
+    monkeypatch.setattr(app_module, "WEBHOOK_SECRET", "whsec")
+    client = app_module.app.test_client()
+    now = int(time.time())
+    before = len(app_module.sms_event_queue)
+
+    body = _signed(app_module, str(now))
+    body["event"]["signature"] = "0" * 64
+    assert client.post("/sms-webhook", json=body).status_code == 401
+    stale = _signed(app_module, str(now - app_module.SENDDO_REPLAY_WINDOW_SECONDS - 60))
+    assert client.post("/sms-webhook", json=stale).status_code == 401
+    assert client.post("/sms-webhook", json=_signed(app_module, "soon")).status_code == 400
+    assert len(app_module.sms_event_queue) == before
+
+    assert client.post("/sms-webhook", json=_signed(app_module, str(now))).status_code == 200
+    # timestamp en millisecondes
+    assert client.post("/sms-webhook", json=_signed(app_module, str(now * 1000))).status_code == 200
+    assert len(app_module.sms_event_queue) == before + 2
+
+    # secret absent : tout est refusé
+    body = _signed(app_module, str(now))
+    monkeypatch.setattr(app_module, "WEBHOOK_SECRET", None)
+    assert client.post("/sms-webhook", json=body).status_code == 401
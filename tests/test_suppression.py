@@ -0,0 +1,52 @@
+from suppression import BloomFilter, SuppressionList
+
+
+def _list(tmp_path, **options):
+    return SuppressionList(str(tmp_path / "suppression.db"), **options)
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    keys = ["+336%08d" % i for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum("+337%08d" % i in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_bloom_false_positive_falls_back_to_sqlite(tmp_path):
+    suppression = _list(tmp_path)
+    suppression.add("06 12 34 56 78")
+    # faux positif : le filtre répond "présent", la base fait foi
+    suppression._bloom.add("+33699999999")
+    assert not suppression.contains("0699999999")
+    assert suppression.stats()["false_positives"] == 1
+    assert suppression.contains("+33612345678")
+    assert suppression.stats()["false_positives"] == 1
+
+
+def test_additions_from_other_processes_are_seen(tmp_path):
+    web, leader = _list(tmp_path, refresh_seconds=0), _list(tmp_path, refresh_seconds=0)
+    assert not leader.contains("0612345678")
+    assert web.add("0612345678")
+    assert not web.add("+33612345678")
+    assert leader.contains("0612345678")
+
+
+def test_full_filter_is_rebuilt_larger(tmp_path):
+    writer, reader = _list(tmp_path, capacity=4), _list(tmp_path, capacity=4, refresh_seconds=0)
+    phones = ["06123456%02d" % i for i in range(10)]
+    assert writer.add_many(phones) == 10
+    assert all(reader.contains(p) for p in phones)
+    assert reader.capacity > 4
+
+
+def test_pending_sync_until_marked(tmp_path):
+    suppression = _list(tmp_path)
+    suppression.add_many(["0612345678", "0612345679"])
+    suppression.add_many(["0612345670"], synced=True)
+    assert suppression.pending_sync() == [("+33612345678", "0612345678"), ("+33612345679", "0612345679")]
+    suppression.mark_synced(["+33612345678"])
+    assert suppression.pending_sync() == [("+33612345679", "0612345679")]
+    assert len(suppression) == 3
@@ -0,0 +1,91 @@
+import queue
+import threading
+import time
+
+from workers import KeyedWorkerPool
+
+
+class Source:
+    def __init__(self, n):
+        self.items = queue.Queue()
+        for i in range(n):
+            self.items.put({"n": i})
+        self.taken = 0
+        self.acked = []
+
+    def get(self, timeout=None):
+        try:
+            item = self.items.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.taken += 1
+        return item
+
+    def ack(self, item):
+        self.acked.append(item["n"])
+
+
+class Deferred:
+    def __init__(self):
+        self._callbacks = []
+
+    def add_done_callback(self, fn):
+        self._callbacks.append(fn)
+
+    def finish(self):
+        for fn in self._callbacks:
+            fn(self)
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_busy_workers_stop_the_dispatcher():
+    source = Source(100)
+    release = threading.Event()
+    pool = KeyedWorkerPool(source.get, lambda item: release.wait(), lambda item: item["n"], workers=2,
+                           lane_capacity=1, ack=source.ack).start()
+    time.sleep(0.3)
+    # 1 élément en cours par worker + 1 par file + celui que le dispatcher tient
+    assert source.taken <= 2 * 2 + 1
+    release.set()
+    assert _wait_for(lambda: len(source.acked) == 100)
+    pool.stop(timeout=2)
+
+
+def test_stop_is_bounded_when_lanes_are_full():
+    source = Source(10)
+    pool = KeyedWorkerPool(source.get, lambda item: time.sleep(10), lambda item: 0, workers=1,
+                           lane_capacity=1, ack=source.ack).start()
+    time.sleep(0.2)
+    start = time.monotonic()
+    pool.stop(timeout=0.5)
+    assert time.monotonic() - start < 2
+
+
+def test_deferred_results_are_acked_when_done():
+    source = Source(3)
+    results = []
+
+    def handler(item):
+        d = Deferred()
+        results.append(d)
+        return d
+
+    pool = KeyedWorkerPool(source.get, handler, lambda item: item["n"], workers=2, ack=source.ack,
+                           max_in_flight=2).start()
+    assert _wait_for(lambda: len(results) == 2)
+    time.sleep(0.1)
+    # max_in_flight atteint : le 3e n'est pas lu tant qu'un résultat n'est pas terminé
+    assert source.taken == 2 and source.acked == [] and pool.in_flight() == 2
+    results[0].finish()
+    assert _wait_for(lambda: len(results) == 3)
+    for d in results[1:]:
+        d.finish()
+    assert _wait_for(lambda: sorted(source.acked) == [0, 1, 2])
+    assert pool.in_flight() == 0
+    pool.stop(timeout=2)
@@ -0,0 +1,64 @@
+import time
+from datetime import datetime, timedelta
+
+from fakes import FakeGspreadClient, FakeServiceError
+from sheets import WorksheetCache
+
+
+class TitleOnlyClient(FakeGspreadClient):
+    """open_by_key ne connaît que la vraie clé : un titre passe par la recherche Drive."""
+
+    def open_by_key(self, key: str):
+        if key != self.spreadsheet.id:
+            self.calls["open_by_key"] += 1
+            raise FakeServiceError(f"spreadsheet {key!r} not found")
+        return super().open_by_key(key)
+
+
+class FakeCreds:
+    def __init__(self, expires_in: float):
+        self.expiry = datetime.utcnow() + timedelta(seconds=expires_in)
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+
+
+def test_handles_are_cached_until_the_metadata_ttl():
+    client = FakeGspreadClient()
+    cache = WorksheetCache(client, metadata_ttl=0.1)
+    ws = cache.get("key")
+    assert cache.get("key") is ws
+    assert client.calls["open_by_key"] == 1
+    time.sleep(0.15)
+    cache.get("key")
+    assert client.calls["open_by_key"] == 2
+    cache.invalidate()
+    cache.get("key")
+    assert cache.stats() == {"hits": 1, "misses": 3, "token_refreshes": 0, "handles": 1}
+
+
+def test_title_is_searched_once_then_opened_by_key():
+    client = TitleOnlyClient()
+    client.spreadsheet.add_worksheet("Leads 001", rows=10, cols=15)
+    cache = WorksheetCache(client)
+    assert cache.get("Panneaux Solaires") is client.spreadsheet.sheet1
+    assert cache.get("Panneaux Solaires", "Leads 001").title == "Leads 001"
+    assert client.calls["open"] == 1
+    cache.invalidate()
+    cache.get("Panneaux Solaires")
+    assert client.calls["open"] == 1
+
+
+def test_token_is_refreshed_only_near_expiry():
+    client = FakeGspreadClient()
+    client.auth = FakeCreds(expires_in=3600)
+    cache = WorksheetCache(client, token_margin=300)
+    cache.get("key")
+    assert client.auth.refreshes == 0
+    client.auth = FakeCreds(expires_in=60)
+    cache.get("key")
+    cache.get("key")
+    assert client.auth.refreshes == 1
+    assert cache.stats()["token_refreshes"] == 1
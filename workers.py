@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import queue
+import threading
+import zlib
+
+
+# ============================================================
+# Pool de workers avec ordre garanti par clé (ex: téléphone)
+# ============================================================
+_STOP = object()
+
+
+class KeyedWorkerPool:
+    """
+    Un dispatcher lit la file durable (réveillé à l'enqueue, pas de polling)
+    et répartit les éléments sur `workers` files internes selon leur clé :
+    deux leads du même téléphone passent toujours par le même worker, donc
+    dans l'ordre. Les files internes ne gardent que `lane_capacity`
+    éléments : quand les workers sont occupés, le dispatcher attend au lieu
+    de sortir la file durable en mémoire. stop() arrête la lecture puis
+    laisse les workers vider les éléments déjà dispatchés (délai borné).
+    `ack(item)` est appelé après le handler,
+    ou, si le handler retourne un résultat différé (add_done_callback, ex:
+    écriture Sheets en attente de batch), quand ce résultat est terminé.
+    Au plus `max_in_flight` éléments lus et pas encore terminés (0 = sans limite).
+    """
+
+    def __init__(self, source_get, handler, key_fn, workers: int = 4, lane_capacity: int = 2, name: str = "pool",
+                 ack=None, max_in_flight: int = 0):
+        self._source_get = source_get
+        self._handler = handler
+        self._ack = ack
+        self._key_fn = key_fn
+        self.name = name
+        self._lanes = [queue.Queue(maxsize=lane_capacity) for _ in range(max(1, workers))]
+        self._slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self._stopping = threading.Event()
+        self._threads = []
+        self._dispatcher = None
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    def start(self):
+        if self._dispatcher is not None:
+            return self
+        for i, lane in enumerate(self._lanes):
+            t = threading.Thread(target=self._work, args=(lane,), name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        self._dispatcher = threading.Thread(target=self._dispatch, name=f"{self.name}-dispatch", daemon=True)
+        self._dispatcher.start()
+        return self
+
+    def _lane_for(self, item):
+        try:
+            key = str(self._key_fn(item) or "")
+        except Exception:
+            key = ""
+        return self._lanes[zlib.crc32(key.encode("utf-8")) % len(self._lanes)]
+
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            # trop d'éléments en cours : on ne lit plus la file
+            if self._slots is not None and not self._slots.acquire(timeout=1.0):
+                continue
+            try:
+                item = self._source_get(timeout=1.0)
+            except Exception as e:
+                print(f"❌ {self.name}: lecture de la file impossible:", str(e))
+                item = None
+                self._stopping.wait(1.0)
+            if item is None:
+                if self._slots is not None:
+                    self._slots.release()
+                continue
+            with self._in_flight_lock:
+                self._in_flight += 1
+            self._lane_for(item).put(item)
+
+    def _work(self, lane):
+        while True:
+            item = lane.get()
+            if item is _STOP:
+                return
+            try:
+                result = self._handler(item)
+            except Exception as e:
+                print(f"❌ {self.name}: erreur non gérée:", str(e))
+                result = None
+            if hasattr(result, "add_done_callback"):
+                result.add_done_callback(lambda _, item=item: self._done(item))
+            else:
+                self._done(item)
+
+    def _done(self, item):
+        try:
+            if self._ack is not None:
+                self._ack(item)
+        except Exception as e:
+            print(f"❌ {self.name}: ack impossible:", str(e))
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+            if self._slots is not None:
+                self._slots.release()
+
+    def in_flight(self) -> int:
+        """Éléments lus dans la file et pas encore terminés (dispatchés ou en attente d'écriture)."""
+        return self._in_flight
+
+    def stop(self, timeout: float = None):
+        """Arrêt propre : plus de lecture, puis drain des éléments en cours (au plus `timeout` en tout)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        self._stopping.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join(remaining())
+        for lane in self._lanes:
+            try:
+                lane.put(_STOP, timeout=remaining())
+            except queue.Full:
+                # worker bloqué : ses éléments non ack seront relus au redémarrage
+                print(f"⚠️ {self.name}: worker toujours occupé, arrêt sans drain")
+        for t in self._threads:
+            t.join(remaining())
+
+
+# ============================================================
+# Résultats de traitement attendus par un appelant (?wait=)
+# ============================================================
+class OutcomeRegistry:
+    """
+    expect(id) avant l'enqueue, resolve(id, result) depuis le worker,
+    wait(id, timeout) côté requête. Les ids non attendus sont ignorés.
+    Le worker peut tourner dans un autre process (leader) : l'attente et le
+    résultat passent alors par deux petits fichiers dans `directory`.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def expect(self, key: str):
+        with self._lock:
+            self._pending[key] = [threading.Event(), None]
+        open(self._path(key, "wait"), "w").close()
+
+    def resolve(self, key: str, result: dict):
+        if not key:
+            return
+        with self._lock:
+            slot = self._pending.get(key)
+            if slot is not None:
+                slot[1] = result
+        if slot is not None:
+            slot[0].set()
+            return
+        # attendu par un autre process ?
+        if os.path.exists(self._path(key, "wait")):
+            tmp = self._path(key, "tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+            os.replace(tmp, self._path(key, "json"))
+
+    def wait(self, key: str, timeout: float):
+        with self._lock:
+            slot = self._pending.get(key)
+        if slot is None:
+            return None
+        result = None
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                if slot[0].wait(min(0.05, max(0.0, deadline - time.monotonic()))):
+                    result = slot[1]
+                    break
+                try:
+                    with open(self._path(key, "json"), "r", encoding="utf-8") as f:
+                        result = json.load(f)
+                    break
+                except (FileNotFoundError, ValueError):
+                    pass
+                if time.monotonic() >= deadline:
+                    break
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            for ext in ("wait", "json"):
+                try:
+                    os.remove(self._path(key, ext))
+                except FileNotFoundError:
+                    pass
+        return result